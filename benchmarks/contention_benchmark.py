@@ -0,0 +1,82 @@
+import os
+import sys
+import tempfile
+from threading import Barrier, Thread
+from time import perf_counter
+
+from src.command_handler import handle_command
+from src.datastore import DataStore
+from src.persistence import AppendOnlyPersister
+from src.types import Array, BulkString
+
+THREAD_COUNTS = (1, 2, 4, 8)
+SHARD_COUNTS = (1, 16)
+OPERATIONS_PER_THREAD = 100000
+KEYSPACE = 10000
+
+
+def worker(datastore, keys, barrier):
+    barrier.wait()
+    for i, key in enumerate(keys):
+        if i & 1:
+            datastore[key] = b"value"
+        else:
+            try:
+                datastore[key]
+            except KeyError:
+                pass
+
+
+def command_worker(datastore, persister, keys, barrier):
+    # the server's path: dispatch, the command lock and the AOF buffer
+    commands = [
+        Array([BulkString(b"SET"), BulkString(key), BulkString(b"value")]) if i & 1
+        else Array([BulkString(b"GET"), BulkString(key)])
+        for i, key in enumerate(keys)
+    ]
+    barrier.wait()
+    for command in commands:
+        handle_command(command, datastore, persister)
+
+
+def run(shards, threads, persister=None):
+    datastore = DataStore(shards)
+    barrier = Barrier(threads + 1)
+    workers = [
+        Thread(
+            target=worker if persister is None else command_worker,
+            args=(datastore,) + (() if persister is None else (persister,)) + (
+                [b"key:%d" % ((t * 7919 + i) % KEYSPACE) for i in range(OPERATIONS_PER_THREAD)], barrier
+            ),
+        )
+        for t in range(threads)
+    ]
+    for thread in workers:
+        thread.start()
+    barrier.wait()
+    start = perf_counter()
+    for thread in workers:
+        thread.join()
+    return threads * OPERATIONS_PER_THREAD / (perf_counter() - start)
+
+
+def main():
+    gil_enabled = getattr(sys, "_is_gil_enabled", lambda: True)()
+    print(f"GIL enabled: {gil_enabled}")
+    print(
+        f"{'threads':>8}" + "".join(f"{f'{shards} shard(s) ops/s':>22}" for shards in SHARD_COUNTS)
+        + f"{'commands + AOF ops/s':>24}"
+    )
+    with tempfile.TemporaryDirectory() as directory:
+        persister = AppendOnlyPersister(os.path.join(directory, "contention.aof"), "no")
+        try:
+            for threads in THREAD_COUNTS:
+                rates = [run(shards, threads) for shards in SHARD_COUNTS]
+                rates.append(run(max(SHARD_COUNTS), threads, persister))
+                print(f"{threads:>8}" + "".join(f"{rate:>22,.0f}" for rate in rates[:-1]) + f"{rates[-1]:>24,.0f}")
+        finally:
+            persister.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+from time import perf_counter
+
+from src.command_handler import handle_command
+from src.datastore import DataStore
+from src.protocol_handler import RespParser, encode_message
+
+VALUE_SIZES = (1024, 100 * 1024)
+OPERATIONS = 20000
+KEYSPACE = 1000
+
+
+def command_frame(args):
+    parts = [b"*%d\r\n" % len(args)]
+    parts.extend(b"$%d\r\n%b\r\n" % (len(arg), arg) for arg in args)
+    return b"".join(parts)
+
+
+def run(frames, datastore):
+    parser = RespParser()
+    start = perf_counter()
+    for frame in frames:
+        parser.feed(frame)
+        command = parser.get_frame()
+        encode_message(handle_command(command, datastore))
+    return len(frames) / (perf_counter() - start)
+
+
+def main():
+    print(f"{'value size':>12}{'SET ops/s':>14}{'GET ops/s':>14}")
+    for size in VALUE_SIZES:
+        value = b"v" * size
+        keys = [b"key:%d" % (i % KEYSPACE) for i in range(OPERATIONS)]
+        datastore = DataStore()
+        set_rate = run([command_frame([b"SET", key, value]) for key in keys], datastore)
+        get_rate = run([command_frame([b"GET", key]) for key in keys], datastore)
+        print(f"{size:>12}{set_rate:>14,.0f}{get_rate:>14,.0f}")
+
+
+if __name__ == "__main__":
+    main()
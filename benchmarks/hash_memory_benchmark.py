@@ -0,0 +1,48 @@
+import sys
+import tracemalloc
+from time import perf_counter
+
+from src.datastore import DataStore
+
+DEFAULT_HASHES = 1_000_000
+FIELDS = [b"name", b"email", b"age", b"city", b"plan"]
+
+
+def measure(build, count):
+    tracemalloc.start()
+    start = perf_counter()
+    result = build(count)
+    elapsed = perf_counter() - start
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return size, elapsed
+
+
+def build_datastore(count):
+    datastore = DataStore()
+    for i in range(count):
+        datastore.hset(b"user:%d" % i, [(field, b"%b:%d" % (field, i)) for field in FIELDS])
+    return datastore
+
+
+def build_dict_of_dicts(count):
+    # the equivalent plain dict of dicts, keyed and valued the same way
+    return {
+        b"user:%d" % i: {field: b"%b:%d" % (field, i) for field in FIELDS}
+        for i in range(count)
+    }
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_HASHES
+    compact_size, compact_time = measure(build_datastore, count)
+    dict_size, dict_time = measure(build_dict_of_dicts, count)
+    print(f"hashes:          {count:,} x {len(FIELDS)} fields")
+    print(f"compact hashes:  {compact_size / 2**20:.1f} MB ({compact_size / count:.0f} B/hash, built in {compact_time:.2f}s)")
+    print(f"dict of dicts:   {dict_size / 2**20:.1f} MB ({dict_size / count:.0f} B/hash, built in {dict_time:.2f}s)")
+    print(f"saving:          {1 - compact_size / dict_size:.0%}")
+
+
+if __name__ == "__main__":
+    main()
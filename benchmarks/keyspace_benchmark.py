@@ -0,0 +1,39 @@
+import sys
+import tracemalloc
+from time import perf_counter
+
+from src.datastore import DataStore
+
+DEFAULT_KEYS = 10_000_000
+COUNTERS = 1000
+INCREMENTS = 1_000_000
+
+
+def main():
+    keys = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_KEYS
+    names = [b"key:%d" % i for i in range(keys)]
+
+    tracemalloc.start()
+    datastore = DataStore()
+    for i, name in enumerate(names):
+        datastore[name] = b"%d" % i if i & 1 else b"value:%d" % i
+    for i in range(0, keys, 10):
+        datastore.expire_at(names[i], 2**62)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    # key names were allocated beforehand, so this is the datastore's per
+    # key overhead plus the values
+    print(f"keys:      {keys:,} (half numeric, 10% with a TTL)")
+    print(f"keyspace:  {size / 2**20:.1f} MB ({size / keys:.1f} B/key)")
+    del datastore
+
+    datastore = DataStore()
+    counters = [b"counter:%d" % (i % COUNTERS) for i in range(INCREMENTS)]
+    start = perf_counter()
+    for counter in counters:
+        datastore.incr(counter)
+    print(f"INCR:      {INCREMENTS / (perf_counter() - start):,.0f} ops/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+from time import perf_counter
+
+from src.protocol_handler import RespParser, extract_frame_from_buffer
+
+SIZES = (100, 1000, 10000)
+REPEAT = 3
+
+
+def command_frame(args):
+    parts = [b"*%d\r\n" % len(args)]
+    parts.extend(b"$%d\r\n%b\r\n" % (len(arg), arg) for arg in args)
+    return b"".join(parts)
+
+
+def rpush_frame(count):
+    return command_frame([b"RPUSH", b"mylist"] + [f"element:{i}".encode() for i in range(count)])
+
+
+def mset_frame(count):
+    args = [b"MSET"]
+    for i in range(count):
+        args.extend((f"key:{i}".encode(), b"x" * 64))
+    return command_frame(args)
+
+
+def parse_with_extract(message):
+    frame, _ = extract_frame_from_buffer(bytearray(message))
+    return frame
+
+
+def parse_with_parser(message):
+    parser = RespParser()
+    parser.feed(message)
+    return parser.get_frame()
+
+
+def best_of(parse, message):
+    best = float('inf')
+    for _ in range(REPEAT):
+        start = perf_counter()
+        parse(message)
+        best = min(best, perf_counter() - start)
+    return best
+
+
+def main():
+    print(f"{'frame':<8}{'elements':>10}{'extract (ms)':>16}{'parser (ms)':>16}{'speedup':>10}")
+    for name, build in (("RPUSH", rpush_frame), ("MSET", mset_frame)):
+        for size in SIZES:
+            message = build(size)
+            assert parse_with_extract(message) == parse_with_parser(message)
+            old = best_of(parse_with_extract, message)
+            new = best_of(parse_with_parser, message)
+            print(f"{name:<8}{size:>10}{old * 1000:>16.2f}{new * 1000:>16.2f}{old / new:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+import random
+import sys
+import tracemalloc
+from time import perf_counter
+
+from src.datastore import DataStore
+
+DEFAULT_SETS = 10000
+SET_SIZE = 500
+
+
+def measure_memory(build):
+    tracemalloc.start()
+    result = build()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return size
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_SETS
+    random.seed(0)
+    ids = [[b"%d" % random.randrange(10**9) for _ in range(SET_SIZE)] for _ in range(count)]
+
+    def build_datastore():
+        datastore = DataStore()
+        for i, members in enumerate(ids):
+            datastore.sadd(b"ids:%d" % i, members)
+        return datastore
+
+    intset_size = measure_memory(build_datastore)
+    set_size = measure_memory(lambda: {b"ids:%d" % i: set(members) for i, members in enumerate(ids)})
+    print(f"{count:,} sets of {SET_SIZE} integer ids")
+    print(f"intsets:         {intset_size / 2**20:.1f} MB")
+    print(f"python sets:     {set_size / 2**20:.1f} MB ({1 - intset_size / set_size:.0%} saved)")
+
+    datastore = DataStore()
+    datastore.sadd(b"small", [b"%d" % i for i in range(0, 1000, 10)])
+    datastore.sadd(b"large", [b"%d" % i for i in range(1_000_000)])
+    start = perf_counter()
+    for _ in range(100):
+        datastore.sinter([b"large", b"small"])
+    print(f"SINTER 1M x 100: {(perf_counter() - start) * 10:.2f} ms/op")
+
+
+if __name__ == "__main__":
+    main()
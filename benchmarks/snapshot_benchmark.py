@@ -0,0 +1,46 @@
+import os
+import sys
+import tempfile
+from time import perf_counter
+
+from src.datastore import DataStore
+from src.persistence import restore_db
+from src.snapshot import load_snapshot, save_snapshot
+
+DEFAULT_KEYS = 1_000_000
+
+
+def command_frame(args):
+    parts = [b"*%d\r\n" % len(args)]
+    parts.extend(b"$%d\r\n%b\r\n" % (len(arg), arg) for arg in args)
+    return b"".join(parts)
+
+
+def main():
+    keys = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_KEYS
+    entries = [(b"key:%d" % i, b"value:%d" % i, 0) for i in range(keys)]
+    with tempfile.TemporaryDirectory() as directory:
+        aof_filename = os.path.join(directory, "bench.aof")
+        snapshot_filename = os.path.join(directory, "bench.rdb")
+        with open(aof_filename, "wb") as f:
+            for key, value, _ in entries:
+                f.write(command_frame([b"SET", key, value]))
+        save_snapshot(snapshot_filename, entries)
+        del entries
+
+        start = perf_counter()
+        restore_db(aof_filename, DataStore())
+        aof_time = perf_counter() - start
+
+        start = perf_counter()
+        load_snapshot(snapshot_filename, DataStore())
+        snapshot_time = perf_counter() - start
+
+        print(f"keys:          {keys:,}")
+        print(f"AOF replay:    {aof_time:.2f}s ({os.path.getsize(aof_filename) / 2**20:.1f} MB)")
+        print(f"snapshot load: {snapshot_time:.2f}s ({os.path.getsize(snapshot_filename) / 2**20:.1f} MB)")
+        print(f"speedup:       {aof_time / snapshot_time:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
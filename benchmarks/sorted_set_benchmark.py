@@ -0,0 +1,45 @@
+import random
+import sys
+from time import perf_counter
+
+from src.command_handler import handle_command
+from src.datastore import DataStore
+from src.types import Array, BulkString
+
+DEFAULT_MEMBERS = 1_000_000
+QUERIES = 10000
+
+
+def command(*args):
+    return Array([BulkString(arg) for arg in args])
+
+
+def timed(label, commands, datastore):
+    start = perf_counter()
+    for c in commands:
+        handle_command(c, datastore)
+    elapsed = perf_counter() - start
+    print(f"{label:<28}{len(commands) / elapsed:>12,.0f} ops/s {elapsed / len(commands) * 1e6:>8.1f} us/op")
+
+
+def main():
+    members = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_MEMBERS
+    random.seed(0)
+    datastore = DataStore()
+    print(f"members: {members:,}")
+    timed("ZADD", [command(b"ZADD", b"board", b"%d" % random.randrange(10**9), b"player:%d" % i) for i in range(members)], datastore)
+    players = [b"player:%d" % random.randrange(members) for _ in range(QUERIES)]
+    timed("ZSCORE", [command(b"ZSCORE", b"board", player) for player in players], datastore)
+    timed("ZRANK", [command(b"ZRANK", b"board", player) for player in players], datastore)
+    timed("ZINCRBY", [command(b"ZINCRBY", b"board", b"100", player) for player in players], datastore)
+    ranks = [random.randrange(members) for _ in range(QUERIES)]
+    timed("ZRANGE (10 members)", [command(b"ZRANGE", b"board", b"%d" % r, b"%d" % (r + 9)) for r in ranks], datastore)
+    timed("ZRANGEBYSCORE LIMIT 0 10", [
+        command(b"ZRANGEBYSCORE", b"board", b"%d" % s, b"+inf", b"LIMIT", b"0", b"10")
+        for s in (random.randrange(10**9) for _ in range(QUERIES))
+    ], datastore)
+    timed("ZREM", [command(b"ZREM", b"board", player) for player in players], datastore)
+
+
+if __name__ == "__main__":
+    main()
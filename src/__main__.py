@@ -1,33 +1,166 @@
+import resource
 import threading
 from time import sleep
 import typer
+from src.cluster import ClusterRouter, ClusterState, parse_node
 from src.datastore import DataStore
-from src.persistence import AppendOnlyPersister, restore_db
-from src.server import Server
+from src.eviction import MAXMEMORY_POLICIES, parse_memory
+from src.persistence import APPENDFSYNC_POLICIES, AppendOnlyPersister, restore_db
+from src.server import AsyncServer, Server
+from src.snapshot import SNAPSHOT_FILENAME
+from src.stats import SERVER_STATS, SLOW_LOG, SLOWLOG_LOG_SLOWER_THAN, SLOWLOG_MAX_LEN
+from src.workers import WorkerRouter, run_workers, serve_worker_socket, worker_socket_path
 
 REDIS_DEFAULT_PORT = 6380
+SERVER_ENGINES = ('threaded', 'asyncio')
+AOF_FILENAME = 'ccdb.aof'
 
 def check_expiry(datastore):
    while True:
       datastore.auto_check_expiry()
       sleep(0.1)
 
-def main(port=None):
+def raise_open_files_limit():
+   # every client holds a file descriptor, lift the soft limit as far as allowed
+   soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+   if soft != hard:
+      try:
+         resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+      except (ValueError, OSError):
+         pass
+
+def segment_filename(filename, worker_id):
+   # each worker persists its own partition: ccdb.aof -> ccdb-1.aof
+   base, extension = filename.rsplit('.', 1)
+   return f'{base}-{worker_id}.{extension}'
+
+def serve(port, engine, appendfsync, aof_filename, dbfilename, aof_load_truncated, maxmemory=(0, 'noeviction'), worker=None, cluster_nodes=None, replicaof=None):
+  datastore = DataStore()
+  if not restore_db(aof_filename, datastore, dbfilename, aof_load_truncated):
+     return -1
+  # applied after loading so the whole dataset is restored, like redis
+  datastore.set_maxmemory(*maxmemory)
+  persister = AppendOnlyPersister(aof_filename, appendfsync, datastore, dbfilename)
+  router = None
+  SERVER_STATS.set_server(port, engine, 'cluster' if cluster_nodes is not None else 'standalone')
+  if replicaof is not None:
+     persister.replication.replicate_from(replicaof, datastore, persister)
+  if worker is not None:
+     worker_id, worker_count = worker
+     serve_worker_socket(worker_socket_path(port, worker_id), datastore, persister)
+     router = WorkerRouter(worker_id, [worker_socket_path(port, i) for i in range(worker_count)])
+  elif cluster_nodes is not None:
+     router = ClusterRouter(ClusterState(('127.0.0.1', port), cluster_nodes), datastore)
+  if engine == 'asyncio':
+     raise_open_files_limit()
+     server = AsyncServer(port, datastore, persister, router, reuse_port=worker is not None)
+  else:
+     expiration_monitor = threading.Thread(target=check_expiry, args=(datastore,), daemon=True)
+     expiration_monitor.start()
+     server = Server(port, datastore, persister, router, reuse_port=worker is not None)
+  try:
+     server.run()
+  finally:
+     persister.close()
+
+def main(
+  port=None,
+  engine='threaded',
+  appendfsync='everysec',
+  dbfilename=SNAPSHOT_FILENAME,
+  aof_load_truncated: bool = False,
+  workers: int = 1,
+  cluster_nodes: str = None,
+  maxmemory='0',
+  maxmemory_policy='noeviction',
+  slowlog_log_slower_than: int = SLOWLOG_LOG_SLOWER_THAN,
+  slowlog_max_len: int = SLOWLOG_MAX_LEN,
+  replicaof: str = None,
+):
   if port == None:
     port = REDIS_DEFAULT_PORT
   else:
     port = int(port)
 
-  print(f"Starting PyRedis on port: {port}")
+  if engine not in SERVER_ENGINES:
+    print(f"Unknown engine '{engine}', expected one of: {', '.join(SERVER_ENGINES)}")
+    return -1
+  if appendfsync not in APPENDFSYNC_POLICIES:
+    print(f"Unknown appendfsync policy '{appendfsync}', expected one of: {', '.join(APPENDFSYNC_POLICIES)}")
+    return -1
+  if workers < 1:
+    print("--workers must be at least 1")
+    return -1
+  if maxmemory_policy not in MAXMEMORY_POLICIES:
+    print(f"Unknown maxmemory policy '{maxmemory_policy}', expected one of: {', '.join(MAXMEMORY_POLICIES)}")
+    return -1
+  try:
+    memory_limit = (parse_memory(maxmemory), maxmemory_policy)
+  except ValueError:
+    print(f"Invalid --maxmemory '{maxmemory}', expected a size such as 100mb or 2gb")
+    return -1
+  if slowlog_max_len < 0:
+    print("--slowlog-max-len must not be negative")
+    return -1
+  SLOW_LOG.configure(slowlog_log_slower_than, slowlog_max_len)
+  primary = None
+  if replicaof is not None:
+    if workers != 1 or cluster_nodes is not None:
+      print("--replicaof cannot be combined with --workers or --cluster-nodes")
+      return -1
+    try:
+      primary = parse_node(replicaof)
+    except ValueError:
+      print(f"Invalid --replicaof '{replicaof}', expected host:port")
+      return -1
 
-  datastore = DataStore()
-  if not restore_db('ccdb.aof', datastore):
-     return -1
-  persister = AppendOnlyPersister('ccdb.aof')
-  expiration_monitor = threading.Thread(target=check_expiry, args=(datastore,))
-  expiration_monitor.start()
-  server = Server(port, datastore, persister)
-  server.run()
+  if cluster_nodes is not None:
+    if workers != 1:
+      print("--cluster-nodes cannot be combined with --workers")
+      return -1
+    try:
+      nodes = [parse_node(node) for node in cluster_nodes.split(',')]
+    except ValueError:
+      print(f"Invalid --cluster-nodes '{cluster_nodes}', expected host:port,host:port,...")
+      return -1
+    if ('127.0.0.1', port) not in nodes:
+      print(f"Port {port} is not one of the --cluster-nodes")
+      return -1
+    print(f"Starting PyRedis on port: {port} ({engine} engine, cluster of {len(nodes)} nodes)")
+    # nodes usually share a working directory, so each keeps its own files
+    return serve(
+      port,
+      engine,
+      appendfsync,
+      segment_filename(AOF_FILENAME, port),
+      segment_filename(dbfilename, port),
+      aof_load_truncated,
+      memory_limit,
+      cluster_nodes=nodes,
+    )
+
+  if workers == 1:
+    if primary is not None:
+      print(f"Starting PyRedis on port: {port} ({engine} engine, replica of {replicaof})")
+    else:
+      print(f"Starting PyRedis on port: {port} ({engine} engine)")
+    return serve(
+      port, engine, appendfsync, AOF_FILENAME, dbfilename, aof_load_truncated, memory_limit, replicaof=primary
+    )
+
+  print(f"Starting PyRedis on port: {port} ({engine} engine, {workers} workers)")
+  # the limit bounds the whole machine, so every worker gets an equal part
+  worker_memory_limit = (memory_limit[0] // workers, memory_limit[1])
+  run_workers(workers, lambda worker_id: serve(
+     port,
+     engine,
+     appendfsync,
+     segment_filename(AOF_FILENAME, worker_id),
+     segment_filename(dbfilename, worker_id),
+     aof_load_truncated,
+     worker_memory_limit,
+     (worker_id, workers),
+  ))
 
 if __name__ == "__main__":
     typer.run(main)
@@ -0,0 +1,244 @@
+import asyncio
+import json
+import random
+from time import perf_counter_ns
+
+import typer
+from typing_extensions import Annotated
+
+from src.command_handler import handle_command
+from src.datastore import DataStore
+from src.protocol_handler import RespParser, encode_message
+from src.types import Array, BulkString, Error
+
+DEFAULT_PORT = 6380
+DEFAULT_SERVER = "127.0.0.1"
+RECV_SIZE = 64 * 1024
+# requests cycle through a pool of pre-encoded commands so generating the
+# load costs the client as little as possible
+COMMAND_POOL_SIZE = 10000
+LRANGE_COUNT = 100
+BENCHMARK_COMMANDS = ('get', 'set', 'incr', 'lpush', 'lrange')
+PERCENTILES = (('p50', 0.5), ('p99', 0.99), ('p999', 0.999))
+NS_PER_MS = 10**6
+NS_PER_SECOND = 10**9
+
+
+def _command(*args):
+    return Array([BulkString(arg) for arg in args])
+
+def build_command(name, key, value):
+    # each command type has its own key prefix so INCR never meets a
+    # non-numeric SET value and lists never collide with strings
+    match name:
+        case 'get':
+            return _command(b'GET', b'key:%d' % key)
+        case 'set':
+            return _command(b'SET', b'key:%d' % key, value)
+        case 'incr':
+            return _command(b'INCR', b'counter:%d' % key)
+        case 'lpush':
+            return _command(b'LPUSH', b'list:%d' % key, value)
+        case 'lrange':
+            return _command(b'LRANGE', b'list:%d' % key, b'0', b'%d' % (LRANGE_COUNT - 1))
+    raise ValueError(f'unknown benchmark command {name!r}')
+
+def parse_mix(mix):
+    # "get:3,set:1" -> [('get', 3), ('set', 1)], the weight defaults to 1
+    result = []
+    for item in mix.split(','):
+        name, _, weight = item.strip().lower().partition(':')
+        if name not in BENCHMARK_COMMANDS:
+            raise ValueError(f'unknown benchmark command {name!r}')
+        weight = int(weight) if weight else 1
+        if weight <= 0:
+            raise ValueError(f'weight of {name!r} must be positive')
+        result.append((name, weight))
+    return result
+
+def command_pool(mix, keyspace, value_size, seed=None):
+    rng = random.Random(seed)
+    names = [name for name, _ in mix]
+    weights = [weight for _, weight in mix]
+    value = b'x' * value_size
+    return [
+        (name, encode_message(build_command(name, rng.randrange(keyspace), value)))
+        for name in rng.choices(names, weights, k=COMMAND_POOL_SIZE)
+    ]
+
+def percentile(latencies, fraction):
+    # latencies must be sorted
+    return latencies[min(int(len(latencies) * fraction), len(latencies) - 1)]
+
+class Results:
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+
+    def record(self, name, latency_ns, failed):
+        latencies = self.latencies.get(name)
+        if latencies is None:
+            latencies = self.latencies[name] = []
+            self.errors[name] = 0
+        latencies.append(latency_ns)
+        if failed:
+            self.errors[name] += 1
+
+    def _summary(self, latencies, errors, elapsed_ns):
+        latencies = sorted(latencies)
+        summary = {
+            'requests': len(latencies),
+            'errors': errors,
+            'ops_per_sec': round(len(latencies) * NS_PER_SECOND / elapsed_ns, 1),
+        }
+        for label, fraction in PERCENTILES:
+            summary[f'{label}_ms'] = round(percentile(latencies, fraction) / NS_PER_MS, 3)
+        summary['max_ms'] = round(latencies[-1] / NS_PER_MS, 3)
+        return summary
+
+    def summary(self, elapsed_ns):
+        commands = {
+            name.upper(): self._summary(latencies, self.errors[name], elapsed_ns)
+            for name, latencies in sorted(self.latencies.items())
+        }
+        everything = [latency for latencies in self.latencies.values() for latency in latencies]
+        return {
+            'seconds': round(elapsed_ns / NS_PER_SECOND, 3),
+            'total': self._summary(everything, sum(self.errors.values()), elapsed_ns),
+            'commands': commands,
+        }
+
+# Requests still to be sent, shared by every client coroutine of a run.
+class Workload:
+    def __init__(self, requests):
+        self.remaining = requests
+
+    def take(self, count):
+        count = min(count, self.remaining)
+        self.remaining -= count
+        return count
+
+async def _run_client(host, port, pool, offset, pipeline, workload, results):
+    reader, writer = await asyncio.open_connection(host, port)
+    parser = RespParser()
+    index = offset
+    try:
+        while True:
+            count = workload.take(pipeline)
+            if not count:
+                break
+            batch = [pool[(index + i) % len(pool)] for i in range(count)]
+            index += count
+            sent = perf_counter_ns()
+            writer.write(b''.join(frame for _, frame in batch))
+            # every reply's latency is measured from the moment its whole
+            # pipeline was sent, as redis-benchmark does
+            for name, _ in batch:
+                reply = parser.get_frame()
+                while reply is None:
+                    data = await reader.read(RECV_SIZE)
+                    if not data:
+                        raise ConnectionError('server closed the connection')
+                    parser.feed(data)
+                    reply = parser.get_frame()
+                results.record(name, perf_counter_ns() - sent, isinstance(reply, Error))
+    finally:
+        writer.close()
+
+async def _run_network(host, port, pool, clients, pipeline, requests):
+    workload = Workload(requests)
+    results = Results()
+    start = perf_counter_ns()
+    # clients start at different points of the pool so they do not all hit
+    # the same keys in lockstep
+    await asyncio.gather(*(
+        _run_client(host, port, pool, i * len(pool) // clients, pipeline, workload, results)
+        for i in range(clients)
+    ))
+    return results, perf_counter_ns() - start
+
+def run_network(host, port, pool, clients, pipeline, requests):
+    return asyncio.run(_run_network(host, port, pool, clients, pipeline, requests))
+
+def run_in_process(pool, pipeline, requests, datastore=None):
+    # the server side cost alone: parsing, dispatch and reply encoding,
+    # pipelined the same way the network clients send commands
+    datastore = DataStore() if datastore is None else datastore
+    parser = RespParser()
+    results = Results()
+    index = 0
+    start = perf_counter_ns()
+    while index < requests:
+        batch = [pool[(index + i) % len(pool)] for i in range(min(pipeline, requests - index))]
+        index += len(batch)
+        parser.feed(b''.join(frame for _, frame in batch))
+        for name, _ in batch:
+            command_start = perf_counter_ns()
+            reply = handle_command(parser.get_frame(), datastore)
+            encode_message(reply)
+            results.record(name, perf_counter_ns() - command_start, isinstance(reply, Error))
+    return results, perf_counter_ns() - start
+
+def print_summary(summary):
+    print(f"{'command':<10}{'requests':>10}{'errors':>8}{'ops/s':>12}{'p50 ms':>10}{'p99 ms':>10}{'p99.9 ms':>10}{'max ms':>10}")
+    rows = list(summary['commands'].items())
+    if len(rows) > 1:
+        rows.append(('total', summary['total']))
+    for name, stats in rows:
+        print(
+            f"{name:<10}{stats['requests']:>10}{stats['errors']:>8}{stats['ops_per_sec']:>12,.0f}"
+            f"{stats['p50_ms']:>10.3f}{stats['p99_ms']:>10.3f}{stats['p999_ms']:>10.3f}{stats['max_ms']:>10.3f}"
+        )
+    print(f"{summary['total']['requests']} requests in {summary['seconds']} s")
+
+def main(
+    server: Annotated[str, typer.Argument()] = DEFAULT_SERVER,
+    port: Annotated[int, typer.Argument()] = DEFAULT_PORT,
+    clients: int = 50,
+    requests: int = 100000,
+    pipeline: int = 1,
+    keyspace: int = 10000,
+    value_size: int = 64,
+    mix: str = 'get:1,set:1',
+    seed: int = None,
+    in_process: bool = False,
+    json_output: Annotated[bool, typer.Option('--json')] = False,
+):
+    if min(clients, requests, pipeline, keyspace) < 1:
+        print("--clients, --requests, --pipeline and --keyspace must be at least 1")
+        return -1
+    if value_size < 0:
+        print("--value-size must not be negative")
+        return -1
+    try:
+        parsed_mix = parse_mix(mix)
+    except ValueError as e:
+        print(f"Invalid --mix '{mix}': {e}, expected e.g. get:3,set:1 from {', '.join(BENCHMARK_COMMANDS)}")
+        return -1
+    pool = command_pool(parsed_mix, keyspace, value_size, seed)
+    if in_process:
+        results, elapsed = run_in_process(pool, pipeline, requests)
+    else:
+        try:
+            results, elapsed = run_network(server, port, pool, clients, pipeline, requests)
+        except OSError as e:
+            print(f"Could not benchmark {server}:{port}: {e}")
+            return -1
+    summary = results.summary(elapsed)
+    if json_output:
+        config = {
+            'mode': 'in-process' if in_process else 'network',
+            'server': None if in_process else f'{server}:{port}',
+            'clients': 1 if in_process else clients,
+            'requests': requests,
+            'pipeline': pipeline,
+            'keyspace': keyspace,
+            'value_size': value_size,
+            'mix': dict(parsed_mix),
+        }
+        print(json.dumps({'config': config, **summary}, indent=2))
+    else:
+        print_summary(summary)
+
+if __name__ == "__main__":
+    typer.run(main)
@@ -1,49 +1,122 @@
-import socket
+import sys
+from itertools import chain
 
 import typer
 from typing_extensions import Annotated
 
-from src.protocol_handler import encode_message, extract_frame_from_buffer
-from src.types import SimpleString, Array, BulkString
+from src.client import DEFAULT_PORT, RECV_SIZE, Client, ReplyError
+from src.protocol_handler import ProtocolError, RespParser
+from src.types import Array, BulkString
 
 
-DEFAULT_PORT = 6380
 DEFAULT_SERVER = "127.0.0.1"
-RECV_SIZE = 1024
+# commands sent per round trip in --pipe mode
+PIPE_BATCH_SIZE = 1000
 
 
 def encode_command(command):
-    return Array([BulkString(p) for p in command.split()])
+    return Array([BulkString(p.encode()) for p in command.split()])
+
+def print_reply(frame, indent=''):
+    if not isinstance(frame, Array):
+        print(f'{indent}{frame.as_str()}')
+        return
+    for count, item in enumerate(frame.data or []):
+        if isinstance(item, Array):
+            print(f'{indent}{count + 1}:')
+            print_reply(item, indent + '   ')
+        else:
+            print(f'{indent}{count + 1}: {item.as_str()}')
+
+def read_commands(stream):
+    # like redis-cli --pipe: raw RESP on stdin, or else one inline command
+    # per line
+    chunks = iter(lambda: stream.read(RECV_SIZE), b'')
+    first = next(chunks, b'')
+    chunks = chain([first], chunks)
+    if first.startswith(b'*'):
+        parser = RespParser()
+        for chunk in chunks:
+            parser.feed(chunk)
+            frame = parser.get_frame()
+            while frame is not None:
+                yield [item.data for item in frame]
+                frame = parser.get_frame()
+        if parser.in_partial_frame():
+            raise ProtocolError('input ends with an incomplete command')
+        return
+    pending = b''
+    for chunk in chunks:
+        lines = (pending + chunk).split(b'\n')
+        pending = lines.pop()
+        for line in lines:
+            if line.strip():
+                yield line.split()
+    if pending.strip():
+        yield pending.split()
+
+def run_pipe(client, stream, batch_size=PIPE_BATCH_SIZE):
+    # streams commands from stream in pipelined batches; returns the number
+    # of replies and of error replies
+    replies = errors = 0
+    pipeline = client.pipeline()
+    commands = read_commands(stream)
+    while True:
+        for command in commands:
+            pipeline.command(*command)
+            if len(pipeline) == batch_size:
+                break
+        if not len(pipeline):
+            return replies, errors
+        for value in pipeline.execute():
+            replies += 1
+            if isinstance(value, ReplyError):
+                errors += 1
+                print(value, file=sys.stderr)
+
+def run_subscription(client, command):
+    # like redis-cli, SUBSCRIBE / PSUBSCRIBE print messages until Ctrl-C
+    kind, *names = command.split()
+    with client.subscription() as subscription:
+        if kind.lower() == 'subscribe':
+            subscription.subscribe(*names)
+        else:
+            subscription.psubscribe(*names)
+        print('Reading messages... (press Ctrl-C to quit)')
+        try:
+            while True:
+                print_reply(subscription.read_reply())
+        except KeyboardInterrupt:
+            print()
 
 def main(
     server: Annotated[str, typer.Argument()] = DEFAULT_SERVER,
     port: Annotated[int, typer.Argument()] = DEFAULT_PORT,
+    pipe: bool = False,
 ):
-    with socket.socket() as client_socket:
-        client_socket.connect((server, port))
-
-        buffer = bytearray()
-
+    with Client(server, port) as client:
+        if pipe:
+            try:
+                replies, errors = run_pipe(client, sys.stdin.buffer)
+            except (OSError, ProtocolError) as e:
+                print(f'Error: {e}', file=sys.stderr)
+                raise typer.Exit(1)
+            print(f'errors: {errors}, replies: {replies}')
+            raise typer.Exit(1 if errors else 0)
         while True:
-            command = input(f'{server}:{port}>')
+            host, port = client.address
+            command = input(f'{host}:{port}>')
             if command == 'quit' or command == 'q':
                 break
-            else:
-                encoded_message = encode_message(encode_command(command))
-                client_socket.send(encoded_message)
-
-                while True:
-                    data = client_socket.recv(RECV_SIZE)
-                    buffer.extend(data)
-                    frame, frame_size = extract_frame_from_buffer(buffer)
-                    if frame:
-                        buffer = buffer[frame_size:]
-                        if isinstance(frame, Array):
-                            for count, item in enumerate(frame.data):
-                                print(f'{count + 1}: {item.as_str()}')
-                        else:
-                            print(frame.as_str())
-                        break
+            if not command.strip():
+                continue
+            try:
+                if command.split()[0].lower() in ('subscribe', 'psubscribe'):
+                    run_subscription(client, command)
+                    continue
+                print_reply(client.request(encode_command(command)))
+            except OSError as e:
+                print(f'Could not reach {host}:{port}: {e}')
 
 if __name__ == "__main__":
     typer.run(main)
@@ -0,0 +1,295 @@
+import socket
+import threading
+from contextlib import contextmanager
+
+from src.protocol_handler import RespParser, encode_message
+from src.types import Array, BulkString, Error, Integer
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 6380
+RECV_SIZE = 64 * 1024
+DEFAULT_MAX_CONNECTIONS = 50
+MAX_REDIRECTS = 5
+
+
+class ReplyError(Exception):
+    pass
+
+
+def encode_arg(arg):
+    if isinstance(arg, bytes):
+        return arg
+    if isinstance(arg, str):
+        return arg.encode()
+    return str(arg).encode()
+
+def build_command(*args):
+    return Array([BulkString(encode_arg(arg)) for arg in args])
+
+def reply_value(frame):
+    # RESP frame -> Python value; error replies become ReplyError instances
+    # so a pipeline can return them alongside the other results
+    if isinstance(frame, Error):
+        return ReplyError(frame.data)
+    if isinstance(frame, Array):
+        return None if frame.data is None else [reply_value(item) for item in frame.data]
+    if isinstance(frame, Integer):
+        return frame.value
+    return frame.data
+
+def parse_redirect(frame):
+    # "MOVED 3999 127.0.0.1:7001" / "ASK 3999 127.0.0.1:7001" -> kind, (host, port)
+    if not isinstance(frame, Error):
+        return None
+    parts = frame.data.split()
+    if len(parts) != 3 or parts[0] not in ('MOVED', 'ASK'):
+        return None
+    host, _, port = parts[2].rpartition(':')
+    return parts[0], (host, int(port))
+
+
+# One socket to the server. It connects lazily and sends a batch of commands
+# in a single write, then parses all their replies from one buffer.
+class Connection:
+    def __init__(self, host, port, timeout=None):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self._socket = None
+        self._parser = None
+
+    def _connect(self):
+        self._socket = socket.create_connection((self.host, self.port), self.timeout)
+        self._socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._parser = RespParser()
+
+    def send(self, messages):
+        # writes without waiting for replies, for subscriber connections
+        if self._socket is None:
+            self._connect()
+        self._socket.sendall(b''.join(encode_message(message) for message in messages))
+
+    def read_reply(self, timeout=None):
+        # the next reply or message, None when none arrives within timeout
+        if self._socket is None:
+            self._connect()
+        self._socket.settimeout(timeout)
+        try:
+            return self._read_replies(1)[0]
+        except TimeoutError:
+            return None
+        finally:
+            if self._socket is not None:
+                self._socket.settimeout(self.timeout)
+
+    def request(self, messages):
+        data = b''.join(encode_message(message) for message in messages)
+        # a connection that sat idle may have been dropped by the server
+        # (restart, idle timeout); retry once on a fresh socket in that case
+        while True:
+            fresh = self._socket is None
+            try:
+                if fresh:
+                    self._connect()
+                self._socket.sendall(data)
+                return self._read_replies(len(messages))
+            except TimeoutError:
+                self.close()
+                raise
+            except OSError:
+                self.close()
+                if fresh:
+                    raise
+            except BaseException:
+                # replies still in flight would be read by the next request
+                self.close()
+                raise
+
+    def _read_replies(self, count):
+        replies = []
+        parser = self._parser
+        while len(replies) < count:
+            reply = parser.get_frame()
+            if reply is not None:
+                replies.append(reply)
+                continue
+            data = self._socket.recv(RECV_SIZE)
+            if not data:
+                raise ConnectionError('server closed the connection')
+            parser.feed(data)
+        return replies
+
+    def close(self):
+        if self._socket is not None:
+            self._socket.close()
+        self._socket = self._parser = None
+
+
+# Thread-safe pool of connections to one server. At most max_connections
+# are open at once; callers beyond that wait for one to be released.
+class ConnectionPool:
+    def __init__(self, host, port, max_connections=DEFAULT_MAX_CONNECTIONS, timeout=None):
+        self.host = host
+        self.port = port
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self._idle = []
+        self._created = 0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        with self._condition:
+            while not self._idle and self._created >= self.max_connections:
+                self._condition.wait()
+            if self._idle:
+                return self._idle.pop()
+            self._created += 1
+        return Connection(self.host, self.port, self.timeout)
+
+    def release(self, connection):
+        with self._condition:
+            self._idle.append(connection)
+            self._condition.notify()
+
+    @contextmanager
+    def connection(self):
+        connection = self.acquire()
+        try:
+            yield connection
+        finally:
+            self.release(connection)
+
+    def request(self, messages):
+        with self.connection() as connection:
+            return connection.request(messages)
+
+    def close(self):
+        with self._condition:
+            for connection in self._idle:
+                connection.close()
+
+
+# Client for applications and src.cli. Commands go through a pool per
+# server; MOVED moves the client to the new owner for good and ASK retries
+# once on the importing node, as cluster clients do.
+class Client:
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT, max_connections=DEFAULT_MAX_CONNECTIONS, timeout=None):
+        self.address = (host, port)
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self._pools = {}
+        self._pools_lock = threading.Lock()
+
+    def pool(self, address=None):
+        address = address or self.address
+        with self._pools_lock:
+            pool = self._pools.get(address)
+            if pool is None:
+                pool = self._pools[address] = ConnectionPool(*address, self.max_connections, self.timeout)
+            return pool
+
+    def request(self, message):
+        # sends one command frame and returns the reply frame
+        reply = self.pool().request([message])[0]
+        for _ in range(MAX_REDIRECTS):
+            redirect = parse_redirect(reply)
+            if redirect is None:
+                break
+            kind, address = redirect
+            if kind == 'MOVED':
+                self.address = address
+                reply = self.pool().request([message])[0]
+            else:
+                reply = self.pool(address).request([Array([BulkString(b'ASKING')]), message])[1]
+        return reply
+
+    def execute(self, *args):
+        value = reply_value(self.request(build_command(*args)))
+        if isinstance(value, ReplyError):
+            raise value
+        return value
+
+    def pipeline(self):
+        return Pipeline(self)
+
+    def subscription(self):
+        return Subscription(self)
+
+    def close(self):
+        with self._pools_lock:
+            for pool in self._pools.values():
+                pool.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+# Commands queued here are sent together when execute is called: one write
+# and one round trip for the whole batch, on one connection of the client's
+# current server. Redirects are not followed inside a pipeline.
+class Pipeline:
+    def __init__(self, client):
+        self._client = client
+        self._commands = []
+
+    def command(self, *args):
+        self._commands.append(build_command(*args))
+        return self
+
+    def __len__(self):
+        return len(self._commands)
+
+    def execute(self):
+        # returns one value per command, failed commands as ReplyError
+        if not self._commands:
+            return []
+        commands, self._commands = self._commands, []
+        return [reply_value(reply) for reply in self._client.pool().request(commands)]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self._commands = []
+
+
+# A connection of its own in subscriber mode. Subscription confirmations and
+# messages are read in arrival order with get_message, as lists like
+# [b'subscribe', channel, count], [b'message', channel, data] and
+# [b'pmessage', pattern, channel, data].
+class Subscription:
+    def __init__(self, client):
+        host, port = client.address
+        self._connection = Connection(host, port, client.timeout)
+
+    def subscribe(self, *channels):
+        self._connection.send([build_command('SUBSCRIBE', *channels)])
+
+    def psubscribe(self, *patterns):
+        self._connection.send([build_command('PSUBSCRIBE', *patterns)])
+
+    def unsubscribe(self, *channels):
+        self._connection.send([build_command('UNSUBSCRIBE', *channels)])
+
+    def punsubscribe(self, *patterns):
+        self._connection.send([build_command('PUNSUBSCRIBE', *patterns)])
+
+    def read_reply(self, timeout=None):
+        # the next frame as sent by the server
+        return self._connection.read_reply(timeout)
+
+    def get_message(self, timeout=None):
+        reply = self.read_reply(timeout)
+        return None if reply is None else reply_value(reply)
+
+    def close(self):
+        self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
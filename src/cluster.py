@@ -0,0 +1,148 @@
+from threading import Lock
+
+from src.command_handler import lookup_command
+from src.hashslot import HASH_SLOTS, key_hash_slot
+from src.types import Array, BulkString, Error, Integer, SimpleString
+
+CLUSTER_HOST = '127.0.0.1'
+
+
+def parse_node(address):
+    host, _, port = address.strip().rpartition(':')
+    if host in ('', 'localhost'):
+        host = CLUSTER_HOST
+    return host, int(port)
+
+
+def format_node(node):
+    return f'{node[0]}:{node[1]}'
+
+
+# Slot ownership of a cluster started from a static node list: the 16384
+# slots are split into equal contiguous ranges in list order. Ownership can
+# then be changed at runtime with CLUSTER SETSLOT, which is how slots are
+# migrated between nodes.
+class ClusterState:
+    def __init__(self, myself, nodes):
+        if myself not in nodes:
+            raise ValueError(f'{format_node(myself)} is not in the cluster node list')
+        self.myself = myself
+        self.slots = [nodes[slot * len(nodes) // HASH_SLOTS] for slot in range(HASH_SLOTS)]
+        self.migrating = {}
+        self.importing = {}
+        self._lock = Lock()
+
+    def slot_ranges(self):
+        ranges = []
+        start = 0
+        for slot in range(1, HASH_SLOTS + 1):
+            if slot == HASH_SLOTS or self.slots[slot] != self.slots[start]:
+                ranges.append((start, slot - 1, self.slots[start]))
+                start = slot
+        return ranges
+
+    def set_slot(self, slot, state, node):
+        with self._lock:
+            match state:
+                case b'MIGRATING':
+                    if self.slots[slot] != self.myself:
+                        return Error("ERR I'm not the owner of hash slot %d" % slot)
+                    self.migrating[slot] = node
+                case b'IMPORTING':
+                    if self.slots[slot] == self.myself:
+                        return Error("ERR I'm already the owner of hash slot %d" % slot)
+                    self.importing[slot] = node
+                case b'NODE':
+                    self.slots[slot] = node
+                    self.migrating.pop(slot, None)
+                    self.importing.pop(slot, None)
+                case b'STABLE':
+                    self.migrating.pop(slot, None)
+                    self.importing.pop(slot, None)
+                case _:
+                    return Error('ERR Invalid CLUSTER SETSLOT action or number of arguments')
+        return SimpleString('OK')
+
+
+# Answers CLUSTER commands and redirects key based commands for slots this
+# node does not serve, the same way WorkerRouter forwards them.
+class ClusterRouter:
+    def __init__(self, state, datastore):
+        self._state = state
+        self._datastore = datastore
+        datastore.index_slots()
+
+    def route(self, command, client):
+        name = command[0].data.upper()
+        if name == b'ASKING':
+            client.asking = True
+            return SimpleString('OK')
+        asking, client.asking = client.asking, False
+        if name == b'CLUSTER':
+            return self._handle_cluster(command)
+
+        spec = lookup_command(command[0].data)
+        if spec is None or not spec.check_arity(len(command)):
+            return None
+        keys = spec.keys(command)
+        if not keys:
+            return None
+        slots = {key_hash_slot(key) for key in keys}
+        if len(slots) > 1:
+            return Error("CROSSSLOT Keys in request don't hash to the same slot")
+        slot = slots.pop()
+        state = self._state
+        owner = state.slots[slot]
+        if owner == state.myself:
+            target = state.migrating.get(slot)
+            # keys already moved away are served by the importing node
+            if target is not None and self._datastore.exists(keys) < len(keys):
+                return Error(f'ASK {slot} {format_node(target)}')
+            return None
+        if asking and slot in state.importing:
+            return None
+        return Error(f'MOVED {slot} {format_node(owner)}')
+
+    def _handle_cluster(self, command):
+        if len(command) < 2:
+            return Error("ERR wrong number of arguments for 'cluster' command")
+        subcommand = command[1].data.upper()
+        try:
+            match subcommand, len(command):
+                case b'KEYSLOT', 3:
+                    return Integer(key_hash_slot(command[2].data))
+                case b'SLOTS', 2:
+                    return Array([
+                        Array([
+                            Integer(start),
+                            Integer(end),
+                            Array([BulkString(node[0].encode()), Integer(node[1])]),
+                        ])
+                        for start, end, node in self._state.slot_ranges()
+                    ])
+                case b'MYID', 2:
+                    return BulkString(format_node(self._state.myself).encode())
+                case b'COUNTKEYSINSLOT', 3:
+                    return Integer(self._datastore.count_keys_in_slot(self._parse_slot(command[2])))
+                case b'GETKEYSINSLOT', 4:
+                    slot, count = self._parse_slot(command[2]), int(command[3].data)
+                    if count < 0:
+                        return Error('ERR Invalid number of keys')
+                    return Array([BulkString(key) for key in self._datastore.keys_in_slot(slot, count)])
+                case b'SETSLOT', 4:
+                    state = command[3].data.upper()
+                    if state in (b'MIGRATING', b'IMPORTING', b'NODE'):
+                        return Error("ERR wrong number of arguments for 'cluster|setslot' command")
+                    return self._state.set_slot(self._parse_slot(command[2]), state, None)
+                case b'SETSLOT', 5:
+                    node = parse_node(command[4].data.decode())
+                    return self._state.set_slot(self._parse_slot(command[2]), command[3].data.upper(), node)
+        except ValueError:
+            return Error('ERR Invalid or out of range slot')
+        return Error(f"ERR unknown subcommand or wrong number of arguments for '{subcommand.decode(errors='replace')}'")
+
+    def _parse_slot(self, argument):
+        slot = int(argument.data)
+        if not 0 <= slot < HASH_SLOTS:
+            raise ValueError(slot)
+        return slot
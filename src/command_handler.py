@@ -1,161 +1,1094 @@
-from src.types import Array, BulkString, Error, Integer, SimpleString
+import os
+import socket
+from dataclasses import dataclass
+from fnmatch import fnmatchcase
+from functools import partial
+from time import perf_counter_ns, time_ns
+from typing import Callable
 
-def _handle_echo(command):
-    if len(command) == 2:
-        message = command[1].data.decode()
-        return BulkString(f'{message}')
-    return Error('ERR wrong number of arguments for ECHO command')
+from src.datastore import INT64_MAX, INT64_MIN
+from src.protocol_handler import RespParser, encode_message
+from src.snapshot import SnapshotError, dump_value, restore_value
+from src.sortedsets import format_score
+from src.profiler import PROFILER, PROFILE_FILENAME
+from src.pubsub import PUBSUB
+from src.stats import SERVER_STATS, SLOW_LOG, format_bytes, process_rss
+from src.types import Array, BulkString, Error, Integer, Replies, SimpleString
+
+WRONGTYPE_ERROR = 'WRONGTYPE Operation against a key holding the wrong kind of value'
+NOT_INTEGER_ERROR = 'ERR value is not an integer or out of range'
+HASH_NOT_INTEGER_ERROR = 'ERR hash value is not an integer'
+OOM_ERROR = "OOM command not allowed when used memory > 'maxmemory'."
+NOT_FLOAT_ERROR = 'ERR value is not a valid float'
+NS_PER_MS = 10**6
+NS_PER_SECOND = 10**9
+
+@dataclass(frozen=True)
+class CommandSpec:
+    name: str
+    handler: Callable
+    # redis convention: positive means exactly N arguments (including the
+    # command name), negative means at least -N
+    arity: int
+    flags: tuple
+    first_key: int = 0
+    last_key: int = 0
+    key_step: int = 0
+    # rewrites the command before it is appended to the AOF, e.g. GETSET as
+    # a plain SET
+    propagate: Callable = None
+    # rewrites the command before it runs, when it is logged, into a form
+    # that means the same whenever it is replayed, e.g. relative expiries
+    # into absolute ones; the datastore and the AOF then get one timestamp
+    rewrite: Callable = None
+    # server commands get the persister passed as a third argument
+    pass_persister: bool = False
+    # and connection commands the client as a fourth
+    pass_client: bool = False
+
+    @property
+    def is_write(self):
+        return 'write' in self.flags
+
+    def check_arity(self, argc):
+        if self.arity >= 0:
+            return argc == self.arity
+        return argc >= -self.arity
+
+    def keys(self, command):
+        if not self.first_key:
+            return []
+        last_key = self.last_key if self.last_key >= 0 else len(command) + self.last_key
+        last_key = min(last_key, len(command) - 1)
+        return [command[i].data for i in range(self.first_key, last_key + 1, self.key_step)]
+
+    def info(self):
+        return Array([
+            BulkString(self.name.encode()),
+            Integer(self.arity),
+            Array([SimpleString(flag) for flag in self.flags]),
+            Integer(self.first_key),
+            Integer(self.last_key),
+            Integer(self.key_step),
+        ])
+
+_COMMANDS = {}
+
+def command(
+    name, arity, flags, first_key=0, last_key=0, key_step=0, propagate=None, rewrite=None, pass_persister=False,
+    pass_client=False,
+):
+    def register(handler):
+        spec = CommandSpec(
+            name, handler, arity, tuple(flags), first_key, last_key, key_step, propagate, rewrite, pass_persister,
+            pass_client,
+        )
+        # register both common spellings so most lookups avoid lower()
+        _COMMANDS[name.encode()] = spec
+        _COMMANDS[name.upper().encode()] = spec
+        return handler
+    return register
 
-def _handle_ping(command):
+def lookup_command(name):
+    spec = _COMMANDS.get(name)
+    if spec is None:
+        spec = _COMMANDS.get(name.lower())
+    return spec
+
+def registered_commands():
+    return sorted({spec.name: spec for spec in _COMMANDS.values()}.values(), key=lambda spec: spec.name)
+
+@command('echo', 2, ('fast',))
+def _handle_echo(command, datastore):
+    return BulkString(command[1].data)
+
+@command('ping', -1, ('fast',))
+def _handle_ping(command, datastore):
     if len(command) == 1:
         return SimpleString('PONG')
     if len(command) == 2:
-        message = command[1].data.decode()
-        return BulkString(f'{message}')
-    return Error('ERR wrong number of arguments for PING command')
-
-def _handle_set(command, datastore, persister):
-    if len(command) >= 3:
-        key, value = command[1].data.decode(), command[2].data.decode()
-        if len(command) == 3:
-            datastore[key] = value
-            if persister: persister.log_command(command)
-            return SimpleString('OK')
-        elif len(command) == 5:
-            expiry_mode = command[3].data.decode().upper()
-            try:
-                expiry = int(command[4].data.decode())
-            except ValueError:
-                return Error('ERR value is not an integer or out of range')
-            match expiry_mode:
-                case 'EX':
-                    datastore.set_with_expiry(key, value, expiry)
-                    if persister: persister.log_command(command)
-                    return SimpleString('OK')
-                case 'PX':
-                    datastore.set_with_expiry(key, value, expiry / 1000)
-                    if persister: persister.log_command(command)
-                    return SimpleString('OK')
-        return Error("ERR syntax error")
-    return Error("ERR wrong number of arguments for 'set' command")
+        return BulkString(command[1].data)
+    return Error("ERR wrong number of arguments for 'ping' command")
 
-def _handle_get(command, datastore):
-    if len(command) == 2:
-        key = command[1].data.decode()
+@command('command', -1, ('loading',))
+def _handle_command(command, datastore):
+    if len(command) == 1:
+        return Array([spec.info() for spec in registered_commands()])
+    match command[1].data.upper():
+        case b'COUNT':
+            return Integer(len(registered_commands()))
+        case b'INFO':
+            if len(command) == 2:
+                return Array([spec.info() for spec in registered_commands()])
+            replies = []
+            for c in command[2:]:
+                spec = lookup_command(c.data)
+                replies.append(spec.info() if spec else Array(None))
+            return Array(replies)
+    return Error("ERR unknown subcommand or wrong number of arguments for 'command' command")
+
+def _expiry_timestamp(mode, expiry):
+    match mode:
+        case b'EX':
+            timestamp = time_ns() + expiry * NS_PER_SECOND
+        case b'PX':
+            timestamp = time_ns() + expiry * NS_PER_MS
+        case b'EXAT':
+            timestamp = expiry * NS_PER_SECOND
+        case b'PXAT':
+            timestamp = expiry * NS_PER_MS
+        case _:
+            return None
+    # expiries are logged and replicated as 64-bit millisecond timestamps
+    if not INT64_MIN <= timestamp // NS_PER_MS <= INT64_MAX:
+        raise OverflowError
+    return timestamp
+
+def _parse_expiry(mode, value):
+    try:
+        expiry = int(value)
+    except ValueError:
+        return None
+    return _expiry_timestamp(mode, expiry)
+
+def _rewrite_set(command):
+    if len(command) != 5:
+        return command
+    mode = command[3].data.upper()
+    if mode not in (b'EX', b'PX'):
+        return command
+    try:
+        expiry = int(command[4].data)
+    except ValueError:
+        return command
+    # invalid expiries are left for the handler to reject
+    if expiry <= 0:
+        return command
+    try:
+        timestamp = _expiry_timestamp(mode, expiry)
+    except OverflowError:
+        return command
+    return [BulkString(b'SET'), command[1], command[2], BulkString(b'PXAT'), BulkString(b'%d' % (timestamp // NS_PER_MS))]
+
+@command('set', -3, ('write', 'denyoom'), 1, 1, 1, rewrite=_rewrite_set)
+def _handle_set(command, datastore):
+    key, value = command[1].data, command[2].data
+    if len(command) == 3:
+        datastore[key] = value
+        return SimpleString('OK')
+    elif len(command) == 5:
+        expiry_mode = command[3].data.upper()
+        if expiry_mode not in (b'EX', b'PX', b'EXAT', b'PXAT'):
+            return Error("ERR syntax error")
         try:
-            value = datastore[key]
-        except KeyError:
-            return BulkString(None)
-        return BulkString(value)
-    return Error("ERR wrong number of arguments for 'get' command")
+            expiry = int(command[4].data)
+        except ValueError:
+            return Error(NOT_INTEGER_ERROR)
+        try:
+            timestamp = _expiry_timestamp(expiry_mode, expiry)
+        except OverflowError:
+            timestamp = None
+        if expiry <= 0 or timestamp is None:
+            return Error("ERR invalid expire time in 'set' command")
+        datastore.set_with_expiry_at(key, value, timestamp)
+        return SimpleString('OK')
+    return Error("ERR syntax error")
+
+@command('get', 2, ('readonly', 'fast'), 1, 1, 1)
+def _handle_get(command, datastore):
+    try:
+        value = datastore[command[1].data]
+    except KeyError:
+        return BulkString(None)
+    if not isinstance(value, bytes):
+        return Error(WRONGTYPE_ERROR)
+    return BulkString(value)
+
+@command('mget', -2, ('readonly', 'fast'), 1, -1, 1)
+def _handle_mget(command, datastore):
+    return Array([BulkString(value) for value in datastore.mget([c.data for c in command[1:]])])
+
+def _parse_pairs(command):
+    if len(command) % 2 == 0:
+        return None
+    return {command[i].data: command[i + 1].data for i in range(1, len(command), 2)}
+
+@command('mset', -3, ('write', 'denyoom'), 1, -1, 2)
+def _handle_mset(command, datastore):
+    pairs = _parse_pairs(command)
+    if pairs is None:
+        return Error("ERR wrong number of arguments for 'mset' command")
+    datastore.mset(pairs)
+    return SimpleString('OK')
+
+@command('msetnx', -3, ('write', 'denyoom'), 1, -1, 2)
+def _handle_msetnx(command, datastore):
+    pairs = _parse_pairs(command)
+    if pairs is None:
+        return Error("ERR wrong number of arguments for 'msetnx' command")
+    return Integer(int(datastore.mset(pairs, only_new=True)))
+
+def _propagate_getset(command):
+    return [BulkString(b'SET'), command[1], command[2]]
+
+@command('getset', 3, ('write', 'denyoom', 'fast'), 1, 1, 1, propagate=_propagate_getset)
+def _handle_getset(command, datastore):
+    try:
+        return BulkString(datastore.getset(command[1].data, command[2].data))
+    except TypeError:
+        return Error(WRONGTYPE_ERROR)
+
+@command('setnx', 3, ('write', 'denyoom', 'fast'), 1, 1, 1)
+def _handle_setnx(command, datastore):
+    return Integer(int(datastore.setnx(command[1].data, command[2].data)))
 
+@command('append', 3, ('write', 'denyoom', 'fast'), 1, 1, 1)
+def _handle_append(command, datastore):
+    try:
+        return Integer(datastore.append(command[1].data, command[2].data))
+    except TypeError:
+        return Error(WRONGTYPE_ERROR)
+
+@command('exists', -2, ('readonly', 'fast'), 1, -1, 1)
 def _handle_exists(command, datastore):
-    if len(command) > 1:
-        count = 0
-        for c in command[1:]:
-            key = c.data.decode()
-            if key in datastore:
-                count += 1
+    return Integer(datastore.exists([c.data for c in command[1:]]))
+
+@command('del', -2, ('write',), 1, -1, 1)
+def _handle_del(command, datastore):
+    return Integer(datastore.delete([c.data for c in command[1:]]))
+
+def _incrby_reply(datastore, key, increment):
+    try:
+        return Integer(datastore.incrby(key, increment))
+    except TypeError:
+        return Error(WRONGTYPE_ERROR)
+    except ValueError:
+        return Error(NOT_INTEGER_ERROR)
+    except OverflowError:
+        return Error('ERR increment or decrement would overflow')
+
+@command('incr', 2, ('write', 'denyoom', 'fast'), 1, 1, 1)
+def _handle_incr(command, datastore):
+    return _incrby_reply(datastore, command[1].data, 1)
+
+@command('decr', 2, ('write', 'denyoom', 'fast'), 1, 1, 1)
+def _handle_decr(command, datastore):
+    return _incrby_reply(datastore, command[1].data, -1)
+
+@command('incrby', 3, ('write', 'denyoom', 'fast'), 1, 1, 1)
+def _handle_incrby(command, datastore):
+    try:
+        increment = int(command[2].data)
+    except ValueError:
+        return Error(NOT_INTEGER_ERROR)
+    return _incrby_reply(datastore, command[1].data, increment)
+
+@command('decrby', 3, ('write', 'denyoom', 'fast'), 1, 1, 1)
+def _handle_decrby(command, datastore):
+    try:
+        decrement = int(command[2].data)
+    except ValueError:
+        return Error(NOT_INTEGER_ERROR)
+    return _incrby_reply(datastore, command[1].data, -decrement)
+
+@command('object', -2, ('readonly',), 2, 2, 1)
+def _handle_object(command, datastore):
+    if command[1].data.upper() == b'ENCODING' and len(command) == 3:
+        encoding = datastore.encoding(command[2].data)
+        return BulkString(encoding.encode() if encoding is not None else None)
+    return Error("ERR unknown subcommand or wrong number of arguments for 'object' command")
+
+@command('lpush', -3, ('write', 'denyoom', 'fast'), 1, 1, 1)
+def _handle_lpush(command, datastore):
+    key = command[1].data
+    try:
+        for c in command[2:]:
+            count = datastore.lpush(key, c.data)
         return Integer(count)
-    return Error("ERR wrong number of arguments for 'exists' command")
-
-def _handle_del(command, datastore, persister):
-    if len(command) > 1:
-        count = 0
-        for c in command[1:]:
-            key = c.data.decode()
-            if key in datastore:
-                del datastore[key]
-                count += 1
-        if persister: persister.log_command(command)
+    except TypeError:
+        return Error(WRONGTYPE_ERROR)
+
+@command('rpush', -3, ('write', 'denyoom', 'fast'), 1, 1, 1)
+def _handle_rpush(command, datastore):
+    key = command[1].data
+    try:
+        for c in command[2:]:
+            count = datastore.rpush(key, c.data)
         return Integer(count)
-    return Error("ERR wrong number of arguments for 'del' command")
+    except TypeError:
+        return Error(WRONGTYPE_ERROR)
 
-def _handle_incr(command, datastore, persister):
-    if len(command) == 2:
-        key = command[1].data.decode()
-        try:
-            if persister: persister.log_command(command)
-            return Integer(datastore.incr(key))
-        except:
-            return Error('ERR value is not an integer or out of range')
-    return Error("ERR wrong number of arguments for 'incr' command")
+@command('lrange', 4, ('readonly',), 1, 1, 1)
+def _handle_lrange(command, datastore):
+    key = command[1].data
+    try:
+        start, end = int(command[2].data), int(command[3].data)
+    except ValueError:
+        return Error(NOT_INTEGER_ERROR)
+    try:
+        result = datastore.lrange(key, start, end)
+        return Array([BulkString(r) for r in result])
+    except TypeError:
+        return Error(WRONGTYPE_ERROR)
 
-def _handle_decr(command, datastore, persister):
-    if len(command) == 2:
-        key = command[1].data.decode()
-        try:
-            if persister: persister.log_command(command)
-            return Integer(datastore.decr(key))
-        except:
-            return Error('ERR value is not an integer or out of range')
-    return Error("ERR wrong number of arguments for 'decr' command")
-
-def _handle_lpush(command, datastore, persister):
-    if len(command) >= 3:
-        key = command[1].data.decode()
-        try:
-            for c in command[2:]:
-                element = c.data.decode()
-                count = datastore.lpush(key, element)
-            if persister: persister.log_command(command)
-            return Integer(count)
-        except TypeError:
-            return Error('WRONGTYPE Operation against a key holding the wrong kind of value')
-    return Error("ERR wrong number of arguments for 'lpush' command")
-
-def _handle_rpush(command, datastore, persister):
-    if len(command) >= 3:
-        key = command[1].data.decode()
-        try:
-            for c in command[2:]:
-                element = c.data.decode()
-                count = datastore.rpush(key, element)
-            if persister: persister.log_command(command)
-            return Integer(count)
-        except TypeError:
-            return Error('WRONGTYPE Operation against a key holding the wrong kind of value')
-    return Error("ERR wrong number of arguments for 'rpush' command")
+@command('hset', -4, ('write', 'denyoom', 'fast'), 1, 1, 1)
+def _handle_hset(command, datastore):
+    if len(command) % 2:
+        return Error("ERR wrong number of arguments for 'hset' command")
+    pairs = [(command[i].data, command[i + 1].data) for i in range(2, len(command), 2)]
+    try:
+        return Integer(datastore.hset(command[1].data, pairs))
+    except TypeError:
+        return Error(WRONGTYPE_ERROR)
 
-def _handle_lrange(command, datastore):
-    if len(command) == 4:
-        key = command[1].data.decode()
-        try:
-            start, end = int(command[2].data.decode()), int(command[3].data.decode())
-            result = datastore.lrange(key, start, end)
-            return Array([BulkString(r) for r in result])
-        except TypeError:
-            return Error('WRONGTYPE Operation against a key holding the wrong kind of value LRANGE')
-    return Error("ERR wrong number of arguments for 'lrange' command")
+@command('hget', 3, ('readonly', 'fast'), 1, 1, 1)
+def _handle_hget(command, datastore):
+    try:
+        return BulkString(datastore.hget(command[1].data, command[2].data))
+    except TypeError:
+        return Error(WRONGTYPE_ERROR)
+
+@command('hmget', -3, ('readonly', 'fast'), 1, 1, 1)
+def _handle_hmget(command, datastore):
+    try:
+        values = datastore.hmget(command[1].data, [c.data for c in command[2:]])
+    except TypeError:
+        return Error(WRONGTYPE_ERROR)
+    return Array([BulkString(value) for value in values])
+
+def _flatten_pairs(pairs):
+    return Array([BulkString(item) for pair in pairs for item in pair])
+
+@command('hgetall', 2, ('readonly',), 1, 1, 1)
+def _handle_hgetall(command, datastore):
+    try:
+        return _flatten_pairs(datastore.hgetall(command[1].data))
+    except TypeError:
+        return Error(WRONGTYPE_ERROR)
+
+@command('hdel', -3, ('write', 'fast'), 1, 1, 1)
+def _handle_hdel(command, datastore):
+    try:
+        return Integer(datastore.hdel(command[1].data, [c.data for c in command[2:]]))
+    except TypeError:
+        return Error(WRONGTYPE_ERROR)
+
+@command('hincrby', 4, ('write', 'denyoom', 'fast'), 1, 1, 1)
+def _handle_hincrby(command, datastore):
+    try:
+        increment = int(command[3].data)
+    except ValueError:
+        return Error(NOT_INTEGER_ERROR)
+    try:
+        return Integer(datastore.hincrby(command[1].data, command[2].data, increment))
+    except TypeError:
+        return Error(WRONGTYPE_ERROR)
+    except ValueError:
+        return Error(HASH_NOT_INTEGER_ERROR)
+    except OverflowError:
+        return Error('ERR increment or decrement would overflow')
+
+@command('hlen', 2, ('readonly', 'fast'), 1, 1, 1)
+def _handle_hlen(command, datastore):
+    try:
+        return Integer(datastore.hlen(command[1].data))
+    except TypeError:
+        return Error(WRONGTYPE_ERROR)
+
+@command('hscan', -3, ('readonly',), 1, 1, 1)
+def _handle_hscan(command, datastore):
+    pattern, count = None, 10
+    try:
+        cursor = int(command[2].data)
+        options = command[3:]
+        if len(options) % 2:
+            return Error('ERR syntax error')
+        for i in range(0, len(options), 2):
+            match options[i].data.upper():
+                case b'MATCH':
+                    pattern = options[i + 1].data
+                case b'COUNT':
+                    count = int(options[i + 1].data)
+                case _:
+                    return Error('ERR syntax error')
+    except ValueError:
+        return Error(NOT_INTEGER_ERROR)
+    if cursor < 0 or count < 1:
+        return Error('ERR syntax error')
+    try:
+        cursor, pairs = datastore.hscan(command[1].data, cursor, count)
+    except TypeError:
+        return Error(WRONGTYPE_ERROR)
+    if pattern is not None:
+        pairs = [pair for pair in pairs if fnmatchcase(pair[0], pattern)]
+    return Array([BulkString(b'%d' % cursor), _flatten_pairs(pairs)])
+
+@command('sadd', -3, ('write', 'denyoom', 'fast'), 1, 1, 1)
+def _handle_sadd(command, datastore):
+    try:
+        return Integer(datastore.sadd(command[1].data, [c.data for c in command[2:]]))
+    except TypeError:
+        return Error(WRONGTYPE_ERROR)
+
+@command('srem', -3, ('write', 'fast'), 1, 1, 1)
+def _handle_srem(command, datastore):
+    try:
+        return Integer(datastore.srem(command[1].data, [c.data for c in command[2:]]))
+    except TypeError:
+        return Error(WRONGTYPE_ERROR)
+
+@command('sismember', 3, ('readonly', 'fast'), 1, 1, 1)
+def _handle_sismember(command, datastore):
+    try:
+        return Integer(int(datastore.sismember(command[1].data, command[2].data)))
+    except TypeError:
+        return Error(WRONGTYPE_ERROR)
+
+@command('smembers', 2, ('readonly',), 1, 1, 1)
+def _handle_smembers(command, datastore):
+    try:
+        return Array([BulkString(member) for member in datastore.smembers(command[1].data)])
+    except TypeError:
+        return Error(WRONGTYPE_ERROR)
+
+@command('scard', 2, ('readonly', 'fast'), 1, 1, 1)
+def _handle_scard(command, datastore):
+    try:
+        return Integer(datastore.scard(command[1].data))
+    except TypeError:
+        return Error(WRONGTYPE_ERROR)
+
+def _set_operation_reply(operation, keys):
+    try:
+        return Array([BulkString(member) for member in operation(keys)])
+    except TypeError:
+        return Error(WRONGTYPE_ERROR)
+
+@command('sinter', -2, ('readonly',), 1, -1, 1)
+def _handle_sinter(command, datastore):
+    return _set_operation_reply(datastore.sinter, [c.data for c in command[1:]])
+
+@command('sunion', -2, ('readonly',), 1, -1, 1)
+def _handle_sunion(command, datastore):
+    return _set_operation_reply(datastore.sunion, [c.data for c in command[1:]])
+
+@command('sdiff', -2, ('readonly',), 1, -1, 1)
+def _handle_sdiff(command, datastore):
+    return _set_operation_reply(datastore.sdiff, [c.data for c in command[1:]])
+
+@command('sinterstore', -3, ('write', 'denyoom'), 1, -1, 1)
+def _handle_sinterstore(command, datastore):
+    try:
+        return Integer(datastore.sinterstore(command[1].data, [c.data for c in command[2:]]))
+    except TypeError:
+        return Error(WRONGTYPE_ERROR)
+
+def _parse_score(value):
+    score = float(value)
+    if score != score:
+        raise ValueError(value)
+    return score
+
+def _parse_score_bound(value):
+    # returns (score, exclusive) for ZRANGEBYSCORE style bounds like (1.5 or -inf
+    if value.startswith(b'('):
+        return _parse_score(value[1:]), True
+    return _parse_score(value), False
+
+def _scored_members(pairs, with_scores):
+    if with_scores:
+        return Array([BulkString(item) for member, score in pairs for item in (member, format_score(score))])
+    return Array([BulkString(member) for member, _ in pairs])
+
+@command('zadd', -4, ('write', 'denyoom', 'fast'), 1, 1, 1)
+def _handle_zadd(command, datastore):
+    flags = set()
+    i = 2
+    while i < len(command) and command[i].data.upper() in (b'NX', b'XX', b'CH', b'INCR'):
+        flags.add(command[i].data.upper())
+        i += 1
+    arguments = command[i:]
+    if not arguments or len(arguments) % 2:
+        return Error('ERR syntax error')
+    if b'NX' in flags and b'XX' in flags:
+        return Error('ERR XX and NX options at the same time are not compatible')
+    if b'INCR' in flags and len(arguments) != 2:
+        return Error('ERR INCR option supports a single increment-element pair')
+    try:
+        pairs = [(arguments[j + 1].data, _parse_score(arguments[j].data)) for j in range(0, len(arguments), 2)]
+    except ValueError:
+        return Error(NOT_FLOAT_ERROR)
+    key = command[1].data
+    try:
+        if b'INCR' in flags:
+            member, increment = pairs[0]
+            score = datastore.zincrby(key, member, increment, b'NX' in flags, b'XX' in flags)
+            return BulkString(format_score(score) if score is not None else None)
+        return Integer(datastore.zadd(key, pairs, b'NX' in flags, b'XX' in flags, b'CH' in flags))
+    except TypeError:
+        return Error(WRONGTYPE_ERROR)
+    except ValueError as e:
+        return Error(f'ERR {e}')
+
+@command('zincrby', 4, ('write', 'denyoom', 'fast'), 1, 1, 1)
+def _handle_zincrby(command, datastore):
+    try:
+        increment = _parse_score(command[2].data)
+    except ValueError:
+        return Error(NOT_FLOAT_ERROR)
+    try:
+        return BulkString(format_score(datastore.zincrby(command[1].data, command[3].data, increment)))
+    except TypeError:
+        return Error(WRONGTYPE_ERROR)
+    except ValueError as e:
+        return Error(f'ERR {e}')
+
+@command('zscore', 3, ('readonly', 'fast'), 1, 1, 1)
+def _handle_zscore(command, datastore):
+    try:
+        score = datastore.zscore(command[1].data, command[2].data)
+    except TypeError:
+        return Error(WRONGTYPE_ERROR)
+    return BulkString(format_score(score) if score is not None else None)
+
+@command('zrank', 3, ('readonly', 'fast'), 1, 1, 1)
+def _handle_zrank(command, datastore):
+    try:
+        rank = datastore.zrank(command[1].data, command[2].data)
+    except TypeError:
+        return Error(WRONGTYPE_ERROR)
+    return Integer(rank) if rank is not None else BulkString(None)
+
+@command('zrange', -4, ('readonly',), 1, 1, 1)
+def _handle_zrange(command, datastore):
+    options = [c.data.upper() for c in command[4:]]
+    if options not in ([], [b'WITHSCORES']):
+        return Error('ERR syntax error')
+    try:
+        start, stop = int(command[2].data), int(command[3].data)
+    except ValueError:
+        return Error(NOT_INTEGER_ERROR)
+    try:
+        return _scored_members(datastore.zrange(command[1].data, start, stop), bool(options))
+    except TypeError:
+        return Error(WRONGTYPE_ERROR)
+
+@command('zrangebyscore', -4, ('readonly',), 1, 1, 1)
+def _handle_zrangebyscore(command, datastore):
+    try:
+        low, low_exclusive = _parse_score_bound(command[2].data)
+        high, high_exclusive = _parse_score_bound(command[3].data)
+    except ValueError:
+        return Error('ERR min or max is not a float')
+    with_scores, offset, count = False, 0, -1
+    i = 4
+    while i < len(command):
+        option = command[i].data.upper()
+        if option == b'WITHSCORES':
+            with_scores = True
+            i += 1
+        elif option == b'LIMIT' and i + 2 < len(command):
+            try:
+                offset, count = int(command[i + 1].data), int(command[i + 2].data)
+            except ValueError:
+                return Error(NOT_INTEGER_ERROR)
+            i += 3
+        else:
+            return Error('ERR syntax error')
+    if offset < 0:
+        return Array([])
+    try:
+        pairs = datastore.zrangebyscore(command[1].data, low, high, low_exclusive, high_exclusive, offset, count)
+    except TypeError:
+        return Error(WRONGTYPE_ERROR)
+    return _scored_members(pairs, with_scores)
+
+@command('zrem', -3, ('write', 'fast'), 1, 1, 1)
+def _handle_zrem(command, datastore):
+    try:
+        return Integer(datastore.zrem(command[1].data, [c.data for c in command[2:]]))
+    except TypeError:
+        return Error(WRONGTYPE_ERROR)
+
+@command('zcard', 2, ('readonly', 'fast'), 1, 1, 1)
+def _handle_zcard(command, datastore):
+    try:
+        return Integer(datastore.zcard(command[1].data))
+    except TypeError:
+        return Error(WRONGTYPE_ERROR)
+
+def _rewrite_expire(command):
+    mode = b'EX' if command[0].data.upper() == b'EXPIRE' else b'PX'
+    try:
+        timestamp = _expiry_timestamp(mode, int(command[2].data))
+    except (ValueError, OverflowError):
+        return command
+    return [BulkString(b'PEXPIREAT'), command[1], BulkString(b'%d' % (timestamp // NS_PER_MS))]
+
+def _expire(command, datastore, mode):
+    try:
+        timestamp = _parse_expiry(mode, command[2].data)
+    except OverflowError:
+        return Error(f"ERR invalid expire time in '{command[0].data.decode().lower()}' command")
+    if timestamp is None:
+        return Error(NOT_INTEGER_ERROR)
+    return Integer(int(datastore.expire_at(command[1].data, timestamp)))
+
+@command('expire', 3, ('write', 'fast'), 1, 1, 1, rewrite=_rewrite_expire)
+def _handle_expire(command, datastore):
+    return _expire(command, datastore, b'EX')
+
+@command('pexpire', 3, ('write', 'fast'), 1, 1, 1, rewrite=_rewrite_expire)
+def _handle_pexpire(command, datastore):
+    return _expire(command, datastore, b'PX')
+
+@command('pexpireat', 3, ('write', 'fast'), 1, 1, 1)
+def _handle_pexpireat(command, datastore):
+    return _expire(command, datastore, b'PXAT')
+
+@command('persist', 2, ('write', 'fast'), 1, 1, 1)
+def _handle_persist(command, datastore):
+    return Integer(int(datastore.persist(command[1].data)))
+
+@command('ttl', 2, ('readonly', 'fast'), 1, 1, 1)
+def _handle_ttl(command, datastore):
+    ttl = datastore.ttl(command[1].data)
+    if ttl < 0:
+        return Integer(ttl)
+    return Integer((ttl + NS_PER_SECOND // 2) // NS_PER_SECOND)
+
+@command('pttl', 2, ('readonly', 'fast'), 1, 1, 1)
+def _handle_pttl(command, datastore):
+    ttl = datastore.ttl(command[1].data)
+    if ttl < 0:
+        return Integer(ttl)
+    return Integer((ttl + NS_PER_MS // 2) // NS_PER_MS)
+
+@command('asking', 1, ('fast',))
+def _handle_asking(command, datastore):
+    # only meaningful in cluster mode, where the cluster router handles it
+    return SimpleString('OK')
+
+@command('dump', 2, ('readonly',), 1, 1, 1)
+def _handle_dump(command, datastore):
+    entry = datastore.dump(command[1].data)
+    if entry is None:
+        return BulkString(None)
+    return BulkString(dump_value(entry[0]))
+
+def _rewrite_restore(command):
+    if b'ABSTTL' in (c.data.upper() for c in command[4:]):
+        return command
+    try:
+        ttl = int(command[2].data)
+    except ValueError:
+        return command
+    # 0 means no expiry, negative TTLs are left for the handler to reject
+    if ttl <= 0:
+        return command
+    return [*command[:2], BulkString(b'%d' % (time_ns() // NS_PER_MS + ttl)), *command[3:], BulkString(b'ABSTTL')]
+
+def _propagate_restore(command):
+    # the TTL is already absolute, or 0 for none
+    return [
+        BulkString(b'RESTORE'), command[1], command[2], command[3], BulkString(b'REPLACE'), BulkString(b'ABSTTL'),
+    ]
+
+@command('restore', -4, ('write', 'denyoom'), 1, 1, 1, propagate=_propagate_restore, rewrite=_rewrite_restore)
+def _handle_restore(command, datastore):
+    key = command[1].data
+    options = [c.data.upper() for c in command[4:]]
+    if any(option not in (b'REPLACE', b'ABSTTL') for option in options):
+        return Error('ERR syntax error')
+    try:
+        ttl = int(command[2].data)
+    except ValueError:
+        return Error(NOT_INTEGER_ERROR)
+    if ttl < 0:
+        return Error('ERR Invalid TTL value, must be >= 0')
+    try:
+        value = restore_value(command[3].data)
+    except SnapshotError:
+        return Error('ERR DUMP payload version or checksum are wrong')
+    expiry = 0
+    if ttl:
+        expiry = ttl * NS_PER_MS if b'ABSTTL' in options else time_ns() + ttl * NS_PER_MS
+    if not datastore.restore(key, value, expiry, b'REPLACE' in options):
+        return Error('BUSYKEY Target key name already exists.')
+    return SimpleString('OK')
+
+def _send_command(host, port, commands, timeout):
+    with socket.create_connection((host, port), timeout=timeout) as connection:
+        connection.sendall(b''.join(encode_message(c) for c in commands))
+        parser = RespParser()
+        replies = []
+        while len(replies) < len(commands):
+            reply = parser.get_frame()
+            if reply is not None:
+                replies.append(reply)
+                continue
+            data = connection.recv(64 * 1024)
+            if not data:
+                raise ConnectionError('connection closed by target')
+            parser.feed(data)
+        return replies
+
+@command('migrate', -6, ('write',), 3, 3, 1, pass_client=True)
+def _handle_migrate(command, datastore, persister, client):
+    host, key = command[1].data.decode(), command[3].data
+    replace = b'REPLACE' in (c.data.upper() for c in command[6:])
+    try:
+        port, timeout_ms = int(command[2].data), int(command[5].data)
+    except ValueError:
+        return Error(NOT_INTEGER_ERROR)
+    if client is not None and client.defers_blocking_calls:
+        # the asyncio engine makes the round trip from a thread
+        client.deferred = partial(_migrate, host, port, key, replace, timeout_ms, datastore, persister)
+        return None
+    return _migrate(host, port, key, replace, timeout_ms, datastore, persister)
+
+def _migrate(host, port, key, replace, timeout_ms, datastore, persister):
+    # the transfer runs without the key's lock so two nodes migrating to each
+    # other never wait on each other's round trip; the key is only deleted if
+    # nothing changed it meanwhile
+    entry = datastore.dump(key)
+    if entry is None:
+        return SimpleString('NOKEY')
+    value, expiry = entry
+    payload = dump_value(value)
+    restore = [BulkString(b'RESTORE'), BulkString(key), BulkString(b'%d' % (expiry // NS_PER_MS)), BulkString(payload)]
+    if replace:
+        restore.append(BulkString(b'REPLACE'))
+    restore.append(BulkString(b'ABSTTL'))
+    try:
+        # ASKING lets the target accept the key while its slot is importing
+        _, reply = _send_command(host, port, [Array([BulkString(b'ASKING')]), Array(restore)], (timeout_ms or 1000) / 1000)
+    except OSError as e:
+        return Error(f'IOERR error or timeout migrating to target instance: {e}')
+    if isinstance(reply, Error):
+        return Error(f'ERR Target instance replied with error: {reply.data}')
+    stripes = persister.command_lock.stripes([key]) if persister is not None else []
+    for stripe in stripes:
+        stripe.acquire()
+    try:
+        entry = datastore.dump(key)
+        if entry is None or entry[1] != expiry or dump_value(entry[0]) != payload:
+            return Error('ERR key was modified while being migrated, the local copy was kept')
+        datastore.delete([key])
+        if persister is not None:
+            persister.log_command([BulkString(b'DEL'), BulkString(key)])
+    finally:
+        for stripe in reversed(stripes):
+            stripe.release()
+    return SimpleString('OK')
+
+@command('bgrewriteaof', 1, ('admin',), pass_persister=True)
+def _handle_bgrewriteaof(command, datastore, persister):
+    if persister is None:
+        return Error('ERR append only file is disabled')
+    if not persister.rewrite_in_background(datastore):
+        return Error('ERR Background append only file rewriting already in progress')
+    return SimpleString('Background append only file rewriting started')
+
+@command('save', 1, ('admin',), pass_persister=True)
+def _handle_save(command, datastore, persister):
+    if persister is None:
+        return Error('ERR persistence is disabled')
+    try:
+        if not persister.save(datastore):
+            return Error('ERR Background save already in progress')
+    except OSError as e:
+        return Error(f'ERR {e}')
+    return SimpleString('OK')
+
+@command('bgsave', 1, ('admin',), pass_persister=True)
+def _handle_bgsave(command, datastore, persister):
+    if persister is None:
+        return Error('ERR persistence is disabled')
+    if not persister.save_in_background(datastore):
+        return Error('ERR Background save already in progress')
+    return SimpleString('Background saving started')
+
+@command('lastsave', 1, ('fast',), pass_persister=True)
+def _handle_lastsave(command, datastore, persister):
+    if persister is None:
+        return Error('ERR persistence is disabled')
+    return Integer(persister.last_save)
+
+@command('psync', 3, ('admin',), pass_client=True)
+def _handle_psync(command, datastore, persister, client):
+    # the connection becomes a replica link: the server hands it over to
+    # client.replica once this reply has been sent
+    if persister is None:
+        return Error('ERR replication needs the append only file to be enabled')
+    if client is None:
+        return Error('ERR PSYNC is only supported on client connections')
+    try:
+        offset = int(command[2].data)
+    except ValueError:
+        return Error('ERR value is not an integer or out of range')
+    with persister.command_lock:
+        client.replica, reply = persister.replication.sync(
+            command[1].data.decode(errors='replace'), offset, datastore, client.address
+        )
+    return SimpleString(reply)
+
+@command('replicaof', 3, ('admin',), pass_persister=True)
+def _handle_replicaof(command, datastore, persister):
+    if persister is None:
+        return Error('ERR replication needs the append only file to be enabled')
+    host, port = command[1].data.decode(errors='replace'), command[2].data
+    if host.lower() == 'no' and port.lower() == b'one':
+        persister.replication.promote()
+        return SimpleString('OK')
+    try:
+        port = int(port)
+    except ValueError:
+        return Error('ERR Invalid master port')
+    persister.replication.replicate_from((host, port), datastore, persister)
+    return SimpleString('OK')
+
+def _subscription_replies(kind, names, change, client):
+    if client is None:
+        return Error(f"ERR {kind.upper()} is only supported on client connections")
+    if kind in ('subscribe', 'psubscribe'):
+        # messages for the new subscriptions must follow their confirmations
+        client.hold_messages()
+    if not names:
+        # unsubscribing from everything while subscribed to nothing
+        return Replies([Array([BulkString(kind.encode()), BulkString(None), Integer(change(client, None))])])
+    return Replies([
+        Array([BulkString(kind.encode()), BulkString(name), Integer(change(client, name))])
+        for name in names
+    ])
+
+@command('subscribe', -2, ('pubsub', 'loading'), pass_client=True)
+def _handle_subscribe(command, datastore, persister, client):
+    return _subscription_replies('subscribe', [c.data for c in command[1:]], PUBSUB.subscribe, client)
+
+@command('psubscribe', -2, ('pubsub', 'loading'), pass_client=True)
+def _handle_psubscribe(command, datastore, persister, client):
+    return _subscription_replies('psubscribe', [c.data for c in command[1:]], PUBSUB.psubscribe, client)
+
+@command('unsubscribe', -1, ('pubsub', 'loading'), pass_client=True)
+def _handle_unsubscribe(command, datastore, persister, client):
+    channels = [c.data for c in command[1:]] or sorted(client.channels if client is not None else ())
+    return _subscription_replies('unsubscribe', channels, PUBSUB.unsubscribe, client)
+
+@command('punsubscribe', -1, ('pubsub', 'loading'), pass_client=True)
+def _handle_punsubscribe(command, datastore, persister, client):
+    patterns = [c.data for c in command[1:]] or sorted(client.patterns if client is not None else ())
+    return _subscription_replies('punsubscribe', patterns, PUBSUB.punsubscribe, client)
+
+@command('publish', 3, ('pubsub', 'loading', 'fast'))
+def _handle_publish(command, datastore):
+    return Integer(PUBSUB.publish(command[1].data, command[2].data))
+
+@command('pubsub', -2, ('pubsub', 'loading'))
+def _handle_pubsub(command, datastore):
+    match command[1].data.upper(), len(command):
+        case b'CHANNELS', 2 | 3:
+            pattern = command[2].data if len(command) == 3 else None
+            return Array([BulkString(channel) for channel in PUBSUB.channels(pattern)])
+        case b'NUMSUB', _:
+            return Array([
+                item for c in command[2:] for item in (BulkString(c.data), Integer(PUBSUB.numsub(c.data)))
+            ])
+        case b'NUMPAT', 2:
+            return Integer(PUBSUB.numpat())
+    return Error("ERR unknown subcommand or wrong number of arguments for 'pubsub' command")
+
+def _info_keyspace(datastore):
+    keys = len(datastore)
+    if not keys:
+        return []
+    return [('db0', f'keys={keys},expires={datastore.expiring_keys()}')]
+
+def _info_memory(datastore):
+    used_memory = datastore.used_memory()
+    return [
+        ('used_memory', used_memory),
+        ('used_memory_human', format_bytes(used_memory)),
+        ('used_memory_rss', process_rss()),
+        ('maxmemory', datastore.maxmemory),
+        ('maxmemory_human', format_bytes(datastore.maxmemory)),
+        ('maxmemory_policy', datastore.maxmemory_policy),
+    ]
+
+def _info_sections(datastore, persister):
+    # each section is only computed when asked for
+    return {
+        'server': SERVER_STATS.server_info,
+        'clients': lambda: [('connected_clients', SERVER_STATS.connected_clients)],
+        'memory': lambda: _info_memory(datastore),
+        'persistence': lambda: persister.info() if persister is not None else [('aof_enabled', 0)],
+        'stats': lambda: [
+            ('total_connections_received', SERVER_STATS.total_connections),
+            ('total_commands_processed', SERVER_STATS.total_commands()),
+            ('evicted_keys', SERVER_STATS.evicted_keys),
+            ('pubsub_channels', len(PUBSUB.channels())),
+            ('pubsub_patterns', PUBSUB.numpat()),
+        ],
+        'replication': lambda: persister.replication.info() if persister is not None else [('role', 'master')],
+        'commandstats': SERVER_STATS.command_info,
+        'keyspace': lambda: _info_keyspace(datastore),
+    }
+
+# sections listed by a bare INFO; as in redis, commandstats must be asked for
+INFO_DEFAULT_SECTIONS = ('server', 'clients', 'memory', 'persistence', 'stats', 'replication', 'keyspace')
+
+@command('info', -1, ('loading',), pass_persister=True)
+def _handle_info(command, datastore, persister):
+    sections = _info_sections(datastore, persister)
+    requested = [c.data.decode(errors='replace').lower() for c in command[1:]] or ['default']
+    names = []
+    for name in requested:
+        if name == 'default':
+            names.extend(INFO_DEFAULT_SECTIONS)
+        elif name in ('all', 'everything'):
+            names.extend(sections)
+        elif name in sections:
+            names.append(name)
+    lines = []
+    for name in dict.fromkeys(names):
+        if lines:
+            lines.append('')
+        lines.append(f'# {name.capitalize()}')
+        lines.extend(f'{field}:{value}' for field, value in sections[name]())
+    return BulkString(''.join(line + '\r\n' for line in lines).encode())
+
+SLOWLOG_DEFAULT_COUNT = 10
+
+@command('slowlog', -2, ('admin',))
+def _handle_slowlog(command, datastore):
+    match command[1].data.upper(), len(command):
+        case b'GET', 2 | 3:
+            try:
+                count = int(command[2].data) if len(command) == 3 else SLOWLOG_DEFAULT_COUNT
+            except ValueError:
+                return Error(NOT_INTEGER_ERROR)
+            if count < 0:
+                count = len(SLOW_LOG)
+            return Array([
+                Array([
+                    Integer(entry_id),
+                    Integer(timestamp),
+                    Integer(duration_us),
+                    Array([BulkString(arg) for arg in args]),
+                    BulkString(address.encode()),
+                    BulkString(b''),
+                ])
+                for entry_id, timestamp, duration_us, args, address in SLOW_LOG.get(count)
+            ])
+        case b'LEN', 2:
+            return Integer(len(SLOW_LOG))
+        case b'RESET', 2:
+            SLOW_LOG.reset()
+            return SimpleString('OK')
+    return Error("ERR unknown subcommand or wrong number of arguments for 'slowlog' command")
+
+@command('latency', -2, ('admin',))
+def _handle_latency(command, datastore):
+    if command[1].data.upper() != b'HISTOGRAM':
+        return Error("ERR unknown subcommand or wrong number of arguments for 'latency' command")
+    names = [c.data.decode(errors='replace').lower() for c in command[2:]]
+    commands = dict(SERVER_STATS.commands)
+    reply = []
+    # a flattened map of command -> {calls, histogram_usec}, as redis sends over RESP2
+    for name in sorted(commands) if not names else dict.fromkeys(names):
+        stats = commands.get(name)
+        if stats is None:
+            continue
+        histogram = []
+        for bucket, count in stats.histogram_usec():
+            histogram.extend((Integer(bucket), Integer(count)))
+        reply.extend((
+            BulkString(name.encode()),
+            Array([BulkString(b'calls'), Integer(stats.calls), BulkString(b'histogram_usec'), Array(histogram)]),
+        ))
+    return Array(reply)
+
+@command('debug', -2, ('admin',))
+def _handle_debug(command, datastore):
+    if command[1].data.upper() != b'PROFILE' or len(command) < 3:
+        return Error("ERR unknown subcommand or wrong number of arguments for 'debug' command")
+    match command[2].data.upper(), len(command):
+        case b'START', 3:
+            if not PROFILER.start():
+                return Error('ERR profiler already running')
+            return SimpleString('OK')
+        case b'STOP', 3 | 4:
+            filename = command[3].data.decode(errors='replace') if len(command) == 4 else PROFILE_FILENAME
+            # clients may only name a profile in the working directory, never
+            # a path or one of the server's own files
+            if os.path.basename(filename) != filename or not filename.endswith('.prof') or filename == '.prof':
+                return Error('ERR profile file must be a file name ending in .prof')
+            try:
+                threads = PROFILER.stop(filename)
+            except OSError as e:
+                return Error(f'ERR {e}')
+            if threads is None:
+                return Error('ERR profiler not running')
+            return SimpleString(f'Profile of {threads} threads written to {filename}')
+    return Error("ERR unknown subcommand or wrong number of arguments for 'debug' command")
 
 def _handle_unrecognised_command(command):
-    args = " ".join((f"'{c.data.decode()}'" for c in command[1:]))
+    args = " ".join((f"'{c.data.decode(errors='replace')}'" for c in command[1:]))
     return Error(
-        f"ERR unknown command '{command[0].data.decode()}', with args beginning with: {args}"
+        f"ERR unknown command '{command[0].data.decode(errors='replace')}', with args beginning with: {args}"
     )
 
-def handle_command(command, datastore, persister=None):
-    match command[0].data.decode().upper():
-        case 'ECHO':
-            return _handle_echo(command)
-        case 'PING':
-            return _handle_ping(command)
-        case 'SET':
-            return _handle_set(command, datastore, persister)
-        case 'GET':
-            return _handle_get(command, datastore)
-        case 'EXISTS':
-            return _handle_exists(command, datastore)
-        case 'DEL':
-            return _handle_del(command, datastore, persister)
-        case 'INCR':
-            return _handle_incr(command, datastore, persister)
-        case 'DECR':
-            return _handle_decr(command, datastore, persister)
-        case 'LPUSH':
-            return _handle_lpush(command, datastore, persister)
-        case 'RPUSH':
-            return _handle_rpush(command, datastore, persister)
-        case 'LRANGE':
-            return _handle_lrange(command, datastore)
-    return _handle_unrecognised_command(command)
+def handle_command(command, datastore, persister=None, client=None, replicated=False):
+    spec = lookup_command(command[0].data)
+    if spec is None:
+        return _handle_unrecognised_command(command)
+    if not spec.check_arity(len(command)):
+        SERVER_STATS.reject(spec.name)
+        return Error(f"ERR wrong number of arguments for '{spec.name}' command")
+    start = perf_counter_ns()
+    result = _execute_command(spec, command, datastore, persister, client, replicated)
+    duration = perf_counter_ns() - start
+    SERVER_STATS.record(spec.name, duration, type(result) is Error)
+    if duration >= SLOW_LOG.threshold_ns:
+        SLOW_LOG.add(command, duration, client.address if client is not None else None)
+    return result
+
+def _evict_logged(persister, key, remove):
+    # evictions reach the AOF as deletes so a reload ends in the same state;
+    # removing and logging under the key's stripe keeps a concurrent write of
+    # the key from landing between the two
+    with persister.command_lock.stripes([key])[0]:
+        if not remove():
+            return False
+        persister.log_command([BulkString(b'DEL'), BulkString(key)])
+        return True
+
+def _execute_command(spec, command, datastore, persister, client, replicated):
+    if spec.pass_client:
+        return spec.handler(command, datastore, persister, client)
+    if spec.pass_persister:
+        return spec.handler(command, datastore, persister)
+    # a replica applies whatever its primary did, which already evicted for
+    # the dataset (replica-ignore-maxmemory in redis)
+    if datastore.maxmemory and 'denyoom' in spec.flags and not replicated:
+        evicted, freed = datastore.free_memory(partial(_evict_logged, persister) if persister is not None else None)
+        SERVER_STATS.evicted_keys += len(evicted)
+        if not freed:
+            return Error(OOM_ERROR)
+    if persister is None or not spec.is_write:
+        return spec.handler(command, datastore)
+    if spec.rewrite is not None:
+        command = spec.rewrite(command)
+        # EXPIRE runs as the PEXPIREAT it is logged as
+        spec = lookup_command(command[0].data)
+    stripes = persister.command_lock.stripes(spec.keys(command))
+    for stripe in stripes:
+        stripe.acquire()
+    try:
+        result = spec.handler(command, datastore)
+        if not isinstance(result, Error):
+            persister.log_command(spec.propagate(command) if spec.propagate else command)
+    finally:
+        for stripe in reversed(stripes):
+            stripe.release()
+    return result
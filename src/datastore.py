@@ -1,117 +1,965 @@
 from collections import deque
-from dataclasses import dataclass
 from itertools import islice
-from random import sample
+from heapq import heapify, heappop, heappush
+from random import randrange, sample
 from threading import Lock
 from time import time, time_ns
 
+from src.eviction import (
+    EVICTION_POOL_SIZE,
+    EVICTION_SAMPLES,
+    LFU_INIT_VAL,
+    LFU_MAX,
+    MAXMEMORY_POLICIES,
+    entry_size,
+    lfu_counter,
+    lfu_touch,
+    value_size,
+)
+from src.hashes import Hash
+from src.hashslot import key_hash_slot
+from src.sets import Set, difference, intersect, union
+from src.sortedsets import SortedSet, SortedSetScores
+
+ACTIVE_EXPIRE_BATCH = 1000
+DEFAULT_SHARDS = 16
+INT64_MIN = -2**63
+INT64_MAX = 2**63 - 1
+EMBSTR_SIZE_LIMIT = 44
+NS_PER_SECOND = 10**9
+NS_PER_MINUTE = 60 * NS_PER_SECOND
+
 def to_ns(seconds):
     return seconds * 10**9
 
-@dataclass
-class DataEntry:
-    value: any
-    expiry: int = 0
+def encode_string(value):
+    # canonical decimal strings that fit in 64 bits are held as ints, which
+    # are smaller than bytes and let INCR/DECR skip parsing and formatting
+    if 0 < len(value) <= 20 and (value.isdigit() or value[0] == 45 and value[1:].isdigit()):
+        number = int(value)
+        if INT64_MIN <= number <= INT64_MAX and b'%d' % number == value:
+            return number
+    return value
 
-    def __len__(self):
-        return len(self.value)
+def decode_string(value):
+    return b'%d' % value if type(value) is int else value
+
+def is_string(value):
+    return isinstance(value, (bytes, int))
+
+def copy_value(value):
+    # containers are copied so later writes do not leak into the copy, and
+    # integer encoded strings are turned back into bytes
+    if isinstance(value, deque):
+        return list(value)
+    if isinstance(value, (Hash, Set, SortedSet)):
+        return value.copy()
+    return decode_string(value)
+
+def load_value(value):
+    # inverse of copy_value for values read from a snapshot or DUMP payload
+    if isinstance(value, list):
+        return deque(value)
+    if isinstance(value, bytes):
+        return encode_string(value)
+    if isinstance(value, SortedSetScores):
+        return value.to_sorted_set()
+    return value
+
+def value_encoding(value):
+    if type(value) is int:
+        return 'int'
+    if isinstance(value, bytes):
+        return 'embstr' if len(value) <= EMBSTR_SIZE_LIMIT else 'raw'
+    if isinstance(value, deque):
+        return 'quicklist'
+    if isinstance(value, Hash):
+        return 'listpack' if value.is_compact else 'hashtable'
+    if isinstance(value, Set):
+        return 'intset' if value.is_intset else 'hashtable'
+    return 'skiplist'
+
+# Values and expiry times are kept in two parallel tables, like redis' dict
+# and expires dicts, so keys without a TTL cost a single dict slot and no
+# per key wrapper object.
+class Shard:
+    __slots__ = (
+        'data', 'expires', 'lock', 'expiry_heap', 'used_memory', 'tracking', 'access', 'clock', 'samples', 'slots'
+    )
 
-class DataStore:
     def __init__(self):
-        self._data = dict()
-        self._lock = Lock()
-    
+        self.data = dict()
+        self.expires = dict()
+        self.lock = Lock()
+        # (expiry, key) min-heap; entries whose expiry no longer matches the
+        # stored one are stale and skipped when popped
+        self.expiry_heap = []
+        # estimated bytes held by this shard's keys and values
+        self.used_memory = 0
+        # eviction state, only kept under an LRU or LFU maxmemory policy:
+        # the last access clock (LRU) or packed LFU counter per key, and every
+        # key in a list for O(1) random sampling, with deleted keys dropped
+        # lazily when sampled
+        self.tracking = None
+        self.access = None
+        self.clock = 0
+        self.samples = None
+        # hash slot -> set of keys, only kept in cluster mode
+        self.slots = None
+
+    # callers must hold the shard lock for everything below
+    def live_value(self, key):
+        value = self.data.get(key)
+        if value is not None:
+            if self.expires:
+                expiry = self.expires.get(key)
+                if expiry is not None and expiry < time_ns():
+                    self.remove(key)
+                    return None
+            if self.tracking is not None:
+                self.touch(key)
+        return value
+
+    def touch(self, key):
+        if self.tracking == 'lru':
+            self.access[key] = self.clock
+        else:
+            self.access[key] = lfu_touch(self.access.get(key), self.clock)
+
+    def store(self, key, value):
+        # plain writes drop any TTL, like SET does
+        old = self.data.get(key)
+        self.data[key] = value
+        if old is None:
+            self.used_memory += entry_size(key, value)
+            if self.samples is not None:
+                self.add_sample(key)
+            if self.slots is not None:
+                self.index_key(key)
+        else:
+            self.used_memory += value_size(value) - value_size(old)
+        if self.expires:
+            self.expires.pop(key, None)
+        if self.tracking is not None:
+            self.touch(key)
+
+    def replace(self, key, value):
+        # overwrites an existing key and keeps its TTL
+        self.used_memory += value_size(value) - value_size(self.data[key])
+        self.data[key] = value
+
+    def resized(self, size, value):
+        # accounts for a container changed in place, size is its value_size
+        # before the change
+        self.used_memory += value_size(value) - size
+
+    def store_with_expiry(self, key, value, timestamp):
+        self.store(key, value)
+        self.set_expiry(key, timestamp)
+
+    def set_expiry(self, key, timestamp):
+        self.expires[key] = timestamp
+        heappush(self.expiry_heap, (timestamp, key))
+
+    def remove(self, key):
+        self.used_memory -= entry_size(key, self.data.pop(key))
+        if self.expires:
+            self.expires.pop(key, None)
+        if self.access is not None:
+            self.access.pop(key, None)
+        if self.slots is not None:
+            slot = key_hash_slot(key)
+            keys = self.slots[slot]
+            keys.discard(key)
+            if not keys:
+                del self.slots[slot]
+
+    def index_key(self, key):
+        self.slots.setdefault(key_hash_slot(key), set()).add(key)
+
+    def expire_batch(self, now):
+        heap = self.expiry_heap
+        for _ in range(ACTIVE_EXPIRE_BATCH):
+            if not heap or heap[0][0] > now:
+                return True
+            expiry, key = heappop(heap)
+            if self.expires.get(key) == expiry:
+                self.remove(key)
+        return False
+
+    def compact_expiry_heap(self):
+        self.expiry_heap = [(expiry, key) for key, expiry in self.expires.items()]
+        heapify(self.expiry_heap)
+
+    def soonest_expiry(self):
+        # (expiry, key) of the key closest to expiring, dropping stale entries
+        heap = self.expiry_heap
+        while heap and self.expires.get(heap[0][1]) != heap[0][0]:
+            heappop(heap)
+        return heap[0] if heap else None
+
+    def add_sample(self, key):
+        self.samples.append(key)
+        if len(self.samples) > 2 * len(self.data) + ACTIVE_EXPIRE_BATCH:
+            self.samples = list(self.data)
+
+    def sample(self, count):
+        samples, data = self.samples, self.data
+        keys = []
+        while samples and len(keys) < count:
+            i = randrange(len(samples))
+            key = samples[i]
+            if key in data:
+                keys.append(key)
+            else:
+                samples[i] = samples[-1]
+                samples.pop()
+        return keys
+
+    def eviction_score(self, key):
+        # higher is a better victim: idle time for LRU, rarity for LFU
+        if self.tracking == 'lru':
+            return self.clock - self.access.get(key, 0)
+        packed = self.access.get(key)
+        return LFU_MAX - (lfu_counter(packed, self.clock) if packed is not None else LFU_INIT_VAL)
+
+# The keyspace is split into independently locked shards routed by key hash,
+# so commands on different keys rarely contend. Operations spanning several
+# shards lock them in index order to stay deadlock free.
+class DataStore:
+    def __init__(self, shards=DEFAULT_SHARDS):
+        if shards < 1 or shards & (shards - 1):
+            raise ValueError('shard count must be a power of two')
+        self._shards = [Shard() for _ in range(shards)]
+        self._shard_mask = shards - 1
+        self.maxmemory = 0
+        self.maxmemory_policy = 'noeviction'
+        self._eviction_lock = Lock()
+        # best (score, key) eviction candidates seen so far, best last
+        self._eviction_pool = []
+
+    def _shard(self, key):
+        return self._shards[hash(key) & self._shard_mask]
+
+    def _group_by_shard(self, keys):
+        groups = {}
+        for key in keys:
+            groups.setdefault(hash(key) & self._shard_mask, []).append(key)
+        return [(self._shards[index], groups[index]) for index in sorted(groups)]
+
+    def _acquire(self, shards):
+        for shard in shards:
+            shard.lock.acquire()
+
+    def _release(self, shards):
+        for shard in reversed(shards):
+            shard.lock.release()
+
     def __getitem__(self, key):
-        with self._lock:
-            entry = self._data[key]
-            if entry.expiry and entry.expiry < time_ns():
-                del self._data[key]
-                raise KeyError
-            return self._data[key].value
-    
+        shard = self._shard(key)
+        with shard.lock:
+            value = shard.live_value(key)
+            if value is None:
+                raise KeyError(key)
+            return decode_string(value)
+
     def __setitem__(self, key, value):
-        with self._lock:
-            self._data[key] = DataEntry(value)
+        shard = self._shard(key)
+        with shard.lock:
+            shard.store(key, encode_string(value) if type(value) is bytes else value)
 
     def __contains__(self, key):
-        with self._lock:
-            return key in self._data
-        
+        shard = self._shard(key)
+        with shard.lock:
+            return shard.live_value(key) is not None
+
     def __delitem__(self, key):
-        with self._lock:
-            del self._data[key]
+        shard = self._shard(key)
+        with shard.lock:
+            shard.remove(key)
 
-    def incr(self, key):
-        with self._lock:
-            entry = self._data.get(key, DataEntry(0))
-            value = int(entry.value) + 1
-            entry.value = str(value)
-            self._data[key] = entry
+    def __len__(self):
+        return sum(len(shard.data) for shard in self._shards)
+
+    def expiring_keys(self):
+        return sum(len(shard.expires) for shard in self._shards)
+
+    def delete(self, keys):
+        groups = self._group_by_shard(keys)
+        shards = [shard for shard, _ in groups]
+        count = 0
+        self._acquire(shards)
+        try:
+            for shard, shard_keys in groups:
+                for key in shard_keys:
+                    if shard.live_value(key) is not None:
+                        shard.remove(key)
+                        count += 1
+        finally:
+            self._release(shards)
+        return count
+
+    def exists(self, keys):
+        groups = self._group_by_shard(keys)
+        shards = [shard for shard, _ in groups]
+        count = 0
+        self._acquire(shards)
+        try:
+            for shard, shard_keys in groups:
+                for key in shard_keys:
+                    if shard.live_value(key) is not None:
+                        count += 1
+        finally:
+            self._release(shards)
+        return count
+
+    def encoding(self, key):
+        shard = self._shard(key)
+        with shard.lock:
+            value = shard.live_value(key)
+            return value_encoding(value) if value is not None else None
+
+    # batched string commands: every shard touched is locked once for the
+    # whole call, so a batch is applied atomically
+    def mget(self, keys):
+        groups = self._group_by_shard(keys)
+        shards = [shard for shard, _ in groups]
+        values = {}
+        self._acquire(shards)
+        try:
+            for shard, shard_keys in groups:
+                for key in shard_keys:
+                    value = shard.live_value(key)
+                    if value is not None and is_string(value):
+                        values[key] = decode_string(value)
+        finally:
+            self._release(shards)
+        return [values.get(key) for key in keys]
+
+    def mset(self, pairs, only_new=False):
+        groups = self._group_by_shard(pairs)
+        shards = [shard for shard, _ in groups]
+        self._acquire(shards)
+        try:
+            if only_new and any(shard.live_value(key) is not None for shard, shard_keys in groups for key in shard_keys):
+                return False
+            for shard, shard_keys in groups:
+                for key in shard_keys:
+                    shard.store(key, encode_string(pairs[key]))
+        finally:
+            self._release(shards)
+        return True
+
+    def getset(self, key, value):
+        shard = self._shard(key)
+        with shard.lock:
+            current = shard.live_value(key)
+            if current is not None and not is_string(current):
+                raise TypeError
+            shard.store(key, encode_string(value))
+            return decode_string(current) if current is not None else None
+
+    def setnx(self, key, value):
+        shard = self._shard(key)
+        with shard.lock:
+            if shard.live_value(key) is not None:
+                return False
+            shard.store(key, encode_string(value))
+            return True
+
+    def append(self, key, value):
+        shard = self._shard(key)
+        with shard.lock:
+            current = shard.live_value(key)
+            if current is None:
+                shard.store(key, encode_string(value))
+                return len(value)
+            if not is_string(current):
+                raise TypeError
+            value = decode_string(current) + value
+            # re-encoded so an append that yields a number still INCRs
+            shard.replace(key, encode_string(value))
+            return len(value)
+
+    def incrby(self, key, increment):
+        shard = self._shard(key)
+        with shard.lock:
+            current = shard.live_value(key)
+            if current is not None and type(current) is not int:
+                if isinstance(current, bytes):
+                    raise ValueError('value is not an integer')
+                raise TypeError
+            value = (current or 0) + increment
+            if not INT64_MIN <= value <= INT64_MAX:
+                raise OverflowError
+            if current is None:
+                shard.store(key, value)
+            else:
+                # keeps the TTL, like redis
+                shard.replace(key, value)
         return value
-    
+
+    def incr(self, key):
+        return self.incrby(key, 1)
+
     def decr(self, key):
-        with self._lock:
-            entry = self._data.get(key, DataEntry(0))
-            value = int(entry.value) - 1
-            entry.value = str(value)
-            self._data[key] = entry
+        return self.incrby(key, -1)
+
+    def _list(self, shard, key, create=False):
+        value = shard.live_value(key)
+        if value is None:
+            if not create:
+                return None
+            value = deque()
+            shard.store(key, value)
+        elif not isinstance(value, deque):
+            raise TypeError
         return value
-    
+
     def lpush(self, key, element):
-        with self._lock:
-            entry = self._data.get(key, DataEntry(deque()))
-            if not isinstance(entry.value, deque):
-                raise TypeError
-            entry.value.appendleft(element)
-            self._data[key] = entry
-            return len(entry.value)
-    
+        shard = self._shard(key)
+        with shard.lock:
+            value = self._list(shard, key, create=True)
+            size = value_size(value)
+            value.appendleft(element)
+            shard.resized(size, value)
+            return len(value)
+
     def rpush(self, key, element):
-        with self._lock:
-            entry = self._data.get(key, DataEntry(deque()))
-            if not isinstance(entry.value, deque):
-                raise TypeError
-            entry.value.append(element)
-            self._data[key] = entry
-            return len(entry.value)
-        
+        shard = self._shard(key)
+        with shard.lock:
+            value = self._list(shard, key, create=True)
+            size = value_size(value)
+            value.append(element)
+            shard.resized(size, value)
+            return len(value)
+
     def lrange(self, key, start, end):
-        with self._lock:
-            entry = self._data.get(key, DataEntry(deque()))
-            if not isinstance(entry.value, deque):
-                raise TypeError
-            length = len(entry.value)
+        shard = self._shard(key)
+        with shard.lock:
+            value = self._list(shard, key)
+            if value is None:
+                return []
+            length = len(value)
             if start > length:
                 return []
             if end > length:
                 end = length
             if start < 0:
                 start = max(length + start, 0)
-            return list(islice(entry.value, start, end))
+            return list(islice(value, start, end))
+
+    def _typed_value(self, shard, key, value_type, create=False):
+        # the container stored at key, None when missing, TypeError when the
+        # key holds another type
+        value = shard.live_value(key)
+        if value is None:
+            if not create:
+                return None
+            value = value_type()
+            shard.store(key, value)
+        elif not isinstance(value, value_type):
+            raise TypeError
+        return value
+
+    def _hash(self, shard, key, create=False):
+        return self._typed_value(shard, key, Hash, create)
+
+    def hset(self, key, pairs):
+        shard = self._shard(key)
+        with shard.lock:
+            value = self._hash(shard, key, create=True)
+            size = value_size(value)
+            count = value.update(pairs)
+            shard.resized(size, value)
+            return count
+
+    def hget(self, key, field):
+        shard = self._shard(key)
+        with shard.lock:
+            value = self._hash(shard, key)
+            return value.get(field) if value is not None else None
+
+    def hmget(self, key, fields):
+        shard = self._shard(key)
+        with shard.lock:
+            value = self._hash(shard, key)
+            if value is None:
+                return [None] * len(fields)
+            return [value.get(field) for field in fields]
+
+    def hgetall(self, key):
+        shard = self._shard(key)
+        with shard.lock:
+            value = self._hash(shard, key)
+            return value.items() if value is not None else []
+
+    def hdel(self, key, fields):
+        shard = self._shard(key)
+        with shard.lock:
+            value = self._hash(shard, key)
+            if value is None:
+                return 0
+            size = value_size(value)
+            count = sum(value.delete(field) for field in fields)
+            shard.resized(size, value)
+            if not len(value):
+                shard.remove(key)
+            return count
+
+    def hincrby(self, key, field, increment):
+        shard = self._shard(key)
+        with shard.lock:
+            value = self._hash(shard, key)
+            current = value.get(field) if value is not None else None
+            if current is not None:
+                # only canonical 64 bit decimals count, as for INCR
+                current = encode_string(current)
+                if type(current) is not int:
+                    raise ValueError('hash value is not an integer')
+            result = (current or 0) + increment
+            if not INT64_MIN <= result <= INT64_MAX:
+                raise OverflowError
+            if value is None:
+                value = self._hash(shard, key, create=True)
+            size = value_size(value)
+            value.set(field, b'%d' % result)
+            shard.resized(size, value)
+            return result
+
+    def hlen(self, key):
+        shard = self._shard(key)
+        with shard.lock:
+            value = self._hash(shard, key)
+            return len(value) if value is not None else 0
+
+    def hscan(self, key, cursor, count):
+        shard = self._shard(key)
+        with shard.lock:
+            value = self._hash(shard, key)
+            if value is None:
+                return 0, []
+            # the scan index is part of the hash's memory while it exists
+            size = value_size(value)
+            result = value.scan(cursor, count)
+            shard.resized(size, value)
+            return result
+
+    def _set(self, shard, key, create=False):
+        return self._typed_value(shard, key, Set, create)
+
+    def sadd(self, key, members):
+        shard = self._shard(key)
+        with shard.lock:
+            value = self._set(shard, key, create=True)
+            size = value_size(value)
+            count = sum(value.add(member) for member in members)
+            shard.resized(size, value)
+            return count
+
+    def srem(self, key, members):
+        shard = self._shard(key)
+        with shard.lock:
+            value = self._set(shard, key)
+            if value is None:
+                return 0
+            size = value_size(value)
+            count = sum(value.remove(member) for member in members)
+            shard.resized(size, value)
+            if not len(value):
+                shard.remove(key)
+            return count
+
+    def sismember(self, key, member):
+        shard = self._shard(key)
+        with shard.lock:
+            value = self._set(shard, key)
+            return value is not None and member in value
+
+    def smembers(self, key):
+        shard = self._shard(key)
+        with shard.lock:
+            value = self._set(shard, key)
+            return value.members() if value is not None else []
+
+    def scard(self, key):
+        shard = self._shard(key)
+        with shard.lock:
+            value = self._set(shard, key)
+            return len(value) if value is not None else 0
+
+    def _set_operation(self, operation, keys, destination=None):
+        # runs operation over the sets at keys (missing keys are empty sets)
+        # with every involved shard locked, optionally storing the result
+        groups = self._group_by_shard(keys if destination is None else keys + [destination])
+        shards = [shard for shard, _ in groups]
+        self._acquire(shards)
+        try:
+            sets = [self._set(self._shard(key), key) or Set() for key in keys]
+            members = operation(sets)
+            if destination is None:
+                return members
+            shard = self._shard(destination)
+            if members:
+                shard.store(destination, Set.from_members(members))
+            elif shard.live_value(destination) is not None:
+                shard.remove(destination)
+            return len(members)
+        finally:
+            self._release(shards)
+
+    def sinter(self, keys):
+        return self._set_operation(intersect, keys)
+
+    def sunion(self, keys):
+        return self._set_operation(union, keys)
+
+    def sdiff(self, keys):
+        return self._set_operation(lambda sets: difference(sets[0], sets[1:]), keys)
+
+    def sinterstore(self, destination, keys):
+        return self._set_operation(intersect, keys, destination)
+
+    def _zset(self, shard, key, create=False):
+        return self._typed_value(shard, key, SortedSet, create)
+
+    def zadd(self, key, pairs, nx=False, xx=False, ch=False):
+        shard = self._shard(key)
+        with shard.lock:
+            value = self._zset(shard, key)
+            if value is None:
+                if xx:
+                    return 0
+                value = self._zset(shard, key, create=True)
+            size = value_size(value)
+            count = 0
+            for member, score in pairs:
+                current = value.score(member)
+                if (nx and current is not None) or (xx and current is None):
+                    continue
+                value.add(member, score)
+                if current is None or (ch and current != score):
+                    count += 1
+            shard.resized(size, value)
+            if not len(value):
+                shard.remove(key)
+            return count
+
+    def zincrby(self, key, member, increment, nx=False, xx=False):
+        # returns the new score, or None when NX/XX prevented the update
+        shard = self._shard(key)
+        with shard.lock:
+            value = self._zset(shard, key)
+            current = value.score(member) if value is not None else None
+            if (nx and current is not None) or (xx and current is None):
+                return None
+            score = (current or 0.0) + increment
+            if score != score:
+                raise ValueError('resulting score is not a number (NaN)')
+            if value is None:
+                value = self._zset(shard, key, create=True)
+            size = value_size(value)
+            value.add(member, score)
+            shard.resized(size, value)
+            return score
+
+    def zscore(self, key, member):
+        shard = self._shard(key)
+        with shard.lock:
+            value = self._zset(shard, key)
+            return value.score(member) if value is not None else None
+
+    def zrank(self, key, member):
+        shard = self._shard(key)
+        with shard.lock:
+            value = self._zset(shard, key)
+            return value.rank(member) if value is not None else None
+
+    def zrange(self, key, start, stop):
+        shard = self._shard(key)
+        with shard.lock:
+            value = self._zset(shard, key)
+            return value.range_by_rank(start, stop) if value is not None else []
+
+    def zrangebyscore(self, key, low, high, low_exclusive=False, high_exclusive=False, offset=0, count=-1):
+        shard = self._shard(key)
+        with shard.lock:
+            value = self._zset(shard, key)
+            if value is None:
+                return []
+            return value.range_by_score(low, high, low_exclusive, high_exclusive, offset, count)
+
+    def zrem(self, key, members):
+        shard = self._shard(key)
+        with shard.lock:
+            value = self._zset(shard, key)
+            if value is None:
+                return 0
+            size = value_size(value)
+            count = sum(value.remove(member) for member in members)
+            shard.resized(size, value)
+            if not len(value):
+                shard.remove(key)
+            return count
+
+    def zcard(self, key):
+        shard = self._shard(key)
+        with shard.lock:
+            value = self._zset(shard, key)
+            return len(value) if value is not None else 0
 
     def set_with_expiry(self, key, value, expiry):
-        with self._lock:
-            expiring_timestamp = time_ns() + to_ns(expiry)
-            self._data[key] = DataEntry(value, expiring_timestamp)
+        self.set_with_expiry_at(key, value, time_ns() + int(to_ns(expiry)))
+
+    def set_with_expiry_at(self, key, value, timestamp):
+        shard = self._shard(key)
+        with shard.lock:
+            shard.store_with_expiry(key, encode_string(value) if type(value) is bytes else value, timestamp)
+
+    def expire_at(self, key, timestamp):
+        shard = self._shard(key)
+        with shard.lock:
+            if shard.live_value(key) is None:
+                return False
+            if timestamp <= time_ns():
+                shard.remove(key)
+                return True
+            shard.set_expiry(key, timestamp)
+            return True
+
+    def persist(self, key):
+        shard = self._shard(key)
+        with shard.lock:
+            if shard.live_value(key) is None:
+                return False
+            return shard.expires.pop(key, None) is not None
+
+    def ttl(self, key):
+        shard = self._shard(key)
+        with shard.lock:
+            if shard.live_value(key) is None:
+                return -2
+            expiry = shard.expires.get(key)
+            if expiry is None:
+                return -1
+            return max(expiry - time_ns(), 0)
+
+    def index_slots(self):
+        # starts keeping the hash slot -> keys index behind
+        # count_keys_in_slot and keys_in_slot
+        self._acquire(self._shards)
+        try:
+            for shard in self._shards:
+                shard.slots = {}
+                for key in shard.data:
+                    shard.index_key(key)
+        finally:
+            self._release(self._shards)
+
+    def count_keys_in_slot(self, slot):
+        count = 0
+        for shard in self._shards:
+            with shard.lock:
+                count += len(shard.slots.get(slot, ()))
+        return count
+
+    def keys_in_slot(self, slot, count):
+        keys = []
+        for shard in self._shards:
+            if len(keys) >= count:
+                break
+            with shard.lock:
+                keys.extend(islice(shard.slots.get(slot, ()), count - len(keys)))
+        return keys
+
+    def dump(self, key):
+        shard = self._shard(key)
+        with shard.lock:
+            value = shard.live_value(key)
+            if value is None:
+                return None
+            return copy_value(value), shard.expires.get(key, 0)
+
+    def restore(self, key, value, expiry=0, replace=False):
+        shard = self._shard(key)
+        with shard.lock:
+            if not replace and shard.live_value(key) is not None:
+                return False
+            if expiry:
+                shard.store_with_expiry(key, load_value(value), expiry)
+            else:
+                shard.store(key, load_value(value))
+            return True
+
+    def snapshot(self):
+        # point in time copy of every live key as (key, value, expiry)
+        self._acquire(self._shards)
+        try:
+            now = time_ns()
+            entries = []
+            for shard in self._shards:
+                expires = shard.expires
+                entries.extend(
+                    (key, copy_value(value), expires.get(key, 0))
+                    for key, value in shard.data.items()
+                    if expires.get(key, now) >= now
+                )
+            return entries
+        finally:
+            self._release(self._shards)
+
+    def bulk_load(self, entries):
+        self._acquire(self._shards)
+        try:
+            now = time_ns()
+            shards, mask = self._shards, self._shard_mask
+            for key, value, expiry in entries:
+                if expiry and expiry < now:
+                    continue
+                shard = shards[hash(key) & mask]
+                value = load_value(value)
+                old = shard.data.get(key)
+                shard.data[key] = value
+                if old is not None:
+                    shard.used_memory -= entry_size(key, old)
+                else:
+                    if shard.samples is not None:
+                        shard.samples.append(key)
+                    if shard.slots is not None:
+                        shard.index_key(key)
+                shard.used_memory += entry_size(key, value)
+                if expiry:
+                    shard.expires[key] = expiry
+                    shard.expiry_heap.append((expiry, key))
+                elif shard.expires:
+                    shard.expires.pop(key, None)
+            for shard in shards:
+                heapify(shard.expiry_heap)
+        finally:
+            self._release(self._shards)
+
+    def clear(self):
+        self._acquire(self._shards)
+        try:
+            for shard in self._shards:
+                shard.data.clear()
+                shard.expires.clear()
+                shard.expiry_heap.clear()
+                shard.used_memory = 0
+                if shard.tracking is not None:
+                    shard.access.clear()
+                    shard.samples.clear()
+                if shard.slots is not None:
+                    shard.slots.clear()
+            self._eviction_pool = []
+        finally:
+            self._release(self._shards)
+
+    def set_maxmemory(self, maxmemory, policy='noeviction'):
+        if policy not in MAXMEMORY_POLICIES:
+            raise ValueError(f'unknown maxmemory policy {policy!r}')
+        tracking = {'allkeys-lru': 'lru', 'allkeys-lfu': 'lfu'}.get(policy)
+        self._acquire(self._shards)
+        try:
+            self.maxmemory = maxmemory
+            self.maxmemory_policy = policy
+            self._eviction_pool = []
+            for shard in self._shards:
+                shard.tracking = tracking
+                shard.access = {} if tracking else None
+                shard.samples = list(shard.data) if tracking else None
+        finally:
+            self._release(self._shards)
+        self.update_clock()
+
+    def used_memory(self):
+        return sum(shard.used_memory for shard in self._shards)
+
+    def update_clock(self, now=None):
+        # coarse access clock shared by every key touched in the same tick,
+        # seconds for LRU and minutes for LFU decay
+        now = time_ns() if now is None else now
+        clock = now // (NS_PER_SECOND if self.maxmemory_policy == 'allkeys-lru' else NS_PER_MINUTE)
+        for shard in self._shards:
+            shard.clock = clock
+
+    def free_memory(self, evict=None):
+        # evicts keys until the estimated memory use is under maxmemory;
+        # returns the evicted keys and whether enough could be freed. When
+        # given, evict(key, remove) is called for each victim instead of
+        # removing it directly, so the caller can hold its own locks around
+        # remove() and log the eviction; it returns remove()'s result
+        evicted = []
+        if not self.maxmemory or self.used_memory() <= self.maxmemory:
+            return evicted, True
+        if self.maxmemory_policy == 'noeviction':
+            return evicted, False
+        with self._eviction_lock:
+            while self.used_memory() > self.maxmemory:
+                if self.maxmemory_policy == 'volatile-ttl':
+                    key = self._evict_soonest_expiring(evict)
+                else:
+                    key = self._evict_sampled(evict)
+                if key is None:
+                    return evicted, False
+                evicted.append(key)
+        return evicted, True
+
+    def _evict(self, key, still_victim, evict):
+        shard = self._shard(key)
+
+        def remove():
+            # the key may have been rewritten since it was picked
+            with shard.lock:
+                if not still_victim(shard):
+                    return False
+                shard.remove(key)
+                return True
+
+        return evict(key, remove) if evict is not None else remove()
+
+    def _evict_soonest_expiring(self, evict):
+        # the expiry heaps already order keys by TTL, so the victim is exact
+        candidates = []
+        for shard in self._shards:
+            with shard.lock:
+                soonest = shard.soonest_expiry()
+            if soonest is not None:
+                candidates.append(soonest)
+        for expiry, key in sorted(candidates):
+            if self._evict(key, lambda shard: shard.expires.get(key) == expiry, evict):
+                return key
+        return None
+
+    def _evict_sampled(self, evict):
+        # approximated LRU/LFU like redis: sample a few random keys into a
+        # small pool of the best candidates seen so far and evict the best
+        pool = self._eviction_pool
+        pooled = {key for _, key in pool}
+        for shard in sample(self._shards, len(self._shards)):
+            with shard.lock:
+                keys = shard.sample(EVICTION_SAMPLES)
+                scored = [(shard.eviction_score(key), key) for key in keys if key not in pooled]
+            if scored:
+                pool.extend(scored)
+                pool.sort()
+                del pool[:-EVICTION_POOL_SIZE]
+                break
+        while pool:
+            _, key = pool.pop()
+            if self._evict(key, lambda shard: key in shard.data, evict):
+                return key
+        return None
 
     def auto_check_expiry(self):
-        while True:
-            try:
-                keys = sample(list(self._data.keys()), 20)
-            # when sample size is larger than sequence size, aka <20 keys stored
-            except ValueError:
-                return 
-            expired_count = 0
-            keys_count = len(keys)
-            for key in keys:
-                try:
-                    with self._lock:
-                        item = self._data[key]
-                        if item.expiry and item.expiry < time_ns():
-                            del self._data[key]
-                            expired_count += 1
-                except KeyError:
-                    pass
-            expired_ratio = expired_count / keys_count
-            if expired_count <= 0.25:
-                break 
+        if self._shards[0].tracking is not None:
+            self.update_clock()
+        for shard in self._shards:
+            done = False
+            while not done:
+                # one batch per lock hold so clients of this shard are not
+                # starved while a large number of keys expire at once
+                with shard.lock:
+                    done = shard.expire_batch(time_ns())
+                    if done and len(shard.expiry_heap) > 2 * len(shard.expires) + ACTIVE_EXPIRE_BATCH:
+                        shard.compact_expiry_heap()
@@ -0,0 +1,81 @@
+import random
+from collections import deque
+
+from src.hashes import Hash
+from src.sets import Set
+
+MAXMEMORY_POLICIES = ('noeviction', 'allkeys-lru', 'allkeys-lfu', 'volatile-ttl')
+# keys looked at per eviction, and best candidates kept between evictions,
+# as redis' maxmemory-samples and eviction pool
+EVICTION_SAMPLES = 5
+EVICTION_POOL_SIZE = 16
+
+# rough CPython costs: a dict slot plus the key's bytes header, a bytes
+# header, a boxed int, and one small element of a container
+KEY_OVERHEAD = 80
+BYTES_OVERHEAD = 33
+INT_SIZE = 32
+ELEMENT_SIZE = 64
+CONTAINER_OVERHEAD = 64
+SKIPLIST_NODE_SIZE = 200
+
+LFU_INIT_VAL = 5
+LFU_LOG_FACTOR = 10
+LFU_DECAY_MINUTES = 1
+LFU_MAX = 255
+
+MEMORY_UNITS = {'b': 1, 'k': 1000, 'kb': 1024, 'm': 1000**2, 'mb': 1024**2, 'g': 1000**3, 'gb': 1024**3}
+
+
+def parse_memory(size):
+    # "100mb" -> bytes, same units as redis.conf
+    size = size.strip().lower()
+    number = size.rstrip('bkmg')
+    unit = size[len(number):] or 'b'
+    if unit not in MEMORY_UNITS or not number.isdigit():
+        raise ValueError(f'invalid memory size {size!r}')
+    return int(number) * MEMORY_UNITS[unit]
+
+
+# O(1) estimate of a value's footprint, containers are counted per element
+# rather than walked
+def value_size(value):
+    value_type = type(value)
+    if value_type is bytes:
+        return BYTES_OVERHEAD + len(value)
+    if value_type is int:
+        return INT_SIZE
+    if value_type is Hash:
+        if value.is_compact:
+            return CONTAINER_OVERHEAD + BYTES_OVERHEAD + len(value.table)
+        size = CONTAINER_OVERHEAD + 2 * ELEMENT_SIZE * len(value)
+        if value.scan_buckets is not None:
+            # the index of an HSCAN in progress, about one entry per field
+            size += ELEMENT_SIZE * len(value)
+        return size
+    if value_type is Set and value.is_intset:
+        return CONTAINER_OVERHEAD + 8 * len(value)
+    if value_type in (deque, Set):
+        return CONTAINER_OVERHEAD + ELEMENT_SIZE * len(value)
+    return CONTAINER_OVERHEAD + (ELEMENT_SIZE + SKIPLIST_NODE_SIZE) * len(value)
+
+
+def entry_size(key, value):
+    return KEY_OVERHEAD + len(key) + value_size(value)
+
+
+# LFU counters follow redis: an 8 bit logarithmic access counter in the low
+# bits and the minute it was last decayed above it
+def lfu_counter(packed, now_minutes):
+    counter = packed & 0xFF
+    elapsed = (now_minutes - (packed >> 8)) // LFU_DECAY_MINUTES
+    return max(counter - elapsed, 0)
+
+
+def lfu_touch(packed, now_minutes):
+    counter = LFU_INIT_VAL if packed is None else lfu_counter(packed, now_minutes)
+    if counter < LFU_MAX:
+        base = max(counter - LFU_INIT_VAL, 0)
+        if random.random() < 1.0 / (base * LFU_LOG_FACTOR + 1):
+            counter += 1
+    return (now_minutes << 8) | counter
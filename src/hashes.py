@@ -0,0 +1,155 @@
+# same thresholds as redis' hash-max-listpack-entries/value
+HASH_MAX_COMPACT_ENTRIES = 128
+HASH_MAX_COMPACT_VALUE = 64
+# HSCAN cursors are the low SCAN_HASH_BITS of a field's hash, plus one so 0
+# can start and end a scan
+SCAN_HASH_BITS = 62
+SCAN_HASH_MASK = 2**SCAN_HASH_BITS - 1
+# fields per bucket of the HSCAN index when it is built
+SCAN_BUCKET_SIZE = 16
+
+
+def _iter_pairs(blob):
+    offset, size = 0, len(blob)
+    while offset < size:
+        length = blob[offset]
+        field = blob[offset + 1:offset + 1 + length]
+        offset += 1 + length
+        length = blob[offset]
+        yield field, blob[offset + 1:offset + 1 + length]
+        offset += 1 + length
+
+
+def _encode_pairs(pairs):
+    return b''.join(b'%c%b%c%b' % (len(field), field, len(value), value) for field, value in pairs)
+
+
+# A hash value. Small hashes are packed into a single bytes object of
+# length prefixed fields and values, like redis' listpack, instead of a dict
+# holding a separate bytes object per field and value. Lookups scan the blob
+# and writes rebuild it, which is cheap at this size. Past either threshold
+# the hash is converted to a dict for good.
+class Hash:
+    __slots__ = ('table', 'count', 'scan_buckets')
+
+    def __init__(self, table=b'', count=0):
+        self.table = table
+        self.count = count
+        # fields bucketed by the high bits of their hash while a scan is in
+        # progress; deleted fields are only dropped when their bucket is read
+        self.scan_buckets = None
+
+    @classmethod
+    def from_pairs(cls, pairs):
+        pairs = list(pairs)
+        if len(pairs) > HASH_MAX_COMPACT_ENTRIES \
+                or any(len(field) > HASH_MAX_COMPACT_VALUE or len(value) > HASH_MAX_COMPACT_VALUE for field, value in pairs):
+            return cls(dict(pairs))
+        return cls(_encode_pairs(pairs), len(pairs))
+
+    @classmethod
+    def from_flat(cls, items):
+        # items is a flat field, value, ... sequence, as read from a snapshot
+        return cls.from_pairs(zip(items[::2], items[1::2]))
+
+    @property
+    def is_compact(self):
+        return isinstance(self.table, bytes)
+
+    def __eq__(self, other):
+        return isinstance(other, Hash) and dict(self.items()) == dict(other.items())
+
+    def __len__(self):
+        if self.is_compact:
+            return self.count
+        return len(self.table)
+
+    def get(self, field):
+        if not self.is_compact:
+            return self.table.get(field)
+        for item_field, value in _iter_pairs(self.table):
+            if item_field == field:
+                return value
+        return None
+
+    def set(self, field, value):
+        # returns True when the field is new
+        return self.update([(field, value)]) == 1
+
+    def update(self, pairs):
+        # returns the number of new fields; the blob is decoded and rebuilt
+        # once for the whole batch
+        pairs = list(pairs)
+        if not self.is_compact:
+            size = len(self.table)
+            if self.scan_buckets is not None:
+                self._index_fields(field for field, _ in pairs if field not in self.table)
+            self.table.update(pairs)
+            return len(self.table) - size
+        current = dict(_iter_pairs(self.table))
+        size = len(current)
+        current.update(pairs)
+        if len(current) > HASH_MAX_COMPACT_ENTRIES \
+                or any(len(field) > HASH_MAX_COMPACT_VALUE or len(value) > HASH_MAX_COMPACT_VALUE for field, value in pairs):
+            self.table, self.count = current, 0
+        else:
+            self.table, self.count = _encode_pairs(current.items()), len(current)
+        return len(current) - size
+
+    def delete(self, field):
+        if not self.is_compact:
+            return self.table.pop(field, None) is not None
+        pairs = [pair for pair in _iter_pairs(self.table) if pair[0] != field]
+        if len(pairs) == self.count:
+            return False
+        self.table, self.count = _encode_pairs(pairs), len(pairs)
+        return True
+
+    def items(self):
+        if self.is_compact:
+            return list(_iter_pairs(self.table))
+        return list(self.table.items())
+
+    def flat(self):
+        return [item for pair in self.items() for item in pair]
+
+    def copy(self):
+        # the compact blob is immutable and can be shared
+        return Hash(self.table if self.is_compact else self.table.copy(), self.count)
+
+    def scan(self, cursor, count):
+        # compact hashes are returned whole, like redis does for listpacks.
+        # Larger ones are walked in field hash order and the cursor is the
+        # hash to resume from, so fields deleted meanwhile never make the scan
+        # skip others. Only the buckets of the index a call reads are sorted;
+        # the index is built on the first call and dropped by the last.
+        if self.is_compact:
+            return 0, self.items()
+        table, buckets = self.table, self.scan_buckets
+        if buckets is None or len(table) > 4 * SCAN_BUCKET_SIZE * len(buckets):
+            buckets = self.scan_buckets = [[] for _ in range(1 << (len(table) // SCAN_BUCKET_SIZE).bit_length())]
+            self._index_fields(table)
+        start = cursor - 1 if cursor else 0
+        first = start >> (SCAN_HASH_BITS - len(buckets).bit_length() + 1)
+        items, last = [], None
+        for index in range(first, len(buckets)):
+            # a field deleted and added again may be in its bucket twice
+            hashed = sorted({(hash(field) & SCAN_HASH_MASK, field) for field in buckets[index] if field in table})
+            buckets[index] = [field for _, field in hashed]
+            for field_hash, field in hashed:
+                if field_hash < start:
+                    continue
+                # fields sharing a hash are returned together so the next
+                # call can start from that hash
+                if len(items) >= count and field_hash != last:
+                    return field_hash + 1, items
+                items.append((field, table[field]))
+                last = field_hash
+        self.scan_buckets = None
+        return 0, items
+
+    def _index_fields(self, fields):
+        buckets = self.scan_buckets
+        shift = SCAN_HASH_BITS - len(buckets).bit_length() + 1
+        for field in fields:
+            buckets[(hash(field) & SCAN_HASH_MASK) >> shift].append(field)
@@ -0,0 +1,14 @@
+from binascii import crc_hqx
+
+HASH_SLOTS = 16384
+
+# Redis cluster key hashing: CRC16 (XMODEM) of the key modulo 16384. When the
+# key contains a non-empty {hashtag} only the tag is hashed, so related keys
+# can be forced onto the same slot.
+def key_hash_slot(key):
+    start = key.find(b'{')
+    if start != -1:
+        end = key.find(b'}', start + 1)
+        if end > start + 1:
+            key = key[start + 1:end]
+    return crc_hqx(key, 0) & (HASH_SLOTS - 1)
@@ -1,38 +1,404 @@
+import mmap
+import os
+import shutil
+from threading import Event, Lock, Thread
+from time import monotonic, time
+
 from src.command_handler import handle_command
-from src.protocol_handler import extract_frame_from_buffer
-from src.types import Error
+from src.protocol_handler import ProtocolError, RespParser
+from src.replication import Replication
+from src.snapshot import (
+    SNAPSHOT_FILENAME,
+    SNAPSHOT_MAGIC,
+    SnapshotError,
+    load_snapshot,
+    read_snapshot,
+    save_snapshot,
+    write_snapshot,
+)
+from src.types import Array, Error
+
+# always:   every command is written and fsynced before its reply is sent,
+#           nothing acknowledged is lost
+# everysec: commands are buffered and written by a background thread in
+#           group commits every FLUSH_INTERVAL, fsynced once a second; a
+#           crash loses at most about one second of writes
+# no:       like everysec but fsync is left to the OS; a process crash loses
+#           at most FLUSH_INTERVAL, a power loss whatever the kernel had not
+#           flushed yet (~30s on Linux)
+APPENDFSYNC_POLICIES = ('always', 'everysec', 'no')
+FLUSH_INTERVAL = 0.1
+FSYNC_INTERVAL = 1.0
+# rewrite automatically once the AOF has grown by this percentage since the
+# last rewrite (or startup), but never below the minimum size
+AUTO_REWRITE_PERCENTAGE = 100
+AUTO_REWRITE_MIN_SIZE = 64 * 1024 * 1024
+NS_PER_MS = 10**6
+REPLAY_PROGRESS_INTERVAL = 64 * 1024 * 1024
+
+COMMAND_LOCK_STRIPES = 16
+
+
+# Held around executing and logging a write so the AOF (and the replication
+# stream) records writes to a key in the order they were applied. Writes only
+# take the stripes of their own keys, so writes to unrelated keys run and log
+# in parallel; entering the lock as a whole takes every stripe, which is how a
+# rewrite or a replica's snapshot sees no write half done.
+class CommandLock:
+    def __init__(self, stripes=COMMAND_LOCK_STRIPES):
+        if stripes < 1 or stripes & (stripes - 1):
+            raise ValueError('stripe count must be a power of two')
+        self._stripes = [Lock() for _ in range(stripes)]
+        self._mask = stripes - 1
+
+    def stripes(self, keys):
+        # stripes guarding keys, in index order so acquiring them never
+        # deadlocks; keyless writes take them all
+        if len(keys) == 1:
+            return [self._stripes[hash(keys[0]) & self._mask]]
+        if not keys:
+            return self._stripes
+        return [self._stripes[i] for i in sorted({hash(key) & self._mask for key in keys})]
+
+    def __enter__(self):
+        for stripe in self._stripes:
+            stripe.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        for stripe in reversed(self._stripes):
+            stripe.release()
 
 
 class AppendOnlyPersister:
-    def __init__(self, filename):
+    def __init__(self, filename, appendfsync='everysec', datastore=None, snapshot_filename=SNAPSHOT_FILENAME):
+        if appendfsync not in APPENDFSYNC_POLICIES:
+            raise ValueError(f"invalid appendfsync policy '{appendfsync}'")
         self._filename = filename
+        self._appendfsync = appendfsync
+        self._datastore = datastore
         self._file = open(filename, mode="ab", buffering=0)
+        self._buffer = bytearray()
+        self.command_lock = CommandLock()
+        self._buffer_lock = Lock()
+        self._file_lock = Lock()
+        self._aof_size = os.path.getsize(filename)
+        self._rewrite_base_size = self._aof_size
+        self._rewrite_buffer = None
+        self._rewrite_thread = None
+        # makes checking for a running rewrite or save and starting one atomic,
+        # the flusher's auto-rewrite races client BGREWRITEAOFs otherwise
+        self._background_lock = Lock()
+        self.snapshot_filename = snapshot_filename
+        self._save_thread = None
+        self.last_save = int(time())
+        self.last_write = 0
+        self._unsynced = False
+        self._last_fsync = monotonic()
+        # every logged command is also the replication stream
+        self.replication = Replication()
+        self._stopped = Event()
+        self._flusher = None
+        if appendfsync != 'always':
+            self._flusher = Thread(target=self._flush_periodically, daemon=True)
+            self._flusher.start()
 
     def log_command(self, command):
-        self._file.write(f"*{len(command)}\r\n".encode())
+        encoded = [b"*%d\r\n" % len(command)]
         for item in command:
-            self._file.write(item.file_encode())
+            encoded.append(item.resp_encode())
+        encoded = b"".join(encoded)
+        with self._buffer_lock:
+            self._buffer += encoded
+            if self._rewrite_buffer is not None:
+                self._rewrite_buffer += encoded
+            # fed under the buffer lock so replicas get the AOF's order
+            self.replication.feed(encoded)
+        if self._appendfsync == 'always':
+            self.flush()
+
+    def flush(self, fsync=False):
+        with self._file_lock:
+            with self._buffer_lock:
+                data, self._buffer = self._buffer, bytearray()
+            if data:
+                self._file.write(data)
+                self._aof_size += len(data)
+                self.last_write = int(time())
+                self._unsynced = True
+            if self._unsynced and (fsync or self._fsync_due()):
+                os.fsync(self._file.fileno())
+                self._unsynced = False
+                self._last_fsync = monotonic()
+
+    def _fsync_due(self):
+        if self._appendfsync == 'always':
+            return True
+        if self._appendfsync == 'everysec':
+            return monotonic() - self._last_fsync >= FSYNC_INTERVAL
+        return False
+
+    def _flush_periodically(self):
+        while not self._stopped.wait(FLUSH_INTERVAL):
+            self.flush()
+            if self._auto_rewrite_due():
+                self.rewrite_in_background(self._datastore)
+
+    def _auto_rewrite_due(self):
+        return (
+            self._datastore is not None
+            and self._aof_size >= AUTO_REWRITE_MIN_SIZE
+            and self._aof_size >= self._rewrite_base_size * (100 + AUTO_REWRITE_PERCENTAGE) / 100
+        )
+
+    def rewrite_in_progress(self):
+        return self._rewrite_thread is not None and self._rewrite_thread.is_alive()
+
+    def rewrite_in_background(self, datastore):
+        with self._background_lock:
+            if self.rewrite_in_progress():
+                return False
+            with self.command_lock:
+                entries = datastore.snapshot()
+                with self._buffer_lock:
+                    self._rewrite_buffer = bytearray()
+            self._rewrite_thread = Thread(target=self._rewrite, args=(entries,), daemon=True)
+            self._rewrite_thread.start()
+            return True
+
+    def wait_for_rewrite(self):
+        thread = self._rewrite_thread
+        if thread is not None:
+            thread.join()
+
+    def _rewrite(self, entries):
+        # the rewritten AOF starts with a binary snapshot of the data followed
+        # by the commands logged since, so restarts load it at snapshot speed
+        temp_filename = f"{self._filename}.rewrite.tmp"
+        try:
+            with open(temp_filename, "wb") as f:
+                write_snapshot(f, entries)
+                # writers are held off only while the commands logged during
+                # the rewrite are appended and the files are swapped
+                with self.command_lock:
+                    self.flush()
+                    with self._file_lock:
+                        with self._buffer_lock:
+                            tail, self._rewrite_buffer = self._rewrite_buffer, None
+                        f.write(tail)
+                        f.flush()
+                        os.fsync(f.fileno())
+                        os.replace(temp_filename, self._filename)
+                        self._file.close()
+                        self._file = open(self._filename, mode="ab", buffering=0)
+                        self._aof_size = self._rewrite_base_size = os.path.getsize(self._filename)
+                        self._unsynced = False
+        except OSError as e:
+            print(f"Background AOF rewrite failed: {e}")
+            with self._buffer_lock:
+                self._rewrite_buffer = None
+            if os.path.exists(temp_filename):
+                os.remove(temp_filename)
+
+    def save(self, datastore):
+        # returns False when a background save is already writing the file
+        with self._background_lock:
+            if self.save_in_progress():
+                return False
+            save_snapshot(self.snapshot_filename, datastore.snapshot())
+            self.last_save = int(time())
+            return True
+
+    def save_in_progress(self):
+        return self._save_thread is not None and self._save_thread.is_alive()
+
+    def save_in_background(self, datastore):
+        with self._background_lock:
+            if self.save_in_progress():
+                return False
+            entries = datastore.snapshot()
+            self._save_thread = Thread(target=self._save, args=(entries,), daemon=True)
+            self._save_thread.start()
+            return True
+
+    def _save(self, entries):
+        try:
+            save_snapshot(self.snapshot_filename, entries)
+            self.last_save = int(time())
+        except OSError as e:
+            print(f"Background save failed: {e}")
+
+    def info(self):
+        with self._buffer_lock:
+            buffered = len(self._buffer)
+        return [
+            ('aof_enabled', 1),
+            ('appendfsync', self._appendfsync),
+            ('aof_current_size', self._aof_size),
+            ('aof_base_size', self._rewrite_base_size),
+            ('aof_buffer_length', buffered),
+            ('aof_rewrite_in_progress', int(self.rewrite_in_progress())),
+            ('aof_last_write_time', self.last_write),
+            ('rdb_bgsave_in_progress', int(self.save_in_progress())),
+            ('rdb_last_save_time', self.last_save),
+        ]
+
+    def close(self):
+        self.replication.close()
+        self._stopped.set()
+        if self._flusher:
+            self._flusher.join()
+        for thread in (self._rewrite_thread, self._save_thread):
+            if thread:
+                thread.join()
+        self.flush(fsync=True)
+        self._file.close()
 
-def restore_db(filename, datastore):
-    buffer = bytearray()
+def _replay_set(datastore, args):
+    if len(args) == 2:
+        datastore[args[0]] = args[1]
+    elif len(args) == 4 and args[2].upper() == b'PXAT':
+        datastore.set_with_expiry_at(args[0], args[1], int(args[3]) * NS_PER_MS)
+    else:
+        return False
+    return True
+
+def _replay_mset(datastore, args):
+    if len(args) % 2:
+        return False
+    datastore.mset(dict(zip(args[::2], args[1::2])))
+    return True
+
+def _replay_del(datastore, args):
+    datastore.delete(args)
+    return True
+
+def _replay_incr(datastore, args):
+    datastore.incr(*args)
+    return True
+
+def _replay_decr(datastore, args):
+    datastore.decr(*args)
+    return True
+
+def _replay_lpush(datastore, args):
+    for element in args[1:]:
+        datastore.lpush(args[0], element)
+    return True
+
+def _replay_rpush(datastore, args):
+    for element in args[1:]:
+        datastore.rpush(args[0], element)
+    return True
+
+def _replay_hset(datastore, args):
+    if len(args) < 3 or len(args) % 2 == 0:
+        return False
+    datastore.hset(args[0], list(zip(args[1::2], args[2::2])))
+    return True
+
+def _replay_pexpireat(datastore, args):
+    key, timestamp = args
+    datastore.expire_at(key, int(timestamp) * NS_PER_MS)
+    return True
+
+# Mutations applied straight to the datastore during AOF replay, bypassing
+# dispatch and reply construction. Each returns False for argument shapes
+# it does not handle, which are then replayed through handle_command.
+_REPLAY_HANDLERS = {
+    b'SET': _replay_set,
+    b'MSET': _replay_mset,
+    b'DEL': _replay_del,
+    b'INCR': _replay_incr,
+    b'DECR': _replay_decr,
+    b'LPUSH': _replay_lpush,
+    b'RPUSH': _replay_rpush,
+    b'HSET': _replay_hset,
+    b'PEXPIREAT': _replay_pexpireat,
+}
+
+def _replay_command(frame, datastore):
+    if not isinstance(frame, Array) or not frame.data:
+        return False
+    replay = _REPLAY_HANDLERS.get(frame[0].data.upper())
+    if replay is not None:
+        try:
+            if replay(datastore, [item.data for item in frame.data[1:]]):
+                return True
+        except (TypeError, ValueError):
+            return False
+    return not isinstance(handle_command(frame, datastore), Error)
+
+def _report_progress(offset, size):
+    print(f'Loading AOF: {offset / size:.0%} ({offset // 2**20} of {size // 2**20} MB)')
+
+def _seed_aof(filename, snapshot_filename):
+    # the AOF must hold the snapshot's keys too, or they are lost on the next
+    # restart once writes have made the AOF non-empty; a snapshot file is a
+    # valid AOF preamble, so it is copied in as is, like a finished rewrite
+    temp_filename = f"{filename}.rewrite.tmp"
+    with open(snapshot_filename, 'rb') as source, open(temp_filename, 'wb') as f:
+        shutil.copyfileobj(source, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_filename, filename)
+
+def restore_db(filename, datastore, snapshot_filename=None, load_truncated=False):
     try:
-        with open(filename, 'rb') as f:
-            while True:
-                data = f.read(4096)
-                if not data:
-                    break
-                buffer.extend(data)
-                while True:
-                    frame, frame_size = extract_frame_from_buffer(buffer)
-                    if frame:
-                        buffer = buffer[frame_size:]
-                        result = handle_command(frame, datastore)
-                        if isinstance(result, Error):
-                            print('Error corrupt AOF file')
-                            return False
-                    else:
-                        break
+        f = open(filename, 'rb')
     except FileNotFoundError:
         with open(filename, 'w'):
-            return True
+            pass
+        f = None
+    if f is None or os.fstat(f.fileno()).st_size == 0:
+        if f:
+            f.close()
+        # without an AOF to replay fall back to the last snapshot, if any
+        if snapshot_filename and os.path.exists(snapshot_filename):
+            try:
+                load_snapshot(snapshot_filename, datastore)
+            except SnapshotError as e:
+                print(f'Error corrupt snapshot file: {e}')
+                return False
+            _seed_aof(filename, snapshot_filename)
+        return True
+
+    with f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+        size = len(buffer)
+        offset = 0
+        if buffer[:len(SNAPSHOT_MAGIC)] == SNAPSHOT_MAGIC:
+            try:
+                entries, offset = read_snapshot(buffer)
+            except SnapshotError as e:
+                print(f'Error corrupt AOF file: {e}')
+                return False
+            datastore.bulk_load(entries)
+            del entries
+        parser = RespParser(buffer, offset)
+        next_report = offset + REPLAY_PROGRESS_INTERVAL
+        while True:
+            try:
+                frame = parser.get_frame()
+            except ProtocolError as e:
+                print(f'Error corrupt AOF file at offset {parser.frame_end()}: {e}')
+                return False
+            if frame is None:
+                break
+            if not _replay_command(frame, datastore):
+                print(f'Error corrupt AOF file, failed to replay command at offset {parser.frame_end()}')
+                return False
+            if parser.frame_end() >= next_report:
+                _report_progress(parser.frame_end(), size)
+                next_report += REPLAY_PROGRESS_INTERVAL
+        valid_size = parser.frame_end()
+
+    if valid_size < size:
+        if not load_truncated:
+            print(
+                f'Error AOF file ends with an incomplete command at offset {valid_size}, '
+                'start with --aof-load-truncated to drop it'
+            )
+            return False
+        print(f'Truncating incomplete command at the end of the AOF ({size - valid_size} bytes)')
+        os.truncate(filename, valid_size)
     return True
@@ -0,0 +1,61 @@
+import cProfile
+import pstats
+import threading
+
+PROFILE_FILENAME = 'pyredis.prof'
+
+
+class _ThreadProfile(cProfile.Profile):
+    # stats are collected by the thread running STOP while the owner may be
+    # in the middle of a command; disabling a profile from another thread
+    # would leave the owner's hook installed, so only snapshot it
+    def create_stats(self):
+        self.snapshot_stats()
+
+
+# Runs command dispatch under cProfile between DEBUG PROFILE START and STOP.
+# cProfile only follows the thread that enabled it, so every client thread
+# gets its own Profile and STOP merges them into one stats file. While
+# stopped the dispatch path pays for a single attribute check.
+class Profiler:
+    def __init__(self):
+        self.enabled = False
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._profiles = []
+        # bumped on every START so threads drop profiles of a previous run
+        self._generation = 0
+
+    def start(self):
+        with self._lock:
+            if self.enabled:
+                return False
+            self._profiles = []
+            self._generation += 1
+            self.enabled = True
+            return True
+
+    def runcall(self, function, *args):
+        local = self._local
+        if getattr(local, 'generation', None) != self._generation:
+            local.profile = _ThreadProfile()
+            local.generation = self._generation
+            with self._lock:
+                self._profiles.append(local.profile)
+        return local.profile.runcall(function, *args)
+
+    def stop(self, filename=PROFILE_FILENAME):
+        # returns the number of profiled threads, None when not running
+        with self._lock:
+            if not self.enabled:
+                return None
+            self.enabled = False
+            profiles, self._profiles = self._profiles, []
+        stats = pstats.Stats()
+        for profile in profiles:
+            stats.add(profile)
+        stats.dump_stats(filename)
+        return len(profiles)
+
+
+PROFILER = Profiler()
@@ -10,6 +10,15 @@ from src.types import (
 SEPERATOR = b'\r\n'
 SEPERATOR_SIZE = len(SEPERATOR)
 
+SIMPLE_STRING_PREFIX = ord('+')
+ERROR_PREFIX = ord('-')
+INTEGER_PREFIX = ord(':')
+BULK_STRING_PREFIX = ord('$')
+ARRAY_PREFIX = ord('*')
+
+class ProtocolError(Exception):
+    pass
+
 def extract_frame_from_buffer(buffer):
     seperator_index = buffer.find(SEPERATOR)
     if seperator_index == -1:
@@ -28,7 +37,7 @@ def extract_frame_from_buffer(buffer):
                 return BulkString(None), 5
             start_index = seperator_index + SEPERATOR_SIZE
             end_index = start_index + length
-            payload = buffer[start_index:end_index]
+            payload = bytes(buffer[start_index:end_index])
             if len(buffer) < seperator_index + SEPERATOR_SIZE + length + SEPERATOR_SIZE:
                 return None, 0
             return BulkString(payload), seperator_index + SEPERATOR_SIZE + length + SEPERATOR_SIZE
@@ -50,5 +59,135 @@ def extract_frame_from_buffer(buffer):
         case _:
             return None, 0
         
+# Incremental parser walking the receive buffer with an offset cursor instead
+# of re-slicing it. Partially received arrays and bulk strings are kept on
+# a stack so parsing resumes where it stopped once more data is fed.
+# A read-only buffer such as an mmap can be parsed in place by passing it
+# in, in which case feed must not be used.
+class RespParser:
+    def __init__(self, buffer=None, offset=0):
+        self._buffer = bytearray() if buffer is None else buffer
+        self._offset = offset
+        self._frame_end = offset
+        self._stack = []
+        self._bulk_length = None
+
+    def feed(self, data):
+        if self._offset:
+            del self._buffer[:self._offset]
+            self._frame_end = max(self._frame_end - self._offset, 0)
+            self._offset = 0
+        self._buffer.extend(data)
+
+    def pending(self):
+        return len(self._buffer) - self._offset
+
+    def frame_end(self):
+        # offset just past the last complete top level frame
+        return self._frame_end
+
+    def in_partial_frame(self):
+        return bool(self._stack) or self._bulk_length is not None or self.pending() > 0
+
+    def get_frame(self):
+        buffer = self._buffer
+        with memoryview(buffer) as view:
+            while True:
+                offset = self._offset
+                if not self._stack and self._bulk_length is None and offset < len(buffer) \
+                        and buffer[offset] == ARRAY_PREFIX:
+                    command = self._parse_bulk_array(buffer, view, offset)
+                    if command is not None:
+                        return command
+                if self._bulk_length is not None:
+                    end = offset + self._bulk_length
+                    if len(buffer) < end + SEPERATOR_SIZE:
+                        return None
+                    item = BulkString(bytes(view[offset:end]))
+                    self._bulk_length = None
+                    self._offset = end + SEPERATOR_SIZE
+                else:
+                    seperator_index = buffer.find(SEPERATOR, offset)
+                    if seperator_index == -1:
+                        return None
+                    prefix = buffer[offset]
+                    self._offset = seperator_index + SEPERATOR_SIZE
+                    if prefix == BULK_STRING_PREFIX:
+                        length = self._parse_length(view, offset, seperator_index)
+                        if length >= 0:
+                            self._bulk_length = length
+                            continue
+                        item = BulkString(None)
+                    elif prefix == ARRAY_PREFIX:
+                        length = self._parse_length(view, offset, seperator_index)
+                        if length > 0:
+                            self._stack.append(([], length))
+                            continue
+                        item = Array([] if length == 0 else None)
+                    elif prefix == SIMPLE_STRING_PREFIX:
+                        item = SimpleString(str(view[offset + 1:seperator_index], 'utf-8'))
+                    elif prefix == ERROR_PREFIX:
+                        item = Error(str(view[offset + 1:seperator_index], 'utf-8'))
+                    elif prefix == INTEGER_PREFIX:
+                        item = Integer(self._parse_length(view, offset, seperator_index))
+                    else:
+                        raise ProtocolError(f"unexpected type byte {prefix!r}")
+
+                while self._stack:
+                    items, length = self._stack[-1]
+                    items.append(item)
+                    if len(items) < length:
+                        break
+                    self._stack.pop()
+                    item = Array(items)
+                else:
+                    self._frame_end = self._offset
+                    return item
+
+    def _parse_bulk_array(self, buffer, view, offset):
+        # fast path for a fully buffered array of bulk strings, i.e. a client
+        # command; anything else is left to the resumable path above
+        find = buffer.find
+        size = len(buffer)
+        seperator_index = find(SEPERATOR, offset)
+        if seperator_index == -1:
+            return None
+        try:
+            count = int(buffer[offset + 1:seperator_index])
+        except ValueError:
+            return None
+        if count <= 0:
+            return None
+        offset = seperator_index + SEPERATOR_SIZE
+        items = []
+        for _ in range(count):
+            if offset >= size or buffer[offset] != BULK_STRING_PREFIX:
+                return None
+            seperator_index = find(SEPERATOR, offset)
+            if seperator_index == -1:
+                return None
+            try:
+                length = int(buffer[offset + 1:seperator_index])
+            except ValueError:
+                return None
+            start = seperator_index + SEPERATOR_SIZE
+            offset = start + length + SEPERATOR_SIZE
+            if length < 0 or offset > size:
+                return None
+            items.append(BulkString(bytes(view[start:offset - SEPERATOR_SIZE])))
+        self._offset = self._frame_end = offset
+        return Array(items)
+
+    def _parse_length(self, view, offset, seperator_index):
+        try:
+            return int(view[offset + 1:seperator_index])
+        except ValueError:
+            raise ProtocolError("invalid length") from None
+
+def is_command(frame):
+    # a client request: a non-empty array of non-null bulk strings
+    return type(frame) is Array and bool(frame.data) \
+        and all(type(item) is BulkString and item.data is not None for item in frame.data)
+
 def encode_message(message):
     return message.resp_encode()
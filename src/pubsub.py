@@ -0,0 +1,124 @@
+import threading
+from fnmatch import fnmatchcase
+
+from src.protocol_handler import encode_message
+from src.types import Array, BulkString, Error
+
+# unsent messages a subscriber may fall behind by before it is disconnected,
+# like redis' client-output-buffer-limit pubsub hard limit
+PUBSUB_OUTPUT_BUFFER_LIMIT = 32 * 1024 * 1024
+SUBSCRIBER_COMMANDS = (b'subscribe', b'unsubscribe', b'psubscribe', b'punsubscribe')
+
+
+def message_frame(channel, message):
+    return encode_message(Array([BulkString(b'message'), BulkString(channel), BulkString(message)]))
+
+def pmessage_frame(pattern, channel, message):
+    return encode_message(Array([
+        BulkString(b'pmessage'), BulkString(pattern), BulkString(channel), BulkString(message)
+    ]))
+
+def subscriber_mode_reply(command):
+    # a connection with subscriptions only takes subscription commands and
+    # PING; returns the reply for anything else, None when it may run
+    name = command[0].data.lower()
+    if name in SUBSCRIBER_COMMANDS:
+        return None
+    if name == b'ping' and len(command) <= 2:
+        return Array([BulkString(b'pong'), BulkString(command[1].data if len(command) == 2 else b'')])
+    return Error(
+        f"ERR Can't execute '{name.decode(errors='replace')}': "
+        "only (P)SUBSCRIBE / (P)UNSUBSCRIBE / PING are allowed in this context"
+    )
+
+
+# Channel and pattern subscriptions of every connection. Subscribers are the
+# server's Client objects: they keep their own channels and patterns sets and
+# take already encoded messages through deliver, which must never block. A
+# message is encoded once per PUBLISH (once per matching pattern for pattern
+# subscribers) and the same bytes are handed to every subscriber.
+class PubSub:
+    def __init__(self):
+        # channel / pattern -> {client: client.deliver}
+        self._channels = {}
+        self._patterns = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, client, channel):
+        # returns the client's subscription count afterwards
+        with self._lock:
+            if channel not in client.channels:
+                client.channels.add(channel)
+                self._channels.setdefault(channel, {})[client] = client.deliver
+        return len(client.channels) + len(client.patterns)
+
+    def unsubscribe(self, client, channel):
+        with self._lock:
+            if channel in client.channels:
+                client.channels.discard(channel)
+                _remove(self._channels, channel, client)
+        return len(client.channels) + len(client.patterns)
+
+    def psubscribe(self, client, pattern):
+        with self._lock:
+            if pattern not in client.patterns:
+                client.patterns.add(pattern)
+                self._patterns.setdefault(pattern, {})[client] = client.deliver
+        return len(client.channels) + len(client.patterns)
+
+    def punsubscribe(self, client, pattern):
+        with self._lock:
+            if pattern in client.patterns:
+                client.patterns.discard(pattern)
+                _remove(self._patterns, pattern, client)
+        return len(client.channels) + len(client.patterns)
+
+    def remove(self, client):
+        # drops every subscription of a client that disconnected
+        if not client.channels and not client.patterns:
+            return
+        with self._lock:
+            for channel in client.channels:
+                _remove(self._channels, channel, client)
+            for pattern in client.patterns:
+                _remove(self._patterns, pattern, client)
+            client.channels.clear()
+            client.patterns.clear()
+
+    def publish(self, channel, message):
+        # returns the number of subscribers the message was handed to
+        receivers = 0
+        with self._lock:
+            subscribers = self._channels.get(channel)
+            if subscribers:
+                data = message_frame(channel, message)
+                for deliver in subscribers.values():
+                    deliver(data)
+                receivers += len(subscribers)
+            for pattern, subscribers in self._patterns.items():
+                if fnmatchcase(channel, pattern):
+                    data = pmessage_frame(pattern, channel, message)
+                    for deliver in subscribers.values():
+                        deliver(data)
+                    receivers += len(subscribers)
+        return receivers
+
+    def channels(self, pattern=None):
+        with self._lock:
+            return [c for c in self._channels if pattern is None or fnmatchcase(c, pattern)]
+
+    def numsub(self, channel):
+        subscribers = self._channels.get(channel)
+        return len(subscribers) if subscribers else 0
+
+    def numpat(self):
+        return len(self._patterns)
+
+def _remove(subscriptions, name, client):
+    subscribers = subscriptions[name]
+    del subscribers[client]
+    if not subscribers:
+        del subscriptions[name]
+
+
+PUBSUB = PubSub()
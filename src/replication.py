@@ -0,0 +1,305 @@
+import io
+import secrets
+import socket
+import threading
+
+from src.command_handler import handle_command, lookup_command
+from src.protocol_handler import ProtocolError, RespParser, encode_message
+from src.snapshot import SnapshotError, read_snapshot, write_snapshot
+from src.types import Array, BulkString, Error, SimpleString
+
+# the stream kept for partial resyncs; it is trimmed back to this size once
+# it has grown to twice that, so trimming is amortised over many writes
+REPL_BACKLOG_SIZE = 1024 * 1024
+# unsent stream a replica may fall behind by before it is disconnected, like
+# redis' client-output-buffer-limit for replicas
+REPLICA_OUTPUT_BUFFER_LIMIT = 64 * 1024 * 1024
+RECV_SIZE = 64 * 1024
+CONNECT_TIMEOUT = 5.0
+# replicas send nothing after PSYNC, so an idle link is checked this often
+# for having been closed by the other end
+IDLE_CHECK_INTERVAL = 0.5
+RECONNECT_INTERVAL = 1.0
+READONLY_ERROR = "READONLY You can't write against a read only replica."
+
+
+class ReplicationError(Exception):
+    pass
+
+
+def readonly_error(command):
+    # the error for a client write sent to a replica, None for other commands
+    spec = lookup_command(command[0].data)
+    if spec is not None and spec.is_write:
+        return Error(READONLY_ERROR)
+    return None
+
+
+def peer_closed(sock):
+    # whether the other end closed an idle connection, without reading from it
+    try:
+        return sock.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT) == b''
+    except BlockingIOError:
+        return False
+    except OSError:
+        return True
+
+
+# The primary's end of one replica connection. Replication.feed queues the
+# command stream here and a thread of its own writes it out, so a slow
+# replica never holds up command execution; one that falls too far behind
+# is dropped instead.
+class ReplicaConnection:
+    def __init__(self, replication, address, offset, entries=None, backlog=b''):
+        self.address = address
+        # replication offset of the stream sent so far
+        self.offset = offset
+        self._replication = replication
+        # snapshot still to be sent for a full resync
+        self._entries = entries
+        self._buffer = bytearray(backlog)
+        self._condition = threading.Condition()
+        self.closed = False
+
+    def feed(self, data):
+        with self._condition:
+            if self.closed:
+                return
+            if len(self._buffer) + len(data) <= REPLICA_OUTPUT_BUFFER_LIMIT:
+                self._buffer += data
+                self._condition.notify()
+                return
+        print(f'Disconnecting replica {self.address}: output buffer limit reached')
+        self.close()
+
+    def serve(self, sock):
+        try:
+            if self._entries is not None:
+                payload = io.BytesIO()
+                write_snapshot(payload, self._entries)
+                self._entries = None
+                sock.sendall(BulkString(payload.getvalue()).resp_encode())
+            while True:
+                with self._condition:
+                    while not self._buffer and not self.closed:
+                        if not self._condition.wait(IDLE_CHECK_INTERVAL) and peer_closed(sock):
+                            self.closed = True
+                    if self.closed:
+                        break
+                    data, self._buffer = self._buffer, bytearray()
+                sock.sendall(data)
+                self.offset += len(data)
+        except OSError:
+            pass
+        finally:
+            sock.close()
+            self.close()
+
+    def close(self):
+        with self._condition:
+            self.closed = True
+            self._buffer = bytearray()
+            self._condition.notify()
+        self._replication.remove_replica(self)
+
+
+# The replica's end: connects to the primary, asks for a partial resync from
+# where it stopped (or a full one the first time), loads the snapshot and
+# then applies the command stream, reconnecting whenever the link drops.
+class PrimaryLink:
+    def __init__(self, address, datastore, persister):
+        self.address = address
+        self._datastore = datastore
+        self._persister = persister
+        self.replid = '?'
+        self.offset = -1
+        self.status = 'connecting'
+        self._socket = None
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        sock = self._socket
+        if sock is not None:
+            try:
+                # unblocks the link thread's recv
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        if self._thread is not threading.current_thread():
+            self._thread.join()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                self._sync()
+            except (OSError, ProtocolError, SnapshotError, ReplicationError) as e:
+                if not self._stopped.is_set():
+                    print(f'Replication link to {self.address[0]}:{self.address[1]} lost: {e}')
+            self.status = 'down'
+            self._stopped.wait(RECONNECT_INTERVAL)
+
+    def _read_frame(self, sock, parser):
+        while True:
+            frame = parser.get_frame()
+            if frame is not None:
+                return frame
+            data = sock.recv(RECV_SIZE)
+            if not data:
+                raise ConnectionError('primary closed the connection')
+            parser.feed(data)
+
+    def _sync(self):
+        self.status = 'connecting'
+        sock = socket.create_connection(self.address, CONNECT_TIMEOUT)
+        sock.settimeout(None)
+        self._socket = sock
+        with sock:
+            if self._stopped.is_set():
+                return
+            parser = RespParser()
+            sock.sendall(encode_message(Array([
+                BulkString(b'PSYNC'), BulkString(self.replid.encode()), BulkString(b'%d' % self.offset),
+            ])))
+            reply = self._read_frame(sock, parser)
+            if not isinstance(reply, SimpleString):
+                raise ReplicationError(f'unexpected PSYNC reply {reply.as_str()!r}')
+            parts = reply.data.split()
+            if parts[0] == 'FULLRESYNC' and len(parts) == 3:
+                self.status = 'sync'
+                payload = self._read_frame(sock, parser)
+                if not isinstance(payload, BulkString) or payload.data is None:
+                    raise ReplicationError('expected a snapshot after FULLRESYNC')
+                entries, _ = read_snapshot(payload.data)
+                self._load(entries)
+                self.replid, self.offset = parts[1], int(parts[2])
+            elif parts[0] != 'CONTINUE':
+                raise ReplicationError(f'unexpected PSYNC reply {reply.data!r}')
+            self.status = 'up'
+            while True:
+                frame = self._read_frame(sock, parser)
+                handle_command(frame, self._datastore, self._persister, replicated=True)
+                self.offset += len(encode_message(frame))
+
+    def _load(self, entries):
+        persister = self._persister
+        with persister.command_lock:
+            self._datastore.clear()
+            self._datastore.bulk_load(entries)
+        # the AOF still describes the old dataset, start it over from this one;
+        # a rewrite already running took its snapshot before the load, so it
+        # is waited for and a new one started
+        while not persister.rewrite_in_background(self._datastore):
+            persister.wait_for_rewrite()
+
+
+# Replication state of one server, kept by its AppendOnlyPersister. As a
+# primary it numbers the bytes of the command stream the AOF sees (the
+# replication offset), keeps the most recent of them in a backlog and fans
+# them out to the connected replicas. As a replica it runs the link to its
+# primary and clients may not write.
+class Replication:
+    def __init__(self, backlog_size=REPL_BACKLOG_SIZE):
+        self.replid = secrets.token_hex(20)
+        self.offset = 0
+        self.backlog_size = backlog_size
+        # only kept once a replica has connected
+        self._backlog = None
+        self._backlog_start = 0
+        # replaced rather than mutated so feed can iterate without a lock
+        self._replicas = ()
+        self._lock = threading.Lock()
+        self._link = None
+
+    @property
+    def read_only(self):
+        return self._link is not None
+
+    def feed(self, data):
+        # called for every command appended to the AOF, under the command lock
+        self.offset += len(data)
+        backlog = self._backlog
+        if backlog is None:
+            return
+        backlog += data
+        if len(backlog) > 2 * self.backlog_size:
+            excess = len(backlog) - self.backlog_size
+            del backlog[:excess]
+            self._backlog_start += excess
+        for replica in self._replicas:
+            replica.feed(data)
+
+    def sync(self, replid, offset, datastore, address):
+        # answers PSYNC; must be called under the command lock so the
+        # snapshot or backlog handed to the replica matches the offset exactly
+        if self._backlog is None:
+            self._backlog = bytearray()
+            self._backlog_start = self.offset
+        if replid == self.replid and self._backlog_start <= offset <= self.offset:
+            backlog = self._backlog[offset - self._backlog_start:]
+            replica = ReplicaConnection(self, address, offset, backlog=backlog)
+            reply = f'CONTINUE {self.replid}'
+        else:
+            replica = ReplicaConnection(self, address, self.offset, entries=datastore.snapshot())
+            reply = f'FULLRESYNC {self.replid} {self.offset}'
+        with self._lock:
+            self._replicas = self._replicas + (replica,)
+        return replica, reply
+
+    def remove_replica(self, replica):
+        with self._lock:
+            self._replicas = tuple(r for r in self._replicas if r is not replica)
+
+    def replicate_from(self, address, datastore, persister):
+        if self._link is not None:
+            if self._link.address == address:
+                return
+            self._link.stop()
+        self._link = PrimaryLink(address, datastore, persister)
+        self._link.start()
+
+    def promote(self):
+        # REPLICAOF NO ONE: keep the data, stop following and accept writes
+        link, self._link = self._link, None
+        if link is not None:
+            link.stop()
+
+    def info(self):
+        info = []
+        link = self._link
+        if link is None:
+            info.append(('role', 'master'))
+        else:
+            info.extend([
+                ('role', 'slave'),
+                ('master_host', link.address[0]),
+                ('master_port', link.address[1]),
+                ('master_link_status', 'up' if link.status == 'up' else 'down'),
+                ('master_sync_in_progress', int(link.status == 'sync')),
+                ('slave_repl_offset', link.offset),
+                ('slave_read_only', 1),
+            ])
+        replicas = self._replicas
+        info.append(('connected_slaves', len(replicas)))
+        for i, replica in enumerate(replicas):
+            host, port = replica.address[:2]
+            info.append((f'slave{i}', f'ip={host},port={port},offset={replica.offset}'))
+        backlog = self._backlog
+        info.extend([
+            ('master_replid', self.replid),
+            ('master_repl_offset', self.offset),
+            ('repl_backlog_active', int(backlog is not None)),
+            ('repl_backlog_size', self.backlog_size),
+            ('repl_backlog_first_byte_offset', self._backlog_start),
+            ('repl_backlog_histlen', len(backlog) if backlog is not None else 0),
+        ])
+        return info
+
+    def close(self):
+        self.promote()
+        for replica in self._replicas:
+            replica.close()
@@ -1,35 +1,277 @@
+import asyncio
+import select
 import socket
 import threading
 from src.command_handler import handle_command
 from src.datastore import DataStore
 
-from src.protocol_handler import encode_message, extract_frame_from_buffer 
+from src.profiler import PROFILER
+from src.protocol_handler import ProtocolError, RespParser, encode_message, is_command
+from src.pubsub import PUBSUB, PUBSUB_OUTPUT_BUFFER_LIMIT, subscriber_mode_reply
+from src.replication import readonly_error
+from src.stats import SERVER_STATS
+from src.types import Array, Error
 
-RECV_SIZE = 1024
+RECV_SIZE = 64 * 1024
+ASYNC_BACKLOG = 4096
+EXPIRY_INTERVAL = 0.1
+# longest a subscriber's own thread leaves messages its socket could not
+# take right away unsent
+SUBSCRIBER_IDLE_INTERVAL_MS = 1000
 
-def handle_client_connection(client_socket, datastore, persister):
-    buffer = bytearray()
+# Per connection state shared by both engines.
+class Client:
+    # whether commands that wait on another server (forwards to other
+    # workers, MIGRATE) leave that call in deferred for the engine to make
+    # instead of making it on the spot
+    defers_blocking_calls = False
+
+    def __init__(self, address):
+        self.address = address
+        # set by ASKING, lets the next command through for an importing slot
+        self.asking = False
+        # set by PSYNC, the connection then carries the replication stream
+        self.replica = None
+        # Pub/Sub subscriptions, kept up to date by PUBSUB
+        self.channels = set()
+        self.patterns = set()
+        # call returning the reply of the command left by defers_blocking_calls
+        self.deferred = None
+
+def execute_buffered_commands(parser, datastore, persister, router=None, client=None):
+    if PROFILER.enabled:
+        return PROFILER.runcall(_execute_frames, parser, datastore, persister, router, client)
+    return _execute_frames(parser, datastore, persister, router, client)
+
+def _execute_frames(parser, datastore, persister, router, client):
+    replies = []
+    read_only = persister is not None and persister.replication.read_only
+    while True:
+        try:
+            frame = parser.get_frame()
+        except ProtocolError as e:
+            replies.append(encode_message(Error(f'ERR Protocol error: {e}')))
+            return b''.join(replies), False
+        if frame is None:
+            break
+        if isinstance(frame, Array) and not frame.data:
+            continue
+        if not is_command(frame):
+            replies.append(encode_message(Error('ERR Protocol error: expected bulk string')))
+            return b''.join(replies), False
+        result = router.route(frame, client) if router else None
+        if client is not None and client.deferred is not None:
+            # the rest of the batch runs once the deferred call replied
+            break
+        if result is None and read_only:
+            result = readonly_error(frame)
+        if result is None and client is not None and (client.channels or client.patterns):
+            result = subscriber_mode_reply(frame)
+        if result is None:
+            result = handle_command(frame, datastore, persister, client)
+            if client is not None and client.deferred is not None:
+                break
+        replies.append(encode_message(result))
+    return b''.join(replies), True
+
+# Client of the threaded engine. Replies are written by the connection's own
+# thread while PUBLISH runs on the publisher's, so both go through send/deliver
+# under one lock. Messages are only sent as far as the socket takes them
+# without blocking; the rest waits in a buffer that the connection's thread
+# keeps retrying, and a subscriber whose buffer outgrows the limit is cut off.
+# Messages published while a batch that subscribes is still running are held
+# back and sent after the batch's replies, behind the subscribe confirmation.
+class SocketClient(Client):
+    def __init__(self, client_socket):
+        super().__init__(client_socket.getpeername())
+        self._socket = client_socket
+        self._lock = threading.Lock()
+        # messages the socket could not take yet
+        self.pending = bytearray()
+        # messages published since this batch subscribed, sent after its replies
+        self._held = None
+        self._dropped = False
+        self._poller = None
+
+    def hold_messages(self):
+        with self._lock:
+            if self._held is None:
+                self._held = bytearray()
+
+    def send(self, data):
+        with self._lock:
+            if self._held is not None:
+                data, self._held = data + self._held, None
+            if self.channels or self.patterns or self.pending:
+                self._queue(data)
+            else:
+                self._socket.sendall(data)
+
+    def deliver(self, data):
+        with self._lock:
+            if self._held is None:
+                self._queue(data)
+            elif not self._dropped:
+                self._held += data
+                if len(self._held) > PUBSUB_OUTPUT_BUFFER_LIMIT:
+                    self._drop()
+
+    def flush(self):
+        with self._lock:
+            self._queue(b'')
+
+    def _queue(self, data):
+        # callers must hold the lock
+        if self._dropped:
+            return
+        pending = self.pending
+        pending += data
+        try:
+            while pending:
+                del pending[:self._socket.send(pending, socket.MSG_DONTWAIT)]
+        except BlockingIOError:
+            pass
+        except OSError:
+            self._drop()
+            return
+        if len(pending) > PUBSUB_OUTPUT_BUFFER_LIMIT:
+            self._drop()
+
+    def _drop(self):
+        # the connection's thread sees the shutdown as a closed connection
+        self._dropped = True
+        self.pending = bytearray()
+        self._held = bytearray() if self._held is not None else None
+        try:
+            self._socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def wait_readable(self):
+        # while messages are pending the thread also waits for the socket to
+        # take more; a publisher can leave some behind while the thread is
+        # already waiting, so it never waits longer than the idle interval
+        if self._poller is None:
+            self._poller = select.poll()
+        while True:
+            pending = bool(self.pending)
+            self._poller.register(self._socket, select.POLLIN | select.POLLOUT if pending else select.POLLIN)
+            events = self._poller.poll(None if pending else SUBSCRIBER_IDLE_INTERVAL_MS)
+            if any(event & ~select.POLLOUT for _, event in events):
+                return
+            self.flush()
+
+def handle_client_connection(client_socket, datastore, persister, router=None):
+    parser = RespParser()
+    client = None
+    SERVER_STATS.client_connected()
     try:
+        client = SocketClient(client_socket)
         while True:
+            if client.channels or client.patterns or client.pending:
+                client.wait_readable()
             data = client_socket.recv(RECV_SIZE)
             if not data:
                 break
-            buffer.extend(data)
-            frame, frame_size = extract_frame_from_buffer(data)
-            if frame:
-                buffer = buffer[frame_size:]
-                result = handle_command(frame, datastore, persister)
-                print(result) # for dev testing purpose only
-                client_socket.send(encode_message(result))
+            parser.feed(data)
+            replies, keep_open = execute_buffered_commands(parser, datastore, persister, router, client)
+            if replies:
+                client.send(replies)
+            if client.replica is not None:
+                # this thread now streams to the replica until it goes away
+                client.replica.serve(client_socket)
+                break
+            if not keep_open:
+                break
+    except ConnectionError:
+        pass
     finally:
+        if client is not None:
+            PUBSUB.remove(client)
+        SERVER_STATS.client_disconnected()
         client_socket.close()
 
+def _serve_replica(replica, writer):
+    # the stream is written with blocking sends from a thread of its own so
+    # a replica that falls behind costs the event loop nothing; the socket
+    # is duplicated as the transport closes its own when the writer does
+    sock = writer.get_extra_info('socket').dup()
+    sock.setblocking(True)
+    threading.Thread(target=replica.serve, args=(sock,), daemon=True).start()
+
+# Client of the asyncio engine. PUBLISH runs on the event loop like every
+# other command, so messages go straight into the transport, which sends what
+# it can at once and buffers the rest; a subscriber whose buffer outgrows the
+# limit is cut off. A batch waiting on a deferred call lets other commands
+# run, so messages are held back the same way as in SocketClient.
+class StreamClient(Client):
+    defers_blocking_calls = True
+
+    def __init__(self, writer):
+        super().__init__(writer.get_extra_info('peername'))
+        self._transport = writer.transport
+        # messages published since this batch subscribed, sent after its replies
+        self._held = None
+
+    def hold_messages(self):
+        if self._held is None:
+            self._held = bytearray()
+
+    def send(self, data):
+        if self._held is not None:
+            data, self._held = data + self._held, None
+        self._transport.write(data)
+
+    def deliver(self, data):
+        transport = self._transport
+        if transport.is_closing():
+            return
+        if self._held is not None:
+            self._held += data
+        else:
+            transport.write(data)
+        if transport.get_write_buffer_size() + len(self._held or b'') > PUBSUB_OUTPUT_BUFFER_LIMIT:
+            transport.abort()
+
+async def handle_client_stream(reader, writer, datastore, persister, router=None):
+    parser = RespParser()
+    client = StreamClient(writer)
+    SERVER_STATS.client_connected()
+    try:
+        while True:
+            data = await reader.read(RECV_SIZE)
+            if not data:
+                break
+            parser.feed(data)
+            replies, keep_open = execute_buffered_commands(parser, datastore, persister, router, client)
+            while client.deferred is not None:
+                call, client.deferred = client.deferred, None
+                reply = await asyncio.to_thread(call)
+                more, keep_open = execute_buffered_commands(parser, datastore, persister, router, client)
+                replies += encode_message(reply) + more
+            if replies:
+                client.send(replies)
+                await writer.drain()
+            if client.replica is not None:
+                _serve_replica(client.replica, writer)
+                break
+            if not keep_open:
+                break
+    except ConnectionError:
+        pass
+    finally:
+        PUBSUB.remove(client)
+        SERVER_STATS.client_disconnected()
+        writer.close()
+
 class Server:
-    def __init__(self, port, datastore, persister):
+    def __init__(self, port, datastore, persister, router=None, reuse_port=False):
         self.port = port
         self._running = False
         self._datastore = datastore
         self._persister = persister
+        self._router = router
+        self._reuse_port = reuse_port
 
     def run(self):
         self._running = True
@@ -37,15 +279,64 @@ class Server:
         with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as server_socket:
             self._server_socket = server_socket
             server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if self._reuse_port:
+                server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
             server_address = ("localhost", self.port)
             server_socket.bind(server_address)
             server_socket.listen()
             while self._running:
                 comm_socket, _ = server_socket.accept()
                 client_thread = threading.Thread(
-                    target=handle_client_connection, args=(comm_socket, self._datastore, self._persister)
+                    target=handle_client_connection,
+                    args=(comm_socket, self._datastore, self._persister, self._router),
                 )
                 client_thread.start()
 
     def stop(self):
         self._running = False
+
+# Multiplexes every connection on a single asyncio loop. Commands and the
+# active expiry cycle run on the loop thread, but deferred blocking calls
+# (worker forwards, MIGRATE) run in to_thread, and the worker socket and
+# replication threads execute commands of their own, so the datastore and
+# command locks are still taken as in the threaded server.
+class AsyncServer:
+    def __init__(self, port, datastore, persister, router=None, reuse_port=False):
+        self.port = port
+        self._datastore = datastore
+        self._persister = persister
+        self._router = router
+        self._reuse_port = reuse_port
+        self._loop = None
+        self._stopped = None
+
+    def run(self):
+        asyncio.run(self._serve())
+
+    async def _serve(self):
+        self._loop = asyncio.get_running_loop()
+        self._stopped = asyncio.Event()
+        server = await asyncio.start_server(
+            self._handle_client,
+            "localhost",
+            self.port,
+            backlog=ASYNC_BACKLOG,
+            reuse_address=True,
+            reuse_port=self._reuse_port or None,
+        )
+        expiry_task = asyncio.create_task(self._check_expiry())
+        async with server:
+            await self._stopped.wait()
+        expiry_task.cancel()
+
+    async def _handle_client(self, reader, writer):
+        await handle_client_stream(reader, writer, self._datastore, self._persister, self._router)
+
+    async def _check_expiry(self):
+        while True:
+            self._datastore.auto_check_expiry()
+            await asyncio.sleep(EXPIRY_INTERVAL)
+
+    def stop(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._stopped.set)
@@ -0,0 +1,123 @@
+from array import array
+from bisect import bisect_left
+
+# same limit as redis' set-max-intset-entries
+SET_MAX_INTSET_ENTRIES = 512
+INT64_MIN = -2**63
+INT64_MAX = 2**63 - 1
+
+
+def _as_int(member):
+    # the integer a member encodes canonically ("12", not "012" or "+12"),
+    # None when it cannot live in an intset
+    try:
+        value = int(member)
+    except ValueError:
+        return None
+    if not INT64_MIN <= value <= INT64_MAX or b'%d' % value != member:
+        return None
+    return value
+
+
+# A set value. Sets whose members are all 64 bit integers are kept as a
+# sorted array('q'), 8 bytes per member searched by bisection, like redis'
+# intset. Adding a non integer member or growing past the size limit
+# promotes it to a Python set of bytes for good.
+class Set:
+    __slots__ = ('table',)
+
+    def __init__(self, table=None):
+        self.table = array('q') if table is None else table
+
+    @classmethod
+    def from_members(cls, members):
+        value = cls()
+        for member in members:
+            value.add(member)
+        return value
+
+    @property
+    def is_intset(self):
+        return isinstance(self.table, array)
+
+    def __len__(self):
+        return len(self.table)
+
+    def __eq__(self, other):
+        return isinstance(other, Set) and set(self.members()) == set(other.members())
+
+    def __contains__(self, member):
+        if not self.is_intset:
+            return member in self.table
+        value = _as_int(member)
+        if value is None:
+            return False
+        table = self.table
+        i = bisect_left(table, value)
+        return i < len(table) and table[i] == value
+
+    def add(self, member):
+        # returns True when the member is new
+        if self.is_intset:
+            value = _as_int(member)
+            if value is not None:
+                table = self.table
+                i = bisect_left(table, value)
+                if i < len(table) and table[i] == value:
+                    return False
+                if len(table) < SET_MAX_INTSET_ENTRIES:
+                    table.insert(i, value)
+                    return True
+            self._convert()
+        if member in self.table:
+            return False
+        self.table.add(member)
+        return True
+
+    def remove(self, member):
+        if not self.is_intset:
+            if member not in self.table:
+                return False
+            self.table.discard(member)
+            return True
+        value = _as_int(member)
+        if value is None:
+            return False
+        table = self.table
+        i = bisect_left(table, value)
+        if i == len(table) or table[i] != value:
+            return False
+        del table[i]
+        return True
+
+    def members(self):
+        if self.is_intset:
+            return [b'%d' % value for value in self.table]
+        return list(self.table)
+
+    def copy(self):
+        return Set(self.table[:] if self.is_intset else self.table.copy())
+
+    def _convert(self):
+        self.table = {b'%d' % value for value in self.table}
+
+
+def intersect(sets):
+    # walks the smallest set and probes the others, so the cost follows the
+    # smallest input rather than the largest
+    if not sets or any(not len(s) for s in sets):
+        return []
+    sets = sorted(sets, key=len)
+    smallest, others = sets[0], sets[1:]
+    return [member for member in smallest.members() if all(member in other for other in others)]
+
+
+def union(sets):
+    result = set()
+    for s in sets:
+        result.update(s.members())
+    return list(result)
+
+
+def difference(first, others):
+    return [member for member in first.members() if not any(member in other for other in others)]
@@ -0,0 +1,217 @@
+import mmap
+import os
+import struct
+import zlib
+
+from src.hashes import Hash
+from src.sets import Set
+from src.sortedsets import SortedSet, SortedSetScores
+
+# Binary snapshot layout:
+#   magic, then one record per key:
+#     type byte (high bit set when an expiry follows)
+#     [expiry: unsigned 64 bit absolute unix time in ns]
+#     key: u32 length + bytes
+#     value: string -> u32 length + bytes, list -> u32 count + (u32 length + bytes)*,
+#            hash -> like a list of field, value, field, value, ...,
+#            sorted set -> u32 count + (u32 length + member + f64 score)*,
+#            set -> like a list of its members
+#   EOF byte, crc32 of everything before it (u32)
+# All integers are little endian.
+SNAPSHOT_MAGIC = b'PYRDB001'
+SNAPSHOT_FILENAME = 'dump.rdb'
+
+TYPE_STRING = 0
+TYPE_LIST = 1
+TYPE_HASH = 2
+TYPE_ZSET = 3
+TYPE_SET = 4
+HAS_EXPIRY = 0x80
+EOF_MARKER = 0xFF
+
+_LENGTH = struct.Struct('<I')
+_EXPIRY = struct.Struct('<Q')
+_CHECKSUM = struct.Struct('<I')
+_SCORE = struct.Struct('<d')
+WRITE_CHUNK_SIZE = 1024 * 1024
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def _encode_bytes(value):
+    return _LENGTH.pack(len(value)) + value
+
+
+def _encode_bytes_list(record_type, key, items, expiry):
+    parts = [bytes([record_type | (HAS_EXPIRY if expiry else 0)])]
+    if expiry:
+        parts.append(_EXPIRY.pack(expiry))
+    parts.append(_encode_bytes(key))
+    parts.append(_LENGTH.pack(len(items)))
+    parts.extend(_encode_bytes(item) for item in items)
+    return b''.join(parts)
+
+
+def encode_entry(key, value, expiry):
+    if isinstance(value, list):
+        return _encode_bytes_list(TYPE_LIST, key, value, expiry)
+    if isinstance(value, Hash):
+        return _encode_bytes_list(TYPE_HASH, key, value.flat(), expiry)
+    if isinstance(value, Set):
+        return _encode_bytes_list(TYPE_SET, key, value.members(), expiry)
+    if isinstance(value, (SortedSet, SortedSetScores)):
+        parts = [bytes([TYPE_ZSET | (HAS_EXPIRY if expiry else 0)])]
+        if expiry:
+            parts.append(_EXPIRY.pack(expiry))
+        parts.append(_encode_bytes(key))
+        parts.append(_LENGTH.pack(len(value)))
+        parts.extend(_encode_bytes(member) + _SCORE.pack(score) for member, score in value.items())
+        return b''.join(parts)
+    if expiry:
+        return b'%c%b%b%b' % (TYPE_STRING | HAS_EXPIRY, _EXPIRY.pack(expiry), _encode_bytes(key), _encode_bytes(value))
+    return b'%c%b%b' % (TYPE_STRING, _encode_bytes(key), _encode_bytes(value))
+
+
+def write_snapshot(f, entries):
+    checksum = zlib.crc32(SNAPSHOT_MAGIC)
+    f.write(SNAPSHOT_MAGIC)
+    chunk = []
+    chunk_size = 0
+    for entry in entries:
+        encoded = encode_entry(*entry)
+        chunk.append(encoded)
+        chunk_size += len(encoded)
+        if chunk_size >= WRITE_CHUNK_SIZE:
+            data = b''.join(chunk)
+            checksum = zlib.crc32(data, checksum)
+            f.write(data)
+            chunk, chunk_size = [], 0
+    chunk.append(bytes([EOF_MARKER]))
+    data = b''.join(chunk)
+    checksum = zlib.crc32(data, checksum)
+    f.write(data)
+    f.write(_CHECKSUM.pack(checksum))
+
+
+def save_snapshot(filename, entries):
+    temp_filename = f'{filename}.tmp'
+    with open(temp_filename, 'wb') as f:
+        write_snapshot(f, entries)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_filename, filename)
+
+
+def _decode_bytes_list(buffer, offset):
+    count, = _LENGTH.unpack_from(buffer, offset)
+    offset += 4
+    items = []
+    for _ in range(count):
+        length, = _LENGTH.unpack_from(buffer, offset)
+        offset += 4
+        items.append(buffer[offset:offset + length])
+        offset += length
+    return items, offset
+
+
+def _decode_value(buffer, offset, record_type):
+    if record_type == TYPE_STRING:
+        length, = _LENGTH.unpack_from(buffer, offset)
+        offset += 4
+        return buffer[offset:offset + length], offset + length
+    if record_type == TYPE_LIST:
+        return _decode_bytes_list(buffer, offset)
+    if record_type == TYPE_HASH:
+        items, offset = _decode_bytes_list(buffer, offset)
+        return Hash.from_flat(items), offset
+    if record_type == TYPE_SET:
+        items, offset = _decode_bytes_list(buffer, offset)
+        return Set.from_members(items), offset
+    if record_type == TYPE_ZSET:
+        count, = _LENGTH.unpack_from(buffer, offset)
+        offset += 4
+        value = SortedSet()
+        for _ in range(count):
+            length, = _LENGTH.unpack_from(buffer, offset)
+            offset += 4
+            member = buffer[offset:offset + length]
+            offset += length
+            value.add(member, _SCORE.unpack_from(buffer, offset)[0])
+            offset += 8
+        return value, offset
+    raise SnapshotError(f'unknown record type {record_type}')
+
+
+# DUMP/RESTORE payloads reuse the record encoding with an empty key,
+# followed by a crc32 of the record
+def dump_value(value):
+    record = encode_entry(b'', value, 0)
+    return record + _CHECKSUM.pack(zlib.crc32(record))
+
+
+def restore_value(payload):
+    try:
+        checksum, = _CHECKSUM.unpack_from(payload, len(payload) - _CHECKSUM.size)
+        if zlib.crc32(payload[:-_CHECKSUM.size]) != checksum:
+            raise SnapshotError('checksum mismatch')
+        record_type = payload[0] & ~HAS_EXPIRY
+        offset = 1 + _LENGTH.size + _LENGTH.unpack_from(payload, 1)[0]
+        value, _ = _decode_value(payload, offset, record_type)
+    except (IndexError, struct.error):
+        raise SnapshotError('truncated payload') from None
+    return value
+
+
+def read_snapshot(buffer, offset=0):
+    # returns the entries as (key, value, expiry) tuples and the offset just
+    # past the snapshot, so a snapshot can be followed by other data
+    if buffer[offset:offset + len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+        raise SnapshotError('not a snapshot')
+    start = offset
+    offset += len(SNAPSHOT_MAGIC)
+    entries = []
+    append = entries.append
+    unpack_length = _LENGTH.unpack_from
+    unpack_expiry = _EXPIRY.unpack_from
+    try:
+        while True:
+            record_type = buffer[offset]
+            offset += 1
+            if record_type == EOF_MARKER:
+                break
+            expiry = 0
+            if record_type & HAS_EXPIRY:
+                expiry, = unpack_expiry(buffer, offset)
+                offset += 8
+                record_type &= ~HAS_EXPIRY
+            length, = unpack_length(buffer, offset)
+            offset += 4
+            key = buffer[offset:offset + length]
+            offset += length
+            if record_type == TYPE_STRING:
+                length, = unpack_length(buffer, offset)
+                offset += 4
+                value = buffer[offset:offset + length]
+                offset += length
+            else:
+                value, offset = _decode_value(buffer, offset, record_type)
+            append((key, value, expiry))
+        checksum, = _CHECKSUM.unpack_from(buffer, offset)
+    except (IndexError, struct.error):
+        raise SnapshotError('truncated snapshot') from None
+    with memoryview(buffer) as view, view[start:offset] as payload:
+        if zlib.crc32(payload) != checksum:
+            raise SnapshotError('checksum mismatch')
+    return entries, offset + _CHECKSUM.size
+
+
+def load_snapshot(filename, datastore):
+    with open(filename, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            raise SnapshotError('empty snapshot')
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            entries, _ = read_snapshot(buffer)
+    datastore.bulk_load(entries)
+    return len(entries)
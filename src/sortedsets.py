@@ -0,0 +1,217 @@
+import random
+
+SKIPLIST_MAX_LEVEL = 32
+SKIPLIST_P = 0.25
+
+
+def format_score(score):
+    if score.is_integer() and abs(score) < 1e17:
+        return b'%d' % score
+    return repr(score).encode()
+
+
+class _Node:
+    __slots__ = ('member', 'score', 'forward', 'span')
+
+    def __init__(self, member, score, level):
+        self.member = member
+        self.score = score
+        self.forward = [None] * level
+        # number of level 0 steps each forward pointer skips, used for ranks
+        self.span = [0] * level
+
+
+# Skiplist ordered by (score, member) with spans on every link, as in redis'
+# zskiplist, so a node's rank and the node at a given rank are both found in
+# O(log N). Ranks are 1 based internally.
+class SkipList:
+    __slots__ = ('header', 'level', 'length')
+
+    def __init__(self):
+        self.header = _Node(None, None, SKIPLIST_MAX_LEVEL)
+        self.level = 1
+        self.length = 0
+
+    def _random_level(self):
+        level = 1
+        while level < SKIPLIST_MAX_LEVEL and random.random() < SKIPLIST_P:
+            level += 1
+        return level
+
+    def insert(self, score, member):
+        update = [None] * SKIPLIST_MAX_LEVEL
+        rank = [0] * SKIPLIST_MAX_LEVEL
+        x = self.header
+        for i in range(self.level - 1, -1, -1):
+            rank[i] = 0 if i == self.level - 1 else rank[i + 1]
+            node = x.forward[i]
+            while node is not None and (node.score < score or (node.score == score and node.member < member)):
+                rank[i] += x.span[i]
+                x, node = node, node.forward[i]
+            update[i] = x
+        level = self._random_level()
+        if level > self.level:
+            for i in range(self.level, level):
+                rank[i] = 0
+                update[i] = self.header
+                self.header.span[i] = self.length
+            self.level = level
+        new = _Node(member, score, level)
+        for i in range(level):
+            new.forward[i] = update[i].forward[i]
+            update[i].forward[i] = new
+            new.span[i] = update[i].span[i] - (rank[0] - rank[i])
+            update[i].span[i] = rank[0] - rank[i] + 1
+        for i in range(level, self.level):
+            update[i].span[i] += 1
+        self.length += 1
+
+    def delete(self, score, member):
+        update = [None] * SKIPLIST_MAX_LEVEL
+        x = self.header
+        for i in range(self.level - 1, -1, -1):
+            node = x.forward[i]
+            while node is not None and (node.score < score or (node.score == score and node.member < member)):
+                x, node = node, node.forward[i]
+            update[i] = x
+        x = x.forward[0]
+        if x is None or x.score != score or x.member != member:
+            return False
+        for i in range(self.level):
+            if update[i].forward[i] is x:
+                update[i].span[i] += x.span[i] - 1
+                update[i].forward[i] = x.forward[i]
+            else:
+                update[i].span[i] -= 1
+        while self.level > 1 and self.header.forward[self.level - 1] is None:
+            self.level -= 1
+        self.length -= 1
+        return True
+
+    def rank(self, score, member):
+        rank = 0
+        x = self.header
+        for i in range(self.level - 1, -1, -1):
+            node = x.forward[i]
+            while node is not None and (node.score < score or (node.score == score and node.member <= member)):
+                rank += x.span[i]
+                x, node = node, node.forward[i]
+            if x.member == member:
+                return rank
+        return 0
+
+    def node_at(self, rank):
+        traversed = 0
+        x = self.header
+        for i in range(self.level - 1, -1, -1):
+            while x.forward[i] is not None and traversed + x.span[i] <= rank:
+                traversed += x.span[i]
+                x = x.forward[i]
+            if traversed == rank:
+                return x
+        return None
+
+    def first_from(self, score, exclusive):
+        # first node whose score is >= score (> score when exclusive)
+        x = self.header
+        for i in range(self.level - 1, -1, -1):
+            node = x.forward[i]
+            while node is not None and (node.score < score or (exclusive and node.score == score)):
+                x, node = node, node.forward[i]
+        return x.forward[0]
+
+
+# Sorted set value: the skiplist keeps members ordered for rank and range
+# queries, the dict answers score lookups in O(1).
+class SortedSet:
+    __slots__ = ('scores', 'skiplist')
+
+    def __init__(self, pairs=()):
+        self.scores = {}
+        self.skiplist = SkipList()
+        for member, score in pairs:
+            self.add(member, score)
+
+    def __len__(self):
+        return len(self.scores)
+
+    def __eq__(self, other):
+        return isinstance(other, SortedSet) and self.scores == other.scores
+
+    def score(self, member):
+        return self.scores.get(member)
+
+    def add(self, member, score):
+        # returns True when the member is new
+        current = self.scores.get(member)
+        if current is not None:
+            if current == score:
+                return False
+            self.skiplist.delete(current, member)
+        self.skiplist.insert(score, member)
+        self.scores[member] = score
+        return current is None
+
+    def remove(self, member):
+        score = self.scores.pop(member, None)
+        if score is None:
+            return False
+        self.skiplist.delete(score, member)
+        return True
+
+    def rank(self, member):
+        score = self.scores.get(member)
+        if score is None:
+            return None
+        return self.skiplist.rank(score, member) - 1
+
+    def range_by_rank(self, start, stop):
+        length = len(self.scores)
+        if start < 0:
+            start = max(length + start, 0)
+        if stop < 0:
+            stop = length + stop
+        stop = min(stop, length - 1)
+        if start > stop:
+            return []
+        node = self.skiplist.node_at(start + 1)
+        result = []
+        for _ in range(stop - start + 1):
+            result.append((node.member, node.score))
+            node = node.forward[0]
+        return result
+
+    def range_by_score(self, low, high, low_exclusive=False, high_exclusive=False, offset=0, count=-1):
+        node = self.skiplist.first_from(low, low_exclusive)
+        while node is not None and offset > 0:
+            node, offset = node.forward[0], offset - 1
+        result = []
+        while node is not None and count != 0:
+            if node.score > high or (high_exclusive and node.score == high):
+                break
+            result.append((node.member, node.score))
+            node = node.forward[0]
+            count -= 1
+        return result
+
+    def items(self):
+        result = []
+        node = self.skiplist.header.forward[0]
+        while node is not None:
+            result.append((node.member, node.score))
+            node = node.forward[0]
+        return result
+
+    def copy(self):
+        # taken with shard locks held, so only the scores are copied, O(N)
+        # where rebuilding the skiplist would be O(N log N)
+        return SortedSetScores(self.scores)
+
+
+# Point in time (member, score) copy of a sorted set for snapshots and DUMP;
+# load_value turns it back into a SortedSet.
+class SortedSetScores(dict):
+    __slots__ = ()
+
+    def to_sorted_set(self):
+        return SortedSet(self.items())
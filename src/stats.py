@@ -0,0 +1,188 @@
+import math
+import os
+import sys
+from collections import deque
+from threading import Lock
+from time import time
+
+# latency histograms use power of two microsecond buckets: bucket i counts
+# calls that took less than 2**i us, enough buckets that no duration needs
+# clamping
+LATENCY_BUCKETS = 64
+# same defaults and argument truncation as redis' slowlog
+SLOWLOG_LOG_SLOWER_THAN = 10000
+SLOWLOG_MAX_LEN = 128
+SLOWLOG_MAX_ARGC = 32
+SLOWLOG_MAX_ARGLEN = 128
+
+
+class CommandStats:
+    __slots__ = ('calls', 'duration_ns', 'rejected', 'failed', 'histogram')
+
+    def __init__(self):
+        self.calls = 0
+        self.duration_ns = 0
+        self.rejected = 0
+        self.failed = 0
+        self.histogram = [0] * LATENCY_BUCKETS
+
+    def histogram_usec(self):
+        # cumulative counts per bucket upper bound, skipping empty buckets
+        result = []
+        total = 0
+        for i, count in enumerate(self.histogram):
+            if count:
+                total += count
+                result.append((1 << i, total))
+        return result
+
+
+# Process wide counters behind INFO. Command counters are bumped on every
+# dispatch without a lock: with the GIL an update is very rarely lost, which
+# is fine for monitoring and keeps the hot path at a dict lookup and a few adds.
+class ServerStats:
+    def __init__(self):
+        self.start_time = time()
+        self.port = 0
+        self.engine = 'threaded'
+        self.mode = 'standalone'
+        self.connected_clients = 0
+        self.total_connections = 0
+        self.evicted_keys = 0
+        self.commands = {}
+        self._clients_lock = Lock()
+
+    def set_server(self, port, engine, mode):
+        self.port = port
+        self.engine = engine
+        self.mode = mode
+
+    def client_connected(self):
+        with self._clients_lock:
+            self.connected_clients += 1
+            self.total_connections += 1
+
+    def client_disconnected(self):
+        with self._clients_lock:
+            self.connected_clients -= 1
+
+    def _command(self, name):
+        stats = self.commands.get(name)
+        if stats is None:
+            stats = self.commands.setdefault(name, CommandStats())
+        return stats
+
+    def record(self, name, duration_ns, failed):
+        stats = self.commands.get(name)
+        if stats is None:
+            stats = self._command(name)
+        stats.calls += 1
+        stats.duration_ns += duration_ns
+        stats.histogram[(duration_ns // 1000).bit_length()] += 1
+        if failed:
+            stats.failed += 1
+
+    def reject(self, name):
+        self._command(name).rejected += 1
+
+    def total_commands(self):
+        return sum(stats.calls for stats in list(self.commands.values()))
+
+    def reset(self):
+        self.commands = {}
+        self.evicted_keys = 0
+        self.total_connections = self.connected_clients
+
+    def server_info(self):
+        uptime = int(time() - self.start_time)
+        return [
+            ('redis_mode', self.mode),
+            ('engine', self.engine),
+            ('python_version', sys.version.split()[0]),
+            ('process_id', os.getpid()),
+            ('tcp_port', self.port),
+            ('uptime_in_seconds', uptime),
+            ('uptime_in_days', uptime // 86400),
+        ]
+
+    def command_info(self):
+        info = []
+        for name, stats in sorted(list(self.commands.items())):
+            usec = stats.duration_ns // 1000
+            per_call = usec / stats.calls if stats.calls else 0
+            info.append((
+                f'cmdstat_{name}',
+                f'calls={stats.calls},usec={usec},usec_per_call={per_call:.2f},'
+                f'rejected_calls={stats.rejected},failed_calls={stats.failed}',
+            ))
+        return info
+
+
+SERVER_STATS = ServerStats()
+
+
+def _format_address(address):
+    if isinstance(address, tuple):
+        return f'{address[0]}:{address[1]}'
+    return address or ''
+
+
+# Bounded log of the commands slower than a threshold, newest first. The
+# dispatch path only compares the duration with threshold_ns; the lock is
+# taken for slow commands alone.
+class SlowLog:
+    def __init__(self, log_slower_than=SLOWLOG_LOG_SLOWER_THAN, max_len=SLOWLOG_MAX_LEN):
+        self._lock = Lock()
+        self._next_id = 0
+        self.entries = deque()
+        self.configure(log_slower_than, max_len)
+
+    def configure(self, log_slower_than, max_len):
+        # a negative threshold disables the log, 0 logs every command
+        self.threshold_ns = math.inf if log_slower_than < 0 else log_slower_than * 1000
+        with self._lock:
+            self.entries = deque(self.entries, maxlen=max_len)
+
+    def add(self, command, duration_ns, address=None):
+        args = [c.data for c in command[:SLOWLOG_MAX_ARGC]]
+        if len(command) > SLOWLOG_MAX_ARGC:
+            args[-1] = b'... (%d more arguments)' % (len(command) - SLOWLOG_MAX_ARGC + 1)
+        args = [
+            arg[:SLOWLOG_MAX_ARGLEN] + b'... (%d more bytes)' % (len(arg) - SLOWLOG_MAX_ARGLEN)
+            if len(arg) > SLOWLOG_MAX_ARGLEN else arg
+            for arg in args
+        ]
+        with self._lock:
+            self.entries.appendleft((self._next_id, int(time()), duration_ns // 1000, args, _format_address(address)))
+            self._next_id += 1
+
+    def get(self, count):
+        with self._lock:
+            return list(self.entries)[:count]
+
+    def __len__(self):
+        return len(self.entries)
+
+    def reset(self):
+        with self._lock:
+            self.entries.clear()
+
+
+SLOW_LOG = SlowLog()
+
+
+def format_bytes(size):
+    # redis' *_human fields: 1.50M, 12.00K, 512B
+    for unit in ('B', 'K', 'M', 'G'):
+        if size < 1024 or unit == 'G':
+            return f'{size}B' if unit == 'B' else f'{size:.2f}{unit}'
+        size /= 1024
+
+
+def process_rss():
+    # resident set size from /proc, 0 where it is not available
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return 0
@@ -11,7 +11,7 @@ class SimpleString:
         return self.data
     
     def resp_encode(self):
-        return f'+{self.data}\r\n'.encode()
+        return b'+%b\r\n' % self.data.encode()
 
 @dataclass
 class Error:
@@ -23,7 +23,7 @@ class Error:
         return self.data
     
     def resp_encode(self):
-        return f'-{self.data}\r\n'.encode()
+        return b'-%b\r\n' % self.data.encode()
 
 @dataclass
 class Integer:
@@ -35,7 +35,7 @@ class Integer:
         return str(self.value)
     
     def resp_encode(self):
-        return f':{self.value}\r\n'.encode()
+        return b':%d\r\n' % self.value
 
 @dataclass
 class BulkString:
@@ -50,13 +50,8 @@ class BulkString:
     
     def resp_encode(self):
         if self.data is None:
-            return '$-1\r\n'.encode()
-        return f'${len(self.data)}\r\n{self.data}\r\n'.encode()
-    
-    def file_encode(self):
-        if self.data is None:
-            return '$-1\r\n'.encode()
-        return f'${len(self.data)}\r\n{self.data.decode()}\r\n'.encode()
+            return b'$-1\r\n'
+        return b'$%d\r\n%b\r\n' % (len(self.data), self.data)
 
 @dataclass
 class Array(Sequence):
@@ -72,10 +67,18 @@ class Array(Sequence):
     
     def resp_encode(self):
         if self.data is None:
-            return '*-1\r\n'.encode()
-        array_length = len(self.data)
-        encoded_message = [f'*{array_length}\r\n'.encode()]
-        for i in range(array_length):
-            encoded_element = self.data[i].resp_encode()
-            encoded_message.append(encoded_element)
+            return b'*-1\r\n'
+        encoded_message = [b'*%d\r\n' % len(self.data)]
+        for element in self.data:
+            encoded_message.append(element.resp_encode())
         return b''.join(encoded_message)
+
+# several replies to one command, as SUBSCRIBE sends one per channel
+@dataclass
+class Replies:
+    data: list
+    def __eq__(self, other):
+        return self.data == other.data
+
+    def resp_encode(self):
+        return b''.join(reply.resp_encode() for reply in self.data)
@@ -0,0 +1,160 @@
+import os
+import signal
+import socket
+import sys
+import tempfile
+import threading
+from functools import partial
+
+from src.command_handler import lookup_command
+from src.hashslot import key_hash_slot
+from src.protocol_handler import RespParser, encode_message
+from src.replication import peer_closed
+from src.server import RECV_SIZE, handle_client_connection
+from src.types import Error
+
+
+def worker_socket_path(port, worker_id):
+    return os.path.join(tempfile.gettempdir(), f'pyredis-{port}-worker-{worker_id}.sock')
+
+
+def worker_for_key(key, worker_count):
+    return key_hash_slot(key) % worker_count
+
+
+# Sends commands for keys owned by another worker process to that worker
+# over its unix socket and relays the reply. Connections are kept per thread
+# so client threads never wait on each other's forwarded commands.
+class WorkerRouter:
+    def __init__(self, worker_id, socket_paths):
+        self.worker_id = worker_id
+        self._socket_paths = socket_paths
+        self._local = threading.local()
+
+    def owner(self, command):
+        spec = lookup_command(command[0].data)
+        if spec is None or not spec.check_arity(len(command)):
+            return self.worker_id
+        owners = {worker_for_key(key, len(self._socket_paths)) for key in spec.keys(command)}
+        if not owners:
+            return self.worker_id
+        if len(owners) > 1:
+            return None
+        return owners.pop()
+
+    def route(self, command, client=None):
+        owner = self.owner(command)
+        if owner is None:
+            return Error("CROSSSLOT Keys in request don't hash to the same worker")
+        if owner == self.worker_id:
+            return None
+        if client is not None and client.defers_blocking_calls:
+            # the asyncio engine sends it from a thread, off the event loop
+            client.deferred = partial(self.forward, owner, command)
+            return None
+        return self.forward(owner, command)
+
+    def _connections(self):
+        connections = getattr(self._local, 'connections', None)
+        if connections is None:
+            connections = self._local.connections = {}
+        return connections
+
+    def _connect(self, owner):
+        connections = self._connections()
+        connection = connections.get(owner)
+        if connection is not None and peer_closed(connection[0]):
+            # the worker went away since the last command, nothing was sent
+            # on this connection yet so a fresh one can take the command
+            connection[0].close()
+            connection = None
+        if connection is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.connect(self._socket_paths[owner])
+            except OSError:
+                sock.close()
+                connections.pop(owner, None)
+                raise
+            connection = connections[owner] = (sock, RespParser())
+        return connection
+
+    def forward(self, owner, command):
+        try:
+            sock, parser = self._connect(owner)
+        except OSError:
+            return Error(f'ERR worker {owner} is unavailable')
+        try:
+            sock.sendall(encode_message(command))
+            while True:
+                reply = parser.get_frame()
+                if reply is not None:
+                    return reply
+                data = sock.recv(RECV_SIZE)
+                if not data:
+                    raise ConnectionError('worker closed the connection')
+                parser.feed(data)
+        except OSError:
+            # the command may have run, so it is not sent again
+            sock.close()
+            self._connections().pop(owner, None)
+            return Error(f'ERR connection to worker {owner} lost, the command may or may not have run')
+
+
+# Serves the commands other workers forward to this one; they are always
+# executed locally.
+def serve_worker_socket(path, datastore, persister):
+    if os.path.exists(path):
+        os.remove(path)
+    server_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server_socket.bind(path)
+    server_socket.listen()
+
+    def accept_forever():
+        with server_socket:
+            while True:
+                connection, _ = server_socket.accept()
+                threading.Thread(
+                    target=handle_client_connection, args=(connection, datastore, persister), daemon=True
+                ).start()
+
+    threading.Thread(target=accept_forever, daemon=True).start()
+    return server_socket
+
+
+def _exit_on_sigterm(signum, frame):
+    # turn SIGTERM into SystemExit so finally blocks (AOF flush) still run
+    sys.exit(0)
+
+
+def run_workers(worker_count, start_worker):
+    signal.signal(signal.SIGTERM, _exit_on_sigterm)
+    children = []
+    for worker_id in range(worker_count):
+        pid = os.fork()
+        if pid == 0:
+            status = 0
+            try:
+                status = start_worker(worker_id) or 0
+            except (KeyboardInterrupt, SystemExit):
+                pass
+            finally:
+                os._exit(status)
+        children.append(pid)
+
+    try:
+        for _ in children:
+            os.wait()
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for pid in children:
+            try:
+                os.waitpid(pid, 0)
+            except ChildProcessError:
+                pass
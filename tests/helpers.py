@@ -0,0 +1,52 @@
+import socket
+import time
+from src.persistence import CommandLock
+from src.types import Array, BulkString
+
+
+def bulk_command(*args):
+    return Array([BulkString(a) for a in args])
+
+
+class RecordingPersister:
+    def __init__(self):
+        self.commands = []
+        self.command_lock = CommandLock()
+
+    def log_command(self, command):
+        self.commands.append([c.data for c in command])
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("localhost", 0))
+        return s.getsockname()[1]
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("condition not met in time")
+        time.sleep(0.01)
+
+
+def connect(port):
+    deadline = time.monotonic() + 5
+    while True:
+        try:
+            return socket.create_connection(("localhost", port))
+        except ConnectionRefusedError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.01)
+
+
+def recv_exactly(sock, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            break
+        data.extend(chunk)
+    return bytes(data)
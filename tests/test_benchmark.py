@@ -0,0 +1,55 @@
+import threading
+import pytest
+from src.benchmark import COMMAND_POOL_SIZE, command_pool, parse_mix, run_in_process, run_network
+from src.datastore import DataStore
+from src.server import AsyncServer
+from tests.helpers import free_port
+
+
+def test_parse_mix():
+    assert parse_mix("get:3, SET") == [("get", 3), ("set", 1)]
+    with pytest.raises(ValueError):
+        parse_mix("get,flushall")
+    with pytest.raises(ValueError):
+        parse_mix("get:0")
+
+
+def test_command_pool_follows_the_mix():
+    pool = command_pool(parse_mix("incr:3,lrange:1"), 10, 8, seed=1)
+    assert len(pool) == COMMAND_POOL_SIZE
+    incrs = sum(name == "incr" for name, _ in pool)
+    assert 0.7 < incrs / len(pool) < 0.8
+    assert pool == command_pool(parse_mix("incr:3,lrange:1"), 10, 8, seed=1)
+
+
+def test_in_process_run():
+    datastore = DataStore()
+    pool = command_pool(parse_mix("set,get,incr,lpush,lrange"), 50, 16, seed=2)
+    results, elapsed = run_in_process(pool, 8, 1000, datastore)
+    summary = results.summary(elapsed)
+    assert summary["total"]["requests"] == 1000
+    assert summary["total"]["errors"] == 0
+    assert set(summary["commands"]) == {"GET", "SET", "INCR", "LPUSH", "LRANGE"}
+    assert summary["total"]["p50_ms"] <= summary["total"]["p99_ms"] <= summary["total"]["max_ms"]
+    assert len(datastore) > 0
+
+
+def test_network_run():
+    port = free_port()
+    server = AsyncServer(port, DataStore(), None)
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    try:
+        pool = command_pool(parse_mix("set,get"), 100, 16, seed=3)
+        for _ in range(100):
+            try:
+                results, elapsed = run_network("127.0.0.1", port, pool, 4, 5, 503)
+                break
+            except ConnectionRefusedError:
+                threading.Event().wait(0.01)
+        summary = results.summary(elapsed)
+        assert summary["total"]["requests"] == 503
+        assert summary["total"]["errors"] == 0
+    finally:
+        server.stop()
+        thread.join(timeout=5)
@@ -0,0 +1,88 @@
+import io
+import threading
+import pytest
+from src.cli import run_pipe
+from src.client import Client, ReplyError
+from src.datastore import DataStore
+from src.server import AsyncServer
+from tests.helpers import free_port
+
+
+@pytest.fixture
+def client():
+    port = free_port()
+    server = AsyncServer(port, DataStore(), None)
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    client = Client("127.0.0.1", port, max_connections=4)
+    for _ in range(500):
+        try:
+            client.execute("PING")
+            break
+        except ConnectionRefusedError:
+            threading.Event().wait(0.01)
+    yield client
+    client.close()
+    server.stop()
+    thread.join(timeout=5)
+
+
+def test_execute_converts_replies(client):
+    assert client.execute("SET", "k", b"v") == "OK"
+    assert client.execute("GET", "k") == b"v"
+    assert client.execute("GET", "missing") is None
+    assert client.execute("INCRBY", "n", 5) == 5
+    assert client.execute("RPUSH", "list", "a", "b") == 2
+    assert client.execute("LRANGE", "list", 0, 2) == [b"a", b"b"]
+    with pytest.raises(ReplyError, match="WRONGTYPE"):
+        client.execute("INCR", "list")
+
+
+def test_pipeline_sends_one_batch(client):
+    with client.pipeline() as pipeline:
+        for i in range(100):
+            pipeline.command("SET", f"key:{i}", i)
+        pipeline.command("INCR", "list-free").command("LPUSH", "key:0", "x")
+        assert len(pipeline) == 102
+        replies = pipeline.execute()
+    assert replies[:100] == ["OK"] * 100
+    assert replies[100] == 1
+    assert isinstance(replies[101], ReplyError)
+    assert client.pipeline().execute() == []
+
+
+def test_pool_is_shared_between_threads(client):
+    def work():
+        for _ in range(50):
+            client.execute("INCR", "counter")
+
+    threads = [threading.Thread(target=work) for _ in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert client.execute("GET", "counter") == b"500"
+    assert client.pool()._created <= 4
+
+
+def test_reconnects_after_the_server_drops_the_connection(client):
+    with client.pool().connection() as connection:
+        # a protocol error makes the server reply and close the socket
+        connection._socket.sendall(b"?garbage\r\n")
+        while connection._socket.recv(1024):
+            pass
+    assert client.execute("SET", "k", "v") == "OK"
+    assert client.execute("GET", "k") == b"v"
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        b"SET a 1\nINCR a\n\nINCR b",
+        b"*3\r\n$3\r\nSET\r\n$1\r\na\r\n$1\r\n1\r\n*2\r\n$4\r\nINCR\r\n$1\r\na\r\n*2\r\n$4\r\nINCR\r\n$1\r\nb\r\n",
+    ],
+)
+def test_pipe_mode(client, data):
+    assert run_pipe(client, io.BytesIO(data), batch_size=2) == (3, 0)
+    assert client.execute("GET", "a") == b"2"
+    assert run_pipe(client, io.BytesIO(b"SET a 1\nLPUSH a x\n"), batch_size=10) == (2, 1)
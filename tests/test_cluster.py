@@ -0,0 +1,237 @@
+import socket
+import threading
+import time
+import pytest
+from src import client as redis_client
+from src.cluster import ClusterRouter, ClusterState
+from src.command_handler import handle_command
+from src.datastore import DataStore
+from src.hashslot import key_hash_slot
+from src.server import AsyncServer, Client
+from src.types import BulkString, Error, Integer, SimpleString
+from tests.helpers import bulk_command, free_port
+
+
+def _key_in_slot_range(start, end):
+    for i in range(100000):
+        key = b"key:%d" % i
+        if start <= key_hash_slot(key) <= end:
+            return key
+
+
+NODES = [("127.0.0.1", 7000), ("127.0.0.1", 7001)]
+
+
+def test_slots_are_split_evenly_in_node_order():
+    state = ClusterState(NODES[0], NODES)
+    assert state.slot_ranges() == [(0, 8191, NODES[0]), (8192, 16383, NODES[1])]
+
+
+def test_moved_and_crossslot():
+    datastore = DataStore()
+    router = ClusterRouter(ClusterState(NODES[0], NODES), datastore)
+    client = Client(None)
+    local, remote = _key_in_slot_range(0, 8191), _key_in_slot_range(8192, 16383)
+
+    assert router.route(bulk_command(b"SET", local, b"v"), client) is None
+    assert router.route(bulk_command(b"GET", remote), client) == Error(
+        "MOVED %d 127.0.0.1:7001" % key_hash_slot(remote)
+    )
+    assert router.route(bulk_command(b"DEL", local, remote), client).data.startswith("CROSSSLOT")
+    # hashtags keep related keys in one slot
+    assert router.route(bulk_command(b"DEL", b"{%b}a" % local, b"{%b}b" % local), client) is None
+    assert router.route(bulk_command(b"CLUSTER", b"KEYSLOT", b"foo"), client) == Integer(12182)
+    assert router.route(bulk_command(b"PING"), client) is None
+
+
+def test_asking_only_applies_to_the_next_command():
+    router = ClusterRouter(ClusterState(NODES[1], NODES), DataStore())
+    client = Client(None)
+    key = _key_in_slot_range(0, 8191)
+    slot = key_hash_slot(key)
+    assert router.route(bulk_command(b"CLUSTER", b"SETSLOT", b"%d" % slot, b"IMPORTING", b"127.0.0.1:7000"), client) == SimpleString("OK")
+
+    assert router.route(bulk_command(b"GET", key), client).data.startswith("MOVED")
+    assert router.route(bulk_command(b"ASKING"), client) == SimpleString("OK")
+    assert router.route(bulk_command(b"GET", key), client) is None
+    assert router.route(bulk_command(b"GET", key), client).data.startswith("MOVED")
+
+
+def test_dump_restore_round_trip():
+    datastore = DataStore()
+    handle_command(bulk_command(b"RPUSH", b"list", b"a"), datastore)
+    handle_command(bulk_command(b"RPUSH", b"list", b"b"), datastore)
+    payload = handle_command(bulk_command(b"DUMP", b"list"), datastore).data
+
+    assert handle_command(bulk_command(b"RESTORE", b"list", b"0", payload), datastore).data.startswith("BUSYKEY")
+    assert handle_command(bulk_command(b"RESTORE", b"copy", b"0", payload), datastore) == SimpleString("OK")
+    assert handle_command(bulk_command(b"LRANGE", b"copy", b"0", b"2"), datastore) == bulk_command(b"a", b"b")
+    assert handle_command(bulk_command(b"RESTORE", b"bad", b"0", payload[:-1] + b"x"), datastore).data.startswith("ERR")
+
+
+@pytest.fixture
+def cluster():
+    ports = [free_port(), free_port()]
+    nodes = [("127.0.0.1", port) for port in ports]
+    servers, threads = [], []
+    for node in nodes:
+        datastore = DataStore()
+        router = ClusterRouter(ClusterState(node, nodes), datastore)
+        server = AsyncServer(node[1], datastore, None, router)
+        thread = threading.Thread(target=server.run, daemon=True)
+        thread.start()
+        servers.append(server)
+        threads.append(thread)
+    yield nodes
+    for server, thread in zip(servers, threads):
+        server.stop()
+        thread.join(timeout=5)
+
+
+def _client(node):
+    client = redis_client.Client(*node)
+    for _ in range(500):
+        try:
+            client.execute(b"PING")
+            return client
+        except ConnectionRefusedError:
+            threading.Event().wait(0.01)
+    raise ConnectionRefusedError(node)
+
+
+def test_live_slot_migration(cluster):
+    source, target = cluster
+    key = _key_in_slot_range(0, 8191)
+    other = b"{%b}other" % key
+    slot = b"%d" % key_hash_slot(key)
+    client = _client(source)
+    reply = client.request(bulk_command(b"SET", key, b"v"))
+    assert reply == SimpleString("OK")
+    reply = client.request(bulk_command(b"SET", other, b"w"))
+
+    to_target, to_source = _client(target), _client(source)
+    to_target.request(bulk_command(b"CLUSTER", b"SETSLOT", slot, b"IMPORTING", b"127.0.0.1:%d" % source[1]))
+    to_source.request(bulk_command(b"CLUSTER", b"SETSLOT", slot, b"MIGRATING", b"127.0.0.1:%d" % target[1]))
+    reply = to_source.request(bulk_command(b"MIGRATE", b"127.0.0.1", b"%d" % target[1], key, b"0", b"1000"))
+    assert reply == SimpleString("OK")
+
+    # the moved key is answered through an ASK redirect, the other one locally
+    assert to_source.pool().request([bulk_command(b"GET", key)])[0].data.startswith("ASK")
+    reply = client.request(bulk_command(b"GET", key))
+    assert reply == BulkString(b"v")
+    reply = client.request(bulk_command(b"GET", other))
+    assert reply == BulkString(b"w")
+
+    to_source.request(bulk_command(b"MIGRATE", b"127.0.0.1", b"%d" % target[1], other, b"0", b"1000"))
+    for node_client in (to_source, to_target):
+        node_client.request(bulk_command(b"CLUSTER", b"SETSLOT", slot, b"NODE", b"127.0.0.1:%d" % target[1]))
+    reply = client.request(bulk_command(b"GET", other))
+    assert reply == BulkString(b"w")
+    assert client.address == target
+    for c in (client, to_source, to_target):
+        c.close()
+
+
+def test_keys_in_slot_index_follows_writes():
+    datastore = DataStore()
+    handle_command(bulk_command(b"SET", b"{a}1", b"v"), datastore)
+    router = ClusterRouter(ClusterState(NODES[0], NODES), datastore)
+    client = Client(None)
+    slot = b"%d" % key_hash_slot(b"a")
+    for key in (b"{a}2", b"{a}3", b"b"):
+        handle_command(bulk_command(b"SET", key, b"v"), datastore)
+    handle_command(bulk_command(b"DEL", b"{a}3"), datastore)
+    handle_command(bulk_command(b"SET", b"{a}1", b"w"), datastore)
+
+    assert router.route(bulk_command(b"CLUSTER", b"COUNTKEYSINSLOT", slot), client) == Integer(2)
+    keys = router.route(bulk_command(b"CLUSTER", b"GETKEYSINSLOT", slot, b"10"), client)
+    assert sorted(key.data for key in keys) == [b"{a}1", b"{a}2"]
+    assert len(router.route(bulk_command(b"CLUSTER", b"GETKEYSINSLOT", slot, b"1"), client)) == 1
+    datastore.bulk_load([(b"{a}4", b"v", 0)])
+    assert datastore.count_keys_in_slot(key_hash_slot(b"a")) == 3
+    datastore.clear()
+    assert router.route(bulk_command(b"CLUSTER", b"COUNTKEYSINSLOT", slot), client) == Integer(0)
+
+
+
+def test_count_keys_in_slot_waits_for_the_shard_lock():
+    datastore = DataStore()
+    handle_command(bulk_command(b"SET", b"{a}1", b"v"), datastore)
+    ClusterRouter(ClusterState(NODES[0], NODES), datastore)
+    counts = []
+    shard = datastore._shard(b"{a}1")
+    with shard.lock:
+        counter = threading.Thread(target=lambda: counts.append(datastore.count_keys_in_slot(key_hash_slot(b"a"))))
+        counter.start()
+        counter.join(timeout=0.1)
+        assert counter.is_alive()
+    counter.join(timeout=5)
+    assert counts == [1]
+
+def _silent_target():
+    # accepts connections but never answers
+    listener = socket.socket()
+    listener.bind(("127.0.0.1", 0))
+    listener.listen()
+    return listener
+
+
+def test_migrate_does_not_block_the_event_loop(cluster):
+    source, _ = cluster
+    key = _key_in_slot_range(0, 8191)
+    with _silent_target() as target:
+        migrating, other = _client(source), _client(source)
+        migrating.request(bulk_command(b"SET", key, b"v"))
+        port = b"%d" % target.getsockname()[1]
+        result = []
+        thread = threading.Thread(target=lambda: result.append(
+            migrating.request(bulk_command(b"MIGRATE", b"127.0.0.1", port, key, b"0", b"1000"))
+        ))
+        thread.start()
+        start = time.monotonic()
+        assert other.request(bulk_command(b"PING")) == SimpleString("PONG")
+        assert time.monotonic() - start < 0.5
+        thread.join()
+    assert result[0].data.startswith("IOERR")
+    assert other.request(bulk_command(b"GET", key)) == BulkString(b"v")
+    migrating.close()
+    other.close()
+
+
+def test_migrate_keeps_a_key_written_during_the_transfer():
+    datastore = DataStore()
+    datastore[b"k"] = b"v"
+    listener = socket.socket()
+    listener.bind(("127.0.0.1", 0))
+    listener.listen()
+
+    def target():
+        connection, _ = listener.accept()
+        with connection:
+            data = b""
+            while not data.endswith(b"ABSTTL\r\n"):
+                data += connection.recv(4096)
+            datastore[b"k"] = b"changed"
+            connection.sendall(b"+OK\r\n+OK\r\n")
+
+    thread = threading.Thread(target=target)
+    thread.start()
+    with listener:
+        port = b"%d" % listener.getsockname()[1]
+        result = handle_command(bulk_command(b"MIGRATE", b"127.0.0.1", port, b"k", b"0", b"1000"), datastore)
+    thread.join()
+    assert result.data.startswith("ERR key was modified")
+    assert datastore[b"k"] == b"changed"
+
+
+def test_setslot_without_a_node_is_rejected(cluster):
+    source, _ = cluster
+    client = _client(source)
+    key = _key_in_slot_range(0, 8191)
+    slot = b"%d" % key_hash_slot(key)
+    for state in (b"NODE", b"MIGRATING", b"IMPORTING"):
+        reply = client.request(bulk_command(b"CLUSTER", b"SETSLOT", slot, state))
+        assert reply == Error("ERR wrong number of arguments for 'cluster|setslot' command")
+    assert client.request(bulk_command(b"SET", key, b"v")) == SimpleString("OK")
+    assert len(client.request(bulk_command(b"CLUSTER", b"SLOTS"))) == 2
+    client.close()
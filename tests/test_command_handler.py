@@ -1,8 +1,11 @@
+import os
+from threading import Thread
 from time import sleep, time_ns
 import pytest
-from src.command_handler import handle_command
+from src.command_handler import NOT_INTEGER_ERROR, WRONGTYPE_ERROR, handle_command
 from src.datastore import DataStore
 from src.types import Array, BulkString, Error, Integer, SimpleString
+from tests.helpers import RecordingPersister, bulk_command
 
 @pytest.mark.parametrize(
     "command, expected",
@@ -10,19 +13,19 @@ from src.types import Array, BulkString, Error, Integer, SimpleString
         # Echo Tests
         (
             Array([BulkString(b"ECHO")]),
-            Error("ERR wrong number of arguments for ECHO command"),
+            Error("ERR wrong number of arguments for 'echo' command"),
         ),
-        (Array([BulkString(b"echo"), BulkString(b"Hello")]), BulkString("Hello")),
+        (Array([BulkString(b"echo"), BulkString(b"Hello")]), BulkString(b"Hello")),
         (
             Array([BulkString(b"echo"), BulkString(b"Hello"), BulkString("World")]),
-            Error("ERR wrong number of arguments for ECHO command"),
+            Error("ERR wrong number of arguments for 'echo' command"),
         ),
         # Ping Tests
         (Array([BulkString(b"ping")]), SimpleString("PONG")),
-        (Array([BulkString(b"ping"), BulkString(b"Hello")]), BulkString("Hello")),
+        (Array([BulkString(b"ping"), BulkString(b"Hello")]), BulkString(b"Hello")),
         (
             Array([BulkString(b"ping"), BulkString(b"Hello"), BulkString("Hello")]),
-            Error("ERR wrong number of arguments for PING command"),
+            Error("ERR wrong number of arguments for 'ping' command"),
         ),
         # Set Command Tests 
         (
@@ -70,8 +73,8 @@ def test_handle_command(command, expected):
 
 def test_set_with_expiry():
     datastore = DataStore()
-    key = 'key'
-    value = 'value'
+    key = b'key'
+    value = b'value'
     ex = 1
     px = 100
 
@@ -80,30 +83,26 @@ def test_set_with_expiry():
     # seconds
     command = base_command[:]
     command.extend([BulkString(b"ex"), BulkString(f"{ex}".encode())])
-    expected_expiry = time_ns() + (ex * 10**9)
     result = handle_command(command, datastore)
     assert result == SimpleString("OK")
-    stored = datastore._data[key]
-    assert stored.value == value
-    diff = - expected_expiry - stored.expiry
-    assert diff < 10000
+    assert datastore[key] == value
+    diff = ex * 10**9 - datastore.ttl(key)
+    assert 0 <= diff < 10**7
 
     # milliseconds
     command = base_command[:]
     command.extend([BulkString(b"px"), BulkString(f"{px}".encode())])
-    expected_expiry = time_ns() + (ex * 10**6)
     result = handle_command(command, datastore)
     assert result == SimpleString("OK")
-    stored = datastore._data[key]
-    assert stored.value == value
-    diff = - expected_expiry - stored.expiry
-    assert diff < 10000
+    assert datastore[key] == value
+    diff = px * 10**6 - datastore.ttl(key)
+    assert 0 <= diff < 10**7
 
 
 def test_get_with_expiry():
     datastore = DataStore()
-    key = 'key'
-    value = 'value'
+    key = b'key'
+    value = b'value'
     px = 100
 
     command = [
@@ -149,7 +148,7 @@ def test_handle_lpush_lrange():
     result = handle_command(Array([BulkString(b"lpush"), SimpleString(b"klp"), SimpleString(b"first")]), datastore)
     assert result == Integer(2)
     result = handle_command(Array([BulkString(b"lrange"), SimpleString(b"klp"), BulkString(b"0"), BulkString(b"2")]), datastore)
-    assert result == Array(data=[BulkString("first"), BulkString("second")])
+    assert result == Array(data=[BulkString(b"first"), BulkString(b"second")])
 
 # Rpush Tests
 def test_handle_rpush_lrange():
@@ -159,4 +158,493 @@ def test_handle_rpush_lrange():
     result = handle_command(Array([BulkString(b"rpush"), SimpleString(b"krp"), SimpleString(b"second")]), datastore)
     assert result == Integer(2)
     result = handle_command(Array([BulkString(b"lrange"), SimpleString(b"krp"), BulkString(b"0"), BulkString(b"2")]), datastore)
-    assert result == Array(data=[BulkString("first"), BulkString("second")])
+    assert result == Array(data=[BulkString(b"first"), BulkString(b"second")])
+
+def test_binary_safe_values_round_trip():
+    datastore = DataStore()
+    value = bytes(range(256))
+    result = handle_command(Array([BulkString(b"set"), BulkString(b"bin"), BulkString(value)]), datastore)
+    assert result == SimpleString("OK")
+    result = handle_command(Array([BulkString(b"get"), BulkString(b"bin")]), datastore)
+    assert result.data == value
+    assert result.resp_encode() == b"$256\r\n" + value + b"\r\n"
+
+def test_write_commands_are_logged_centrally():
+    datastore = DataStore()
+    persister = RecordingPersister()
+    handle_command(Array([BulkString(b"SET"), BulkString(b"k"), BulkString(b"1")]), datastore, persister)
+    handle_command(Array([BulkString(b"get"), BulkString(b"k")]), datastore, persister)
+    handle_command(Array([BulkString(b"Incr"), BulkString(b"k")]), datastore, persister)
+    handle_command(Array([BulkString(b"lpush"), BulkString(b"k"), BulkString(b"x")]), datastore, persister)
+    assert persister.commands == [[b"SET", b"k", b"1"], [b"Incr", b"k"]]
+
+def test_command_info():
+    datastore = DataStore()
+    result = handle_command(Array([BulkString(b"command"), BulkString(b"info"), BulkString(b"GET"), BulkString(b"nope")]), datastore)
+    assert result == Array([
+        Array([
+            BulkString(b"get"),
+            Integer(2),
+            Array([SimpleString("readonly"), SimpleString("fast")]),
+            Integer(1),
+            Integer(1),
+            Integer(1),
+        ]),
+        Array(None),
+    ])
+    count = handle_command(Array([BulkString(b"COMMAND"), BulkString(b"COUNT")]), datastore)
+    listing = handle_command(Array([BulkString(b"COMMAND")]), datastore)
+    assert count == Integer(len(listing))
+
+def test_expire_ttl_persist():
+    datastore = DataStore()
+    assert handle_command(bulk_command(b"expire", b"k", b"10"), datastore) == Integer(0)
+    assert handle_command(bulk_command(b"ttl", b"k"), datastore) == Integer(-2)
+    handle_command(bulk_command(b"set", b"k", b"v"), datastore)
+    assert handle_command(bulk_command(b"ttl", b"k"), datastore) == Integer(-1)
+    assert handle_command(bulk_command(b"expire", b"k", b"10"), datastore) == Integer(1)
+    assert handle_command(bulk_command(b"ttl", b"k"), datastore) == Integer(10)
+    assert 9900 < handle_command(bulk_command(b"pttl", b"k"), datastore).value <= 10000
+    assert handle_command(bulk_command(b"persist", b"k"), datastore) == Integer(1)
+    assert handle_command(bulk_command(b"persist", b"k"), datastore) == Integer(0)
+    assert handle_command(bulk_command(b"ttl", b"k"), datastore) == Integer(-1)
+    assert handle_command(bulk_command(b"pexpire", b"k", b"-1"), datastore) == Integer(1)
+    assert handle_command(bulk_command(b"exists", b"k"), datastore) == Integer(0)
+
+def test_expiries_past_the_millisecond_range_are_rejected():
+    datastore = DataStore()
+    persister = RecordingPersister()
+    huge = b"99999999999999999999"
+    assert handle_command(bulk_command(b"set", b"k", b"v", b"EX", huge), datastore, persister) == Error(
+        "ERR invalid expire time in 'set' command"
+    )
+    assert handle_command(bulk_command(b"set", b"k", b"v", b"PXAT", b"9223372036854775808"), datastore) == Error(
+        "ERR invalid expire time in 'set' command"
+    )
+    handle_command(bulk_command(b"set", b"k", b"v"), datastore, persister)
+    for name, value in ((b"expire", huge), (b"expire", b"-" + huge), (b"pexpire", b"9223372036854775807")):
+        assert handle_command(bulk_command(name, b"k", value), datastore, persister) == Error(
+            f"ERR invalid expire time in '{name.decode()}' command"
+        )
+    assert handle_command(bulk_command(b"ttl", b"k"), datastore) == Integer(-1)
+    assert persister.commands == [[b"set", b"k", b"v"]]
+
+def test_active_expiry_reclaims_small_keyspace():
+    datastore = DataStore()
+    for i in range(5):
+        handle_command(bulk_command(b"set", b"k%d" % i, b"v", b"px", b"10"), datastore)
+    handle_command(bulk_command(b"set", b"kept", b"v"), datastore)
+    sleep(0.02)
+    datastore.auto_check_expiry()
+    assert [key for key, _, _ in datastore.snapshot()] == [b"kept"]
+    assert all(not shard.expiry_heap for shard in datastore._shards)
+
+def test_relative_expiry_is_logged_as_absolute():
+    datastore = DataStore()
+    persister = RecordingPersister()
+    handle_command(bulk_command(b"set", b"k", b"v", b"ex", b"100"), datastore, persister)
+    handle_command(bulk_command(b"expire", b"k", b"100"), datastore, persister)
+    expected_ms = (time_ns() + 100 * 10**9) // 10**6
+    (set_command, expire_command) = persister.commands
+    assert set_command[:4] == [b"SET", b"k", b"v", b"PXAT"]
+    assert expire_command[:2] == [b"PEXPIREAT", b"k"]
+    for command in persister.commands:
+        assert abs(int(command[-1]) - expected_ms) < 1000
+
+def test_relative_expiry_is_stored_as_logged():
+    datastore = DataStore()
+    persister = RecordingPersister()
+    handle_command(bulk_command(b"set", b"k", b"v", b"px", b"100000"), datastore, persister)
+    assert datastore.dump(b"k")[1] == int(persister.commands[-1][-1]) * 10**6
+    handle_command(bulk_command(b"pexpire", b"k", b"200000"), datastore, persister)
+    assert datastore.dump(b"k")[1] == int(persister.commands[-1][-1]) * 10**6
+    payload = handle_command(bulk_command(b"dump", b"k"), datastore).data
+    handle_command(bulk_command(b"restore", b"copy", b"300000", payload), datastore, persister)
+    logged = persister.commands[-1]
+    assert logged[-2:] == [b"REPLACE", b"ABSTTL"]
+    assert datastore.dump(b"copy")[1] == int(logged[2]) * 10**6
+
+def test_set_rejects_non_positive_expiry():
+    datastore = DataStore()
+    persister = RecordingPersister()
+    for mode, expiry in ((b"ex", b"0"), (b"px", b"-5"), (b"exat", b"0"), (b"pxat", b"-1")):
+        result = handle_command(bulk_command(b"set", b"k", b"v", mode, expiry), datastore, persister)
+        assert result == Error("ERR invalid expire time in 'set' command")
+    assert handle_command(bulk_command(b"set", b"k", b"v", b"ex", b"x"), datastore) == Error(NOT_INTEGER_ERROR)
+    assert b"k" not in datastore
+    assert persister.commands == []
+
+def test_multi_key_commands_across_shards():
+    datastore = DataStore()
+    keys = [b"key:%d" % i for i in range(64)]
+    for key in keys:
+        handle_command(bulk_command(b"set", key, b"v"), datastore)
+    assert len(datastore) == 64
+    assert handle_command(bulk_command(b"exists", *keys, b"missing"), datastore) == Integer(64)
+    assert handle_command(bulk_command(b"del", *keys[:32], b"missing"), datastore) == Integer(32)
+    assert handle_command(bulk_command(b"exists", *keys), datastore) == Integer(32)
+
+def test_concurrent_increments_are_not_lost():
+    datastore = DataStore()
+    keys = [b"counter:%d" % i for i in range(8)]
+
+    def work():
+        for _ in range(200):
+            for key in keys:
+                handle_command(bulk_command(b"incr", key), datastore)
+
+    threads = [Thread(target=work) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert all(datastore[key] == b"800" for key in keys)
+
+def test_mset_mget_batch():
+    datastore = DataStore()
+    persister = RecordingPersister()
+    pairs = [b"page:%d" % i for i in range(200)]
+    command = [arg for key in pairs for arg in (key, key + b":value")]
+    assert handle_command(bulk_command(b"mset", *command), datastore, persister) == SimpleString("OK")
+    assert len(persister.commands) == 1
+    handle_command(bulk_command(b"rpush", b"list", b"x"), datastore)
+    result = handle_command(bulk_command(b"mget", *pairs[:3], b"missing", b"list"), datastore)
+    assert result == bulk_command(b"page:0:value", b"page:1:value", b"page:2:value", None, None)
+    assert handle_command(bulk_command(b"mset", b"k"), datastore) == Error("ERR wrong number of arguments for 'mset' command")
+    assert handle_command(bulk_command(b"mset", b"k", b"v", b"k2"), datastore).data.startswith("ERR wrong number")
+
+def test_msetnx_sets_all_or_nothing():
+    datastore = DataStore()
+    assert handle_command(bulk_command(b"msetnx", b"a", b"1", b"b", b"2"), datastore) == Integer(1)
+    assert handle_command(bulk_command(b"msetnx", b"b", b"3", b"c", b"4"), datastore) == Integer(0)
+    assert handle_command(bulk_command(b"mget", b"a", b"b", b"c"), datastore) == bulk_command(b"1", b"2", None)
+
+def test_getset_setnx_append():
+    datastore = DataStore()
+    persister = RecordingPersister()
+    assert handle_command(bulk_command(b"setnx", b"k", b"a"), datastore) == Integer(1)
+    assert handle_command(bulk_command(b"setnx", b"k", b"b"), datastore) == Integer(0)
+    assert handle_command(bulk_command(b"append", b"k", b"bc"), datastore) == Integer(3)
+    assert handle_command(bulk_command(b"append", b"new", b"xy"), datastore) == Integer(2)
+    handle_command(bulk_command(b"set", b"k", b"abc", b"ex", b"100"), datastore)
+    assert handle_command(bulk_command(b"getset", b"k", b"v"), datastore, persister) == BulkString(b"abc")
+    assert handle_command(bulk_command(b"ttl", b"k"), datastore) == Integer(-1)
+    assert handle_command(bulk_command(b"getset", b"nope", b"v"), datastore) == BulkString(None)
+    assert persister.commands == [[b"SET", b"k", b"v"]]
+    handle_command(bulk_command(b"rpush", b"list", b"x"), datastore)
+    assert handle_command(bulk_command(b"append", b"list", b"x"), datastore) == Error(WRONGTYPE_ERROR)
+    assert handle_command(bulk_command(b"getset", b"list", b"x"), datastore) == Error(WRONGTYPE_ERROR)
+
+def test_hash_commands():
+    datastore = DataStore()
+    assert handle_command(bulk_command(b"hset", b"h", b"name", b"ann", b"age", b"30"), datastore) == Integer(2)
+    assert handle_command(bulk_command(b"hset", b"h", b"name", b"bob"), datastore) == Integer(0)
+    assert handle_command(bulk_command(b"hget", b"h", b"name"), datastore) == BulkString(b"bob")
+    assert handle_command(bulk_command(b"hmget", b"h", b"age", b"nope"), datastore) == bulk_command(b"30", None)
+    assert handle_command(bulk_command(b"hgetall", b"h"), datastore) == bulk_command(b"name", b"bob", b"age", b"30")
+    assert handle_command(bulk_command(b"hincrby", b"h", b"age", b"-5"), datastore) == Integer(25)
+    assert handle_command(bulk_command(b"hincrby", b"h", b"name", b"1"), datastore) == Error("ERR hash value is not an integer")
+    assert handle_command(bulk_command(b"hlen", b"h"), datastore) == Integer(2)
+    assert handle_command(bulk_command(b"hdel", b"h", b"name", b"age", b"nope"), datastore) == Integer(2)
+    assert handle_command(bulk_command(b"exists", b"h"), datastore) == Integer(0)
+    assert handle_command(bulk_command(b"hincrby", b"new", b"n", b"x"), datastore) == Error(NOT_INTEGER_ERROR)
+    assert handle_command(bulk_command(b"hset", b"h", b"odd"), datastore).data.startswith("ERR wrong number")
+    handle_command(bulk_command(b"set", b"s", b"v"), datastore)
+    assert handle_command(bulk_command(b"hget", b"s", b"f"), datastore) == Error(WRONGTYPE_ERROR)
+    handle_command(bulk_command(b"hset", b"h2", b"f", b"v"), datastore)
+    assert handle_command(bulk_command(b"get", b"h2"), datastore) == Error(WRONGTYPE_ERROR)
+
+def test_hincrby_checks_stored_values_and_overflow():
+    datastore = DataStore()
+    max_int = b"9223372036854775807"
+    assert handle_command(bulk_command(b"hincrby", b"h", b"n", max_int), datastore) == Integer(2**63 - 1)
+    assert handle_command(bulk_command(b"hincrby", b"h", b"n", max_int), datastore) == Error(
+        "ERR increment or decrement would overflow"
+    )
+    assert handle_command(bulk_command(b"hincrby", b"h", b"n", b"-1"), datastore) == Integer(2**63 - 2)
+    for stored in (b" 12 ", b"1_000", b"012", b"+5", b"9223372036854775808"):
+        handle_command(bulk_command(b"hset", b"h", b"f", stored), datastore)
+        assert handle_command(bulk_command(b"hincrby", b"h", b"f", b"1"), datastore) == Error(
+            "ERR hash value is not an integer"
+        )
+
+def test_hash_converts_from_compact_encoding():
+    datastore = DataStore()
+    handle_command(bulk_command(b"hset", b"h", b"f", b"v"), datastore)
+    handle_command(bulk_command(b"hset", b"long", b"f", b"x" * 65), datastore)
+    fields = [arg for i in range(129) for arg in (b"f%d" % i, b"%d" % i)]
+    handle_command(bulk_command(b"hset", b"many", *fields), datastore)
+    entries = {key: value for key, value, _ in datastore.snapshot()}
+    assert entries[b"h"].is_compact
+    assert not entries[b"long"].is_compact
+    assert not entries[b"many"].is_compact
+    assert handle_command(bulk_command(b"hget", b"many", b"f128"), datastore) == BulkString(b"128")
+
+def test_hscan_walks_large_hashes():
+    datastore = DataStore()
+    fields = [arg for i in range(300) for arg in (b"f%d" % i, b"%d" % i)]
+    handle_command(bulk_command(b"hset", b"h", *fields), datastore)
+    seen, cursor = {}, b"0"
+    while True:
+        cursor, items = handle_command(bulk_command(b"hscan", b"h", cursor, b"count", b"50"), datastore).data
+        cursor = cursor.data
+        seen.update(zip([i.data for i in items.data[::2]], [i.data for i in items.data[1::2]]))
+        if cursor == b"0":
+            break
+    assert len(seen) == 300
+    result = handle_command(bulk_command(b"hscan", b"h", b"0", b"match", b"f1?", b"count", b"1000"), datastore)
+    assert len(result[1].data) == 20
+    handle_command(bulk_command(b"hset", b"small", b"a", b"1"), datastore)
+    assert handle_command(bulk_command(b"hscan", b"small", b"0"), datastore) == Array([BulkString(b"0"), bulk_command(b"a", b"1")])
+
+def test_hscan_returns_every_remaining_field_when_fields_are_deleted_during_the_scan():
+    datastore = DataStore()
+    fields = [arg for i in range(1000) for arg in (b"f%d" % i, b"v")]
+    handle_command(bulk_command(b"hset", b"h", *fields), datastore)
+    seen, deleted, cursor = set(), set(), b"0"
+    while True:
+        cursor, items = handle_command(bulk_command(b"hscan", b"h", cursor, b"count", b"50"), datastore).data
+        cursor = cursor.data
+        page = [i.data for i in items.data[::2]]
+        seen.update(page)
+        # drop the fields just returned and some that are still to come
+        for field in page[:25] + [b"f%d" % (len(deleted) + i) for i in range(10)]:
+            if handle_command(bulk_command(b"hdel", b"h", field), datastore) == Integer(1):
+                deleted.add(field)
+        if cursor == b"0":
+            break
+    remaining = {b"f%d" % i for i in range(1000)} - deleted
+    assert remaining <= seen
+
+def test_hscan_index_is_counted_as_memory_and_dropped_when_the_scan_ends():
+    datastore = DataStore()
+    fields = [arg for i in range(1000) for arg in (b"f%d" % i, b"v")]
+    handle_command(bulk_command(b"hset", b"h", *fields), datastore)
+    before = datastore.used_memory()
+    cursor, items = handle_command(bulk_command(b"hscan", b"h", b"0", b"count", b"10"), datastore).data
+    assert datastore.used_memory() > before
+    # fields added mid-scan are indexed too, and returned at most once
+    handle_command(bulk_command(b"hdel", b"h", b"f1"), datastore)
+    handle_command(bulk_command(b"hset", b"h", b"f1", b"v", b"new", b"v"), datastore)
+    seen = [i.data for i in items.data[::2]]
+    cursor = cursor.data
+    while cursor != b"0":
+        cursor, items = handle_command(bulk_command(b"hscan", b"h", cursor, b"count", b"100"), datastore).data
+        cursor = cursor.data
+        seen.extend(i.data for i in items.data[::2])
+    assert len(seen) == len(set(seen))
+    assert set(seen) >= {b"f%d" % i for i in range(2, 1000)}
+    handle_command(bulk_command(b"hdel", b"h", b"new"), datastore)
+    assert datastore.used_memory() == before
+
+def test_sorted_set_commands():
+    datastore = DataStore()
+    persister = RecordingPersister()
+    assert handle_command(bulk_command(b"zadd", b"z", b"3", b"c", b"1", b"a", b"2", b"b"), datastore, persister) == Integer(3)
+    assert handle_command(bulk_command(b"zadd", b"z", b"CH", b"1.5", b"a", b"4", b"d"), datastore) == Integer(2)
+    assert handle_command(bulk_command(b"zadd", b"z", b"NX", b"9", b"a"), datastore) == Integer(0)
+    assert handle_command(bulk_command(b"zadd", b"z", b"INCR", b"1", b"a"), datastore) == BulkString(b"2.5")
+    assert handle_command(bulk_command(b"zscore", b"z", b"a"), datastore) == BulkString(b"2.5")
+    assert handle_command(bulk_command(b"zincrby", b"z", b"-2.5", b"a"), datastore) == BulkString(b"0")
+    assert handle_command(bulk_command(b"zcard", b"z"), datastore) == Integer(4)
+    assert handle_command(bulk_command(b"zrank", b"z", b"c"), datastore) == Integer(2)
+    assert handle_command(bulk_command(b"zrank", b"z", b"nope"), datastore) == BulkString(None)
+    assert handle_command(bulk_command(b"zrange", b"z", b"0", b"-1"), datastore) == bulk_command(b"a", b"b", b"c", b"d")
+    assert handle_command(bulk_command(b"zrange", b"z", b"-2", b"-1", b"withscores"), datastore) == bulk_command(b"c", b"3", b"d", b"4")
+    assert handle_command(bulk_command(b"zrangebyscore", b"z", b"(0", b"+inf"), datastore) == bulk_command(b"b", b"c", b"d")
+    assert handle_command(bulk_command(b"zrangebyscore", b"z", b"-inf", b"(4", b"LIMIT", b"1", b"1"), datastore) == bulk_command(b"b")
+    assert handle_command(bulk_command(b"zrangebyscore", b"z", b"x", b"1"), datastore) == Error("ERR min or max is not a float")
+    assert handle_command(bulk_command(b"zadd", b"z", b"nan", b"a"), datastore) == Error("ERR value is not a valid float")
+    assert handle_command(bulk_command(b"zrem", b"z", b"a", b"b", b"c", b"d", b"e"), datastore) == Integer(4)
+    assert handle_command(bulk_command(b"exists", b"z"), datastore) == Integer(0)
+    handle_command(bulk_command(b"set", b"s", b"v"), datastore)
+    assert handle_command(bulk_command(b"zadd", b"s", b"1", b"a"), datastore) == Error(WRONGTYPE_ERROR)
+    assert persister.commands == [[b"zadd", b"z", b"3", b"c", b"1", b"a", b"2", b"b"]]
+
+def test_set_commands():
+    datastore = DataStore()
+    assert handle_command(bulk_command(b"sadd", b"a", b"3", b"1", b"2", b"1"), datastore) == Integer(3)
+    assert handle_command(bulk_command(b"sadd", b"b", b"2", b"3", b"4", b"x"), datastore) == Integer(4)
+    assert handle_command(bulk_command(b"sismember", b"a", b"2"), datastore) == Integer(1)
+    assert handle_command(bulk_command(b"sismember", b"a", b"02"), datastore) == Integer(0)
+    assert handle_command(bulk_command(b"smembers", b"a"), datastore) == bulk_command(b"1", b"2", b"3")
+    assert handle_command(bulk_command(b"scard", b"b"), datastore) == Integer(4)
+    assert sorted(m.data for m in handle_command(bulk_command(b"sinter", b"a", b"b"), datastore)) == [b"2", b"3"]
+    assert handle_command(bulk_command(b"sinter", b"a", b"missing"), datastore) == Array([])
+    assert len(handle_command(bulk_command(b"sunion", b"a", b"b"), datastore)) == 5
+    assert handle_command(bulk_command(b"sdiff", b"a", b"b"), datastore) == bulk_command(b"1")
+    assert handle_command(bulk_command(b"sinterstore", b"c", b"a", b"b"), datastore) == Integer(2)
+    assert handle_command(bulk_command(b"scard", b"c"), datastore) == Integer(2)
+    assert handle_command(bulk_command(b"srem", b"c", b"2", b"3", b"9"), datastore) == Integer(2)
+    assert handle_command(bulk_command(b"exists", b"c"), datastore) == Integer(0)
+    handle_command(bulk_command(b"set", b"s", b"v"), datastore)
+    assert handle_command(bulk_command(b"sinter", b"a", b"s"), datastore) == Error(WRONGTYPE_ERROR)
+    assert handle_command(bulk_command(b"sadd", b"s", b"1"), datastore) == Error(WRONGTYPE_ERROR)
+
+def test_set_promotes_from_intset():
+    datastore = DataStore()
+    handle_command(bulk_command(b"sadd", b"ids", *[b"%d" % i for i in range(512)]), datastore)
+    handle_command(bulk_command(b"sadd", b"tags", b"1", b"red"), datastore)
+    entries = {key: value for key, value, _ in datastore.snapshot()}
+    assert entries[b"ids"].is_intset and not entries[b"tags"].is_intset
+    handle_command(bulk_command(b"sadd", b"ids", b"-9223372036854775808"), datastore)
+    entries = {key: value for key, value, _ in datastore.snapshot()}
+    assert not entries[b"ids"].is_intset
+    assert handle_command(bulk_command(b"sismember", b"ids", b"511"), datastore) == Integer(1)
+    assert handle_command(bulk_command(b"scard", b"ids"), datastore) == Integer(513)
+
+def test_integer_encoded_strings():
+    datastore = DataStore()
+    handle_command(bulk_command(b"set", b"n", b"41"), datastore)
+    handle_command(bulk_command(b"set", b"padded", b"041"), datastore)
+    handle_command(bulk_command(b"set", b"long", b"x" * 45), datastore)
+    assert handle_command(bulk_command(b"object", b"encoding", b"n"), datastore) == BulkString(b"int")
+    assert handle_command(bulk_command(b"object", b"encoding", b"padded"), datastore) == BulkString(b"embstr")
+    assert handle_command(bulk_command(b"object", b"encoding", b"long"), datastore) == BulkString(b"raw")
+    assert handle_command(bulk_command(b"object", b"encoding", b"nope"), datastore) == BulkString(None)
+    assert handle_command(bulk_command(b"incr", b"n"), datastore) == Integer(42)
+    assert handle_command(bulk_command(b"get", b"n"), datastore) == BulkString(b"42")
+    assert handle_command(bulk_command(b"incrby", b"n", b"-50"), datastore) == Integer(-8)
+    assert handle_command(bulk_command(b"decrby", b"n", b"2"), datastore) == Integer(-10)
+    assert handle_command(bulk_command(b"mget", b"n", b"padded"), datastore) == bulk_command(b"-10", b"041")
+    assert handle_command(bulk_command(b"append", b"n", b"5"), datastore) == Integer(4)
+    assert handle_command(bulk_command(b"get", b"n"), datastore) == BulkString(b"-105")
+    assert handle_command(bulk_command(b"incr", b"padded"), datastore) == Error(NOT_INTEGER_ERROR)
+    handle_command(bulk_command(b"set", b"max", b"9223372036854775807"), datastore)
+    assert handle_command(bulk_command(b"incr", b"max"), datastore) == Error("ERR increment or decrement would overflow")
+    handle_command(bulk_command(b"rpush", b"list", b"x"), datastore)
+    assert handle_command(bulk_command(b"incr", b"list"), datastore) == Error(WRONGTYPE_ERROR)
+    assert handle_command(bulk_command(b"object", b"encoding", b"list"), datastore) == BulkString(b"quicklist")
+
+def test_append_then_incr():
+    datastore = DataStore()
+    handle_command(bulk_command(b"set", b"k", b"1"), datastore)
+    assert handle_command(bulk_command(b"append", b"k", b"0"), datastore) == Integer(2)
+    assert handle_command(bulk_command(b"incr", b"k"), datastore) == Integer(11)
+    handle_command(bulk_command(b"append", b"new", b"7"), datastore)
+    assert handle_command(bulk_command(b"incr", b"new"), datastore) == Integer(8)
+
+def test_incr_keeps_ttl_and_set_clears_it():
+    datastore = DataStore()
+    handle_command(bulk_command(b"set", b"n", b"1", b"ex", b"100"), datastore)
+    handle_command(bulk_command(b"incr", b"n"), datastore)
+    assert handle_command(bulk_command(b"ttl", b"n"), datastore) == Integer(100)
+    handle_command(bulk_command(b"set", b"n", b"1"), datastore)
+    assert handle_command(bulk_command(b"ttl", b"n"), datastore) == Integer(-1)
+    assert all(not shard.expires for shard in datastore._shards)
+
+def _info(datastore, *sections, persister=None):
+    reply = handle_command(bulk_command(b"info", *sections), datastore, persister)
+    fields = {}
+    for line in reply.data.decode().split("\r\n"):
+        if line and not line.startswith("#"):
+            field, value = line.split(":", 1)
+            fields[field] = value
+    return reply.data.decode(), fields
+
+def test_info_sections():
+    datastore = DataStore()
+    handle_command(bulk_command(b"set", b"a", b"1"), datastore)
+    handle_command(bulk_command(b"set", b"b", b"2", b"ex", b"100"), datastore)
+    text, fields = _info(datastore)
+    assert [line for line in text.split("\r\n") if line.startswith("#")] == [
+        "# Server", "# Clients", "# Memory", "# Persistence", "# Stats", "# Replication", "# Keyspace",
+    ]
+    assert fields["db0"] == "keys=2,expires=1"
+    assert fields["aof_enabled"] == "0"
+    assert int(fields["used_memory"]) == datastore.used_memory() > 0
+    assert fields["maxmemory_policy"] == "noeviction"
+    text, fields = _info(datastore, b"KEYSPACE", b"memory")
+    assert text.startswith("# Keyspace\r\n") and "# Memory" in text and "# Server" not in text
+    text, _ = _info(datastore, b"all")
+    assert "# Commandstats" in text
+
+def test_info_commandstats_counts_calls():
+    datastore = DataStore()
+    _, before = _info(datastore, b"commandstats")
+    handle_command(bulk_command(b"set", b"k", b"v"), datastore)
+    handle_command(bulk_command(b"incr", b"k"), datastore)
+    handle_command(bulk_command(b"incr"), datastore)
+    _, after = _info(datastore, b"commandstats")
+    def counters(fields, name):
+        stats = fields.get(f"cmdstat_{name}", "calls=0,rejected_calls=0,failed_calls=0")
+        return {k: v for k, v in (item.split("=") for item in stats.split(","))}
+    assert int(counters(after, "set")["calls"]) == int(counters(before, "set")["calls"]) + 1
+    incr_before, incr_after = counters(before, "incr"), counters(after, "incr")
+    assert int(incr_after["calls"]) == int(incr_before["calls"]) + 1
+    assert int(incr_after["failed_calls"]) == int(incr_before["failed_calls"]) + 1
+    assert int(incr_after["rejected_calls"]) == int(incr_before["rejected_calls"]) + 1
+    assert "usec_per_call" in incr_after
+
+@pytest.fixture
+def slow_log():
+    from src.stats import SLOW_LOG, SLOWLOG_LOG_SLOWER_THAN, SLOWLOG_MAX_LEN
+    SLOW_LOG.configure(0, 3)
+    SLOW_LOG.reset()
+    yield SLOW_LOG
+    SLOW_LOG.configure(SLOWLOG_LOG_SLOWER_THAN, SLOWLOG_MAX_LEN)
+    SLOW_LOG.reset()
+
+def test_slowlog_keeps_newest_entries(slow_log):
+    from src.server import Client
+    datastore = DataStore()
+    client = Client(("127.0.0.1", 50000))
+    for i in range(5):
+        handle_command(bulk_command(b"set", b"key:%d" % i, b"v" * 200), datastore, None, client)
+    assert handle_command(bulk_command(b"slowlog", b"len"), datastore) == Integer(3)
+    entries = handle_command(bulk_command(b"slowlog", b"get", b"2"), datastore)
+    assert len(entries) == 2
+    newest = entries[0]
+    assert newest[0].value > entries[1][0].value
+    assert newest[3][:2] == [BulkString(b"slowlog"), BulkString(b"len")]
+    entry = entries[1]
+    assert entry[3][1] == BulkString(b"key:4")
+    assert entry[3][2] == BulkString(b"v" * 128 + b"... (72 more bytes)")
+    assert entry[4] == BulkString(b"127.0.0.1:50000")
+    slow_log.configure(-1, 3)
+    assert handle_command(bulk_command(b"slowlog", b"reset"), datastore) == SimpleString("OK")
+    handle_command(bulk_command(b"get", b"key:0"), datastore)
+    assert handle_command(bulk_command(b"slowlog", b"len"), datastore) == Integer(0)
+
+def test_latency_histogram():
+    datastore = DataStore()
+    for _ in range(3):
+        handle_command(bulk_command(b"echo", b"hi"), datastore)
+    reply = handle_command(bulk_command(b"latency", b"histogram", b"echo", b"nosuchcommand"), datastore)
+    assert reply[0] == BulkString(b"echo")
+    calls, histogram = reply[1][1].value, reply[1][3]
+    assert calls >= 3
+    buckets = [item.value for item in histogram[::2]]
+    counts = [item.value for item in histogram[1::2]]
+    assert buckets == sorted(buckets) and all(b & (b - 1) == 0 for b in buckets)
+    assert counts == sorted(counts) and counts[-1] == calls
+    assert len(reply) == 2
+
+def test_debug_profile_writes_stats(tmp_path, monkeypatch):
+    import pstats
+    from src.protocol_handler import RespParser, encode_message
+    from src.server import execute_buffered_commands
+    monkeypatch.chdir(tmp_path)
+    datastore = DataStore()
+    filename = b"run.prof"
+    assert handle_command(bulk_command(b"debug", b"profile", b"stop"), datastore) == Error("ERR profiler not running")
+    assert handle_command(bulk_command(b"debug", b"profile", b"start"), datastore) == SimpleString("OK")
+    parser = RespParser()
+    parser.feed(encode_message(bulk_command(b"set", b"k", b"v")) * 10)
+    execute_buffered_commands(parser, datastore, None)
+    reply = handle_command(bulk_command(b"debug", b"profile", b"stop", filename), datastore)
+    assert reply.data.endswith(filename.decode())
+    functions = {name for _, _, name in pstats.Stats(filename.decode()).stats}
+    assert "_handle_set" in functions
+
+def test_debug_profile_only_writes_prof_files_in_the_working_directory(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    datastore = DataStore()
+    assert handle_command(bulk_command(b"debug", b"profile", b"start"), datastore) == SimpleString("OK")
+    try:
+        for filename in (str(tmp_path / "run.prof").encode(), b"../run.prof", b"ccdb.aof", b".prof"):
+            reply = handle_command(bulk_command(b"debug", b"profile", b"stop", filename), datastore)
+            assert reply == Error("ERR profile file must be a file name ending in .prof")
+    finally:
+        assert handle_command(bulk_command(b"debug", b"profile", b"stop"), datastore).data.startswith("Profile")
+    assert sorted(os.listdir(tmp_path)) == ["pyredis.prof"]
@@ -0,0 +1,121 @@
+import threading
+import pytest
+from src.command_handler import OOM_ERROR, handle_command
+from src.datastore import DataStore
+from src.persistence import AppendOnlyPersister, restore_db
+from src.eviction import parse_memory
+from src.types import BulkString, Error, SimpleString
+from tests.helpers import RecordingPersister, bulk_command
+
+
+@pytest.mark.parametrize(
+    "size, expected",
+    [("0", 0), ("1024", 1024), ("100mb", 100 * 1024**2), ("2GB", 2 * 1024**3), ("5k", 5000)],
+)
+def test_parse_memory(size, expected):
+    assert parse_memory(size) == expected
+
+
+def test_used_memory_tracks_writes_and_deletes():
+    datastore = DataStore()
+    assert datastore.used_memory() == 0
+    handle_command(bulk_command(b"set", b"k", b"v" * 1000), datastore)
+    handle_command(bulk_command(b"rpush", b"list", b"a", b"b"), datastore)
+    handle_command(bulk_command(b"hset", b"h", b"f", b"v"), datastore)
+    assert datastore.used_memory() > 1000
+    handle_command(bulk_command(b"set", b"k", b"v"), datastore)
+    handle_command(bulk_command(b"del", b"k", b"list", b"h"), datastore)
+    assert datastore.used_memory() == 0
+
+
+def test_noeviction_rejects_writes_over_the_limit():
+    datastore = DataStore()
+    datastore.set_maxmemory(2000, "noeviction")
+    for i in range(10):
+        handle_command(bulk_command(b"set", b"key:%d" % i, b"v" * 200), datastore)
+    assert handle_command(bulk_command(b"set", b"more", b"v"), datastore) == Error(OOM_ERROR)
+    assert handle_command(bulk_command(b"get", b"key:0"), datastore) == BulkString(b"v" * 200)
+    assert handle_command(bulk_command(b"del", b"key:0", b"key:1"), datastore).value == 2
+
+
+def test_allkeys_lru_evicts_idle_keys():
+    datastore = DataStore()
+    datastore.set_maxmemory(100 * 1024, "allkeys-lru")
+    datastore.update_clock(0)
+    hot = [b"hot:%d" % i for i in range(50)]
+    for key in hot:
+        handle_command(bulk_command(b"set", key, b"v" * 100), datastore)
+    datastore.update_clock(100 * 10**9)
+    persister = RecordingPersister()
+    for i in range(2000):
+        handle_command(bulk_command(b"set", b"cold:%d" % i, b"v" * 100), datastore, persister)
+        for key in hot[i % 5::50]:
+            handle_command(bulk_command(b"get", key), datastore)
+        if i % 100 == 0:
+            datastore.update_clock((200 + i) * 10**9)
+            for key in hot:
+                handle_command(bulk_command(b"get", key), datastore)
+    # the limit is checked before each write, so it can be passed by one key
+    assert datastore.used_memory() <= 100 * 1024 + 300
+    assert sum(key in datastore for key in hot) >= 45
+    evicted = [key for command in persister.commands if command[0] == b"DEL" for key in command[1:]]
+    assert evicted and all(key not in datastore for key in evicted)
+
+
+def test_allkeys_lfu_keeps_frequently_used_keys():
+    datastore = DataStore()
+    datastore.set_maxmemory(50 * 1024, "allkeys-lfu")
+    hot = [b"hot:%d" % i for i in range(20)]
+    for key in hot:
+        handle_command(bulk_command(b"set", key, b"v"), datastore)
+        for _ in range(100):
+            handle_command(bulk_command(b"get", key), datastore)
+    for i in range(2000):
+        assert handle_command(bulk_command(b"set", b"cold:%d" % i, b"v" * 100), datastore) == SimpleString("OK")
+    assert datastore.used_memory() <= 50 * 1024 + 300
+    assert sum(key in datastore for key in hot) >= 18
+
+
+def test_volatile_ttl_evicts_soonest_expiring_and_then_refuses():
+    datastore = DataStore()
+    datastore.set_maxmemory(4000, "volatile-ttl")
+    handle_command(bulk_command(b"set", b"persistent", b"v" * 1000), datastore)
+    for i in range(10):
+        handle_command(bulk_command(b"set", b"ttl:%d" % i, b"v" * 100, b"ex", b"%d" % (100 + i)), datastore)
+    handle_command(bulk_command(b"set", b"big", b"v" * 1000), datastore)
+    assert datastore.used_memory() > 4000
+    handle_command(bulk_command(b"set", b"small", b"v"), datastore)
+    assert b"ttl:0" not in datastore
+    assert b"ttl:9" in datastore and b"persistent" in datastore
+    result = handle_command(bulk_command(b"set", b"huge", b"v" * 10000), datastore)
+    assert result == SimpleString("OK")
+    assert handle_command(bulk_command(b"set", b"more", b"v"), datastore) == Error(OOM_ERROR)
+    assert b"persistent" in datastore
+
+
+def test_aof_replay_matches_memory_when_an_evicted_key_is_rewritten_at_once(tmp_path, monkeypatch):
+    filename = tmp_path / "evict.aof"
+    datastore = DataStore()
+    persister = AppendOnlyPersister(filename, "no")
+    handle_command(bulk_command(b"set", b"victim", b"v" * 600), datastore, persister)
+    datastore.set_maxmemory(512, "allkeys-lru")
+    evict_sampled = DataStore._evict_sampled
+
+    def evict_then_rewrite(self, *args):
+        # another connection writes the victim right after it was evicted
+        key = evict_sampled(self, *args)
+        writer = threading.Thread(
+            target=handle_command, args=(bulk_command(b"set", key, b"new"), datastore, persister)
+        )
+        writer.start()
+        writer.join(5)
+        return key
+
+    monkeypatch.setattr(DataStore, "_evict_sampled", evict_then_rewrite)
+    handle_command(bulk_command(b"set", b"other", b"o" * 600), datastore, persister)
+    persister.close()
+
+    assert datastore[b"victim"] == b"new"
+    restored = DataStore()
+    assert restore_db(filename, restored)
+    assert sorted(restored.snapshot()) == sorted(datastore.snapshot())
@@ -0,0 +1,182 @@
+from threading import Barrier, Event, Thread
+import pytest
+from src.command_handler import handle_command
+from src.datastore import DataStore
+from src.persistence import AppendOnlyPersister, CommandLock, restore_db
+from tests.helpers import bulk_command
+
+
+@pytest.mark.parametrize("appendfsync", ["always", "everysec", "no"])
+def test_logged_commands_are_restored(tmp_path, appendfsync):
+    filename = tmp_path / "test.aof"
+    datastore = DataStore()
+    persister = AppendOnlyPersister(filename, appendfsync)
+    handle_command(bulk_command(b"set", b"k", b"\x00binary\r\n"), datastore, persister)
+    handle_command(bulk_command(b"incr", b"counter"), datastore, persister)
+    handle_command(bulk_command(b"incr", b"counter"), datastore, persister)
+    handle_command(bulk_command(b"rpush", b"list", b"a", b"b"), datastore, persister)
+    persister.close()
+
+    restored = DataStore()
+    assert restore_db(filename, restored)
+    assert restored[b"k"] == b"\x00binary\r\n"
+    assert restored[b"counter"] == b"2"
+    assert restored.lrange(b"list", 0, 2) == [b"a", b"b"]
+
+
+def test_always_policy_writes_before_returning(tmp_path):
+    filename = tmp_path / "test.aof"
+    persister = AppendOnlyPersister(filename, "always")
+    handle_command(bulk_command(b"set", b"k", b"v"), DataStore(), persister)
+    assert filename.read_bytes() == b"*3\r\n$3\r\nset\r\n$1\r\nk\r\n$1\r\nv\r\n"
+    persister.close()
+
+
+def test_everysec_policy_buffers_writes(tmp_path):
+    filename = tmp_path / "test.aof"
+    persister = AppendOnlyPersister(filename, "everysec")
+    persister._stopped.set()
+    persister._flusher.join()
+    handle_command(bulk_command(b"set", b"k", b"v"), DataStore(), persister)
+    assert filename.read_bytes() == b""
+    persister.flush()
+    assert filename.read_bytes() == b"*3\r\n$3\r\nset\r\n$1\r\nk\r\n$1\r\nv\r\n"
+    persister.close()
+
+
+def test_invalid_policy_is_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        AppendOnlyPersister(tmp_path / "test.aof", "sometimes")
+
+
+def test_bgrewriteaof_compacts_history(tmp_path):
+    filename = tmp_path / "test.aof"
+    datastore = DataStore()
+    persister = AppendOnlyPersister(filename, "always", datastore)
+    for _ in range(100):
+        handle_command(bulk_command(b"incr", b"counter"), datastore, persister)
+    handle_command(bulk_command(b"rpush", b"list", *[b"%d" % i for i in range(100)]), datastore, persister)
+    handle_command(bulk_command(b"set", b"session", b"s", b"ex", b"100"), datastore, persister)
+    handle_command(bulk_command(b"set", b"gone", b"x"), datastore, persister)
+    handle_command(bulk_command(b"del", b"gone"), datastore, persister)
+    size_before = filename.stat().st_size
+
+    result = handle_command(bulk_command(b"bgrewriteaof"), datastore, persister)
+    assert result.data == "Background append only file rewriting started"
+    # written while the rewrite may still be running
+    handle_command(bulk_command(b"incr", b"counter"), datastore, persister)
+    persister._rewrite_thread.join()
+    handle_command(bulk_command(b"set", b"after", b"rewrite"), datastore, persister)
+    persister.close()
+
+    assert filename.stat().st_size < size_before
+    restored = DataStore()
+    assert restore_db(filename, restored)
+    assert restored[b"counter"] == b"101"
+    assert restored.lrange(b"list", 0, 100) == [b"%d" % i for i in range(100)]
+    assert restored[b"after"] == b"rewrite"
+    assert b"gone" not in restored
+    assert 99 * 10**9 < restored.ttl(b"session") <= 100 * 10**9
+
+
+def test_restore_refuses_torn_final_command(tmp_path):
+    filename = tmp_path / "test.aof"
+    complete = b"*3\r\n$3\r\nSET\r\n$1\r\nk\r\n$1\r\nv\r\n"
+    filename.write_bytes(complete + b"*3\r\n$3\r\nSET\r\n$1\r\nx")
+    assert not restore_db(filename, DataStore())
+    assert filename.read_bytes().startswith(complete)
+
+    datastore = DataStore()
+    assert restore_db(filename, datastore, load_truncated=True)
+    assert datastore[b"k"] == b"v"
+    assert b"x" not in datastore
+    assert filename.read_bytes() == complete
+
+
+def test_restore_replays_through_handlers_for_other_commands(tmp_path):
+    filename = tmp_path / "test.aof"
+    filename.write_bytes(
+        b"*3\r\n$3\r\nSET\r\n$1\r\nk\r\n$1\r\nv\r\n"
+        b"*3\r\n$6\r\nEXPIRE\r\n$1\r\nk\r\n$3\r\n100\r\n"
+        b"*2\r\n$7\r\nPERSIST\r\n$1\r\nk\r\n"
+        b"*3\r\n$3\r\nDEL\r\n$1\r\nk\r\n$7\r\nmissing\r\n"
+        b"*3\r\n$5\r\nLPUSH\r\n$1\r\nl\r\n$1\r\na\r\n"
+    )
+    datastore = DataStore()
+    assert restore_db(filename, datastore)
+    assert b"k" not in datastore
+    assert datastore.lrange(b"l", 0, 1) == [b"a"]
+
+
+def test_restore_rejects_failing_command(tmp_path):
+    filename = tmp_path / "test.aof"
+    filename.write_bytes(
+        b"*3\r\n$3\r\nSET\r\n$1\r\nk\r\n$1\r\nv\r\n"
+        b"*3\r\n$5\r\nLPUSH\r\n$1\r\nk\r\n$1\r\na\r\n"
+    )
+    assert not restore_db(filename, DataStore())
+
+
+def test_info_reports_aof_state(tmp_path):
+    datastore = DataStore()
+    persister = AppendOnlyPersister(tmp_path / "test.aof", "always", datastore)
+    handle_command(bulk_command(b"set", b"k", b"v"), datastore, persister)
+    reply = handle_command(bulk_command(b"info", b"persistence"), datastore, persister)
+    lines = reply.data.decode().split("\r\n")
+    assert "aof_enabled:1" in lines
+    assert "aof_current_size:27" in lines
+    assert "appendfsync:always" in lines
+    assert any(line.startswith("aof_last_write_time:") and line != "aof_last_write_time:0" for line in lines)
+    persister.close()
+
+
+def test_command_lock_only_serialises_writes_to_the_same_stripe(tmp_path):
+    datastore = DataStore()
+    persister = AppendOnlyPersister(tmp_path / "test.aof", "no")
+    lock = persister.command_lock
+    other = next(b"k%d" % i for i in range(100) if lock.stripes([b"k%d" % i]) != lock.stripes([b"a"]))
+    stripe, = lock.stripes([b"a"])
+    assert len(lock.stripes([b"a", other, b"a"])) == 2
+
+    with stripe:
+        # a write to another stripe goes ahead while this one is held
+        handle_command(bulk_command(b"set", other, b"1"), datastore, persister)
+        blocked = Thread(target=handle_command, args=(bulk_command(b"set", b"a", b"1"), datastore, persister))
+        blocked.start()
+        blocked.join(timeout=0.2)
+        assert blocked.is_alive()
+    blocked.join(timeout=5)
+    assert datastore[b"a"] == b"1"
+    persister.close()
+
+
+def test_entering_command_lock_holds_every_stripe():
+    lock = CommandLock(4)
+    with lock:
+        assert all(stripe.locked() for stripe in lock.stripes([]))
+    assert not any(stripe.locked() for stripe in lock.stripes([]))
+
+
+def test_concurrent_background_starts_run_one_rewrite_and_one_save(tmp_path):
+    datastore = DataStore()
+    persister = AppendOnlyPersister(tmp_path / "test.aof", "no", datastore, tmp_path / "dump.rdb")
+    finish = Event()
+    persister._rewrite = lambda entries: finish.wait(5)
+    persister._save = lambda entries: finish.wait(5)
+    barrier = Barrier(8)
+    started = []
+
+    def start(method):
+        barrier.wait()
+        started.append(method(datastore))
+
+    methods = [persister.rewrite_in_background, persister.save_in_background] * 4
+    threads = [Thread(target=start, args=(method,)) for method in methods]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(started) == [False] * 6 + [True] * 2
+    assert not persister.save(datastore)
+    finish.set()
+    persister.close()
@@ -1,5 +1,12 @@
 import pytest
-from src.protocol_handler import SimpleString, extract_frame_from_buffer, encode_message
+from src.protocol_handler import (
+    ProtocolError,
+    RespParser,
+    SimpleString,
+    extract_frame_from_buffer,
+    encode_message,
+    is_command,
+)
 from src.types import (
     Array,
     BulkString,
@@ -61,14 +68,87 @@ def test_read_simple_string(buffer, expected):
     actual = extract_frame_from_buffer(buffer)
     assert actual == expected
     
+@pytest.mark.parametrize(
+    "buffer, expected, pending",
+    [
+        (b"+Par", None, 4),
+        (b"+OK\r\n", SimpleString("OK"), 0),
+        (b"+OK\r\n+Next", SimpleString("OK"), 5),
+        (b"-Error Message\r\n", Error("Error Message"), 0),
+        (b":100\r\n+OK", Integer(100), 3),
+        (b"$5\r\nHel", None, 3),
+        (b"$12\r\nHello\r\nWorld\r\n", BulkString(b"Hello\r\nWorld"), 0),
+        (b"$0\r\n\r\n", BulkString(b""), 0),
+        (b"$-1\r\n", BulkString(None), 0),
+        (b"*0\r\n", Array([]), 0),
+        (b"*-1\r\n", Array(None), 0),
+        (b"*2\r\n$5\r\nhello\r\n$5\r\n", None, 0),
+        (
+            b"*2\r\n$5\r\nhello\r\n$5\r\nworld\r\n+OK",
+            Array([BulkString(b"hello"), BulkString(b"world")]),
+            3,
+        ),
+        (
+            b"*2\r\n*2\r\n:1\r\n:2\r\n$1\r\na\r\n",
+            Array([Array([Integer(1), Integer(2)]), BulkString(b"a")]),
+            0,
+        ),
+    ],
+)
+
+def test_resp_parser(buffer, expected, pending):
+    parser = RespParser()
+    parser.feed(buffer)
+    assert parser.get_frame() == expected
+    assert parser.pending() == pending
+
+def test_resp_parser_resumes_partial_frames():
+    message = b"*3\r\n$3\r\nSET\r\n$3\r\nkey\r\n$10\r\n0123456789\r\n:7\r\n"
+    parser = RespParser()
+    frames = []
+    for i in range(len(message)):
+        parser.feed(message[i:i + 1])
+        frame = parser.get_frame()
+        if frame is not None:
+            frames.append(frame)
+    assert frames == [
+        Array([BulkString(b"SET"), BulkString(b"key"), BulkString(b"0123456789")]),
+        Integer(7),
+    ]
+    assert isinstance(frames[0][2].data, bytes)
+
+def test_resp_parser_rejects_unknown_type():
+    parser = RespParser()
+    parser.feed(b"PING\r\n")
+    with pytest.raises(ProtocolError):
+        parser.get_frame()
+
+@pytest.mark.parametrize(
+    "buffer, expected",
+    [
+        (b"*2\r\n$3\r\nGET\r\n$1\r\nk\r\n", True),
+        (b"*1\r\n:5\r\n", False),
+        (b"*1\r\n$-1\r\n", False),
+        (b"*2\r\n$3\r\nGET\r\n*1\r\n$1\r\nk\r\n", False),
+        (b"*1\r\n+PING\r\n", False),
+        (b"*0\r\n", False),
+        (b"$4\r\nPING\r\n", False),
+    ],
+)
+def test_is_command(buffer, expected):
+    parser = RespParser()
+    parser.feed(buffer)
+    assert is_command(parser.get_frame()) is expected
+
 @pytest.mark.parametrize(
     "message, expected",
     [
         (SimpleString("OK"), b"+OK\r\n"),
         (Error("Error"), b"-Error\r\n"),
         (Integer(100), b":100\r\n"),
-        (BulkString("This is a Bulk String"), b"$21\r\nThis is a Bulk String\r\n"),
-        (BulkString(""), b"$0\r\n\r\n"),
+        (BulkString(b"This is a Bulk String"), b"$21\r\nThis is a Bulk String\r\n"),
+        (BulkString(b""), b"$0\r\n\r\n"),
+        (BulkString(b"\x00\xff"), b"$2\r\n\x00\xff\r\n"),
         (BulkString(None), b"$-1\r\n"),
         (Array([]), b"*0\r\n"),
         (Array(None), b"*-1\r\n"),
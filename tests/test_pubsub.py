@@ -0,0 +1,213 @@
+import socket
+import threading
+import time
+import pytest
+from src import client as redis_client
+from src import server as server_module
+from src.command_handler import handle_command
+from src.datastore import DataStore
+from src.pubsub import PUBSUB, PubSub
+from src.server import AsyncServer, Server
+from src.types import Array, BulkString, Error, Integer, Replies
+from tests.helpers import bulk_command, free_port, wait_for
+
+
+class FakeClient:
+    def __init__(self):
+        self.address = None
+        self.channels = set()
+        self.patterns = set()
+        self.received = []
+
+    def hold_messages(self):
+        pass
+
+    def deliver(self, data):
+        self.received.append(data)
+
+
+def test_registry_encodes_each_message_once():
+    pubsub = PubSub()
+    first, second, by_pattern = FakeClient(), FakeClient(), FakeClient()
+    assert pubsub.subscribe(first, b"news") == 1
+    assert pubsub.subscribe(first, b"news") == 1
+    assert pubsub.subscribe(second, b"news") == 1
+    assert pubsub.psubscribe(by_pattern, b"n*") == 1
+    assert pubsub.publish(b"news", b"hello") == 3
+    assert first.received == [b"*3\r\n$7\r\nmessage\r\n$4\r\nnews\r\n$5\r\nhello\r\n"]
+    # every subscriber is handed the very same bytes object
+    assert first.received[0] is second.received[0]
+    assert by_pattern.received == [b"*4\r\n$8\r\npmessage\r\n$2\r\nn*\r\n$4\r\nnews\r\n$5\r\nhello\r\n"]
+    assert pubsub.publish(b"other", b"x") == 0
+
+    assert pubsub.channels() == [b"news"]
+    assert pubsub.numsub(b"news") == 2
+    pubsub.remove(first)
+    assert pubsub.numsub(b"news") == 1 and not first.channels
+    assert pubsub.unsubscribe(second, b"news") == 0
+    assert pubsub.channels() == [] and pubsub.numpat() == 1
+
+
+def test_subscription_commands():
+    datastore, client = DataStore(), FakeClient()
+    try:
+        assert handle_command(bulk_command(b"SUBSCRIBE", b"a", b"b"), datastore, None, client) == Replies([
+            Array([BulkString(b"subscribe"), BulkString(b"a"), Integer(1)]),
+            Array([BulkString(b"subscribe"), BulkString(b"b"), Integer(2)]),
+        ])
+        handle_command(bulk_command(b"PSUBSCRIBE", b"a*"), datastore, None, client)
+        assert handle_command(bulk_command(b"PUBLISH", b"a", b"m"), datastore) == Integer(2)
+        assert handle_command(bulk_command(b"PUBSUB", b"NUMSUB", b"a", b"c"), datastore) == Array(
+            [BulkString(b"a"), Integer(1), BulkString(b"c"), Integer(0)]
+        )
+        assert handle_command(bulk_command(b"PUBSUB", b"CHANNELS", b"b*"), datastore) == Array([BulkString(b"b")])
+        assert handle_command(bulk_command(b"PUBSUB", b"NUMPAT"), datastore) == Integer(1)
+        assert handle_command(bulk_command(b"UNSUBSCRIBE"), datastore, None, client) == Replies([
+            Array([BulkString(b"unsubscribe"), BulkString(b"a"), Integer(2)]),
+            Array([BulkString(b"unsubscribe"), BulkString(b"b"), Integer(1)]),
+        ])
+        assert handle_command(bulk_command(b"PUNSUBSCRIBE"), datastore, None, client) == Replies([
+            Array([BulkString(b"punsubscribe"), BulkString(b"a*"), Integer(0)]),
+        ])
+        assert handle_command(bulk_command(b"UNSUBSCRIBE"), datastore, None, client) == Replies([
+            Array([BulkString(b"unsubscribe"), BulkString(None), Integer(0)]),
+        ])
+        assert isinstance(handle_command(bulk_command(b"SUBSCRIBE", b"a"), datastore), Error)
+    finally:
+        PUBSUB.remove(client)
+
+
+@pytest.fixture(params=["threaded", "asyncio"])
+def server_port(request):
+    port = free_port()
+    server_class = AsyncServer if request.param == "asyncio" else Server
+    server = server_class(port, DataStore(), None)
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    client = redis_client.Client("localhost", port)
+    wait_for(lambda: _ping(client))
+    yield port
+    client.close()
+    server.stop()
+
+
+def _ping(client):
+    try:
+        return client.execute("PING") == "PONG"
+    except ConnectionRefusedError:
+        return False
+
+
+def test_publish_reaches_every_subscriber(server_port):
+    client = redis_client.Client("localhost", server_port)
+    subscriptions = [client.subscription() for _ in range(100)]
+    try:
+        for subscription in subscriptions:
+            subscription.subscribe("events")
+        for subscription in subscriptions:
+            assert subscription.get_message(timeout=5) == [b"subscribe", b"events", 1]
+        patterned = client.subscription()
+        subscriptions.append(patterned)
+        patterned.psubscribe("ev*")
+        assert patterned.get_message(timeout=5) == [b"psubscribe", b"ev*", 1]
+
+        assert client.execute("PUBLISH", "events", "invalidate:42") == 101
+        for subscription in subscriptions[:-1]:
+            assert subscription.get_message(timeout=5) == [b"message", b"events", b"invalidate:42"]
+        assert patterned.get_message(timeout=5) == [b"pmessage", b"ev*", b"events", b"invalidate:42"]
+        assert client.execute("PUBSUB", "NUMSUB", "events") == [b"events", 100]
+    finally:
+        for subscription in subscriptions:
+            subscription.close()
+    wait_for(lambda: client.execute("PUBSUB", "NUMSUB", "events") == [b"events", 0])
+    client.close()
+
+
+def _exchange(sock, data, size):
+    sock.sendall(data)
+    reply = b""
+    while len(reply) < size:
+        reply += sock.recv(size - len(reply))
+    return reply
+
+
+def test_subscriber_mode_only_allows_subscription_commands(server_port):
+    with socket.create_connection(("localhost", server_port)) as sock:
+        subscribed = b"*3\r\n$9\r\nsubscribe\r\n$1\r\na\r\n:1\r\n"
+        assert _exchange(sock, b"*2\r\n$9\r\nSUBSCRIBE\r\n$1\r\na\r\n", len(subscribed)) == subscribed
+        error = b"-ERR Can't execute 'get': only (P)SUBSCRIBE / (P)UNSUBSCRIBE / PING are allowed in this context\r\n"
+        assert _exchange(sock, b"*2\r\n$3\r\nGET\r\n$1\r\nk\r\n", len(error)) == error
+        pong = b"*2\r\n$4\r\npong\r\n$0\r\n\r\n"
+        assert _exchange(sock, b"*1\r\n$4\r\nPING\r\n", len(pong)) == pong
+        unsubscribed = b"*3\r\n$11\r\nunsubscribe\r\n$1\r\na\r\n:0\r\n"
+        assert _exchange(sock, b"*1\r\n$11\r\nUNSUBSCRIBE\r\n", len(unsubscribed)) == unsubscribed
+        # back to a normal connection
+        assert _exchange(sock, b"*1\r\n$4\r\nPING\r\n", 7) == b"+PONG\r\n"
+
+
+def test_slow_subscriber_is_disconnected(server_port, monkeypatch):
+    monkeypatch.setattr(server_module, "PUBSUB_OUTPUT_BUFFER_LIMIT", 256 * 1024)
+    client = redis_client.Client("localhost", server_port)
+    slow = socket.socket()
+    slow.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+    slow.connect(("localhost", server_port))
+    slow.sendall(b"*2\r\n$9\r\nSUBSCRIBE\r\n$4\r\nbulk\r\n")
+    wait_for(lambda: client.execute("PUBSUB", "NUMSUB", "bulk") == [b"bulk", 1])
+    payload = b"x" * 64 * 1024
+    start = time.monotonic()
+    # the slow subscriber never reads; publishing must not wait for it
+    for _ in range(200):
+        client.execute("PUBLISH", "bulk", payload)
+    assert time.monotonic() - start < 5
+    wait_for(lambda: client.execute("PUBSUB", "NUMSUB", "bulk") == [b"bulk", 0])
+    slow.close()
+    client.close()
+
+
+def test_lagging_subscriber_under_the_limit_gets_every_message(server_port):
+    client = redis_client.Client("localhost", server_port)
+    with client.subscription() as subscription:
+        subscription.subscribe("bulk")
+        assert subscription.get_message(timeout=5) == [b"subscribe", b"bulk", 1]
+        payloads = [b"%d:" % i + b"x" * 32 * 1024 for i in range(64)]
+        for payload in payloads:
+            assert client.execute("PUBLISH", "bulk", payload) == 1
+        for payload in payloads:
+            assert subscription.get_message(timeout=5) == [b"message", b"bulk", payload]
+    client.close()
+
+
+def test_subscribe_confirmation_arrives_before_messages(monkeypatch):
+    # publishes from another connection right after the channel was
+    # registered but before the SUBSCRIBE reply was written
+    subscribed, published = threading.Event(), threading.Event()
+    execute = server_module.execute_buffered_commands
+
+    def execute_then_wait(parser, datastore, persister, router=None, client=None):
+        result = execute(parser, datastore, persister, router, client)
+        if client.channels and not subscribed.is_set():
+            subscribed.set()
+            published.wait(5)
+        return result
+
+    monkeypatch.setattr(server_module, "execute_buffered_commands", execute_then_wait)
+    port = free_port()
+    server = Server(port, DataStore(), None)
+    threading.Thread(target=server.run, daemon=True).start()
+    client = redis_client.Client("localhost", port)
+    wait_for(lambda: _ping(client))
+
+    def publish():
+        subscribed.wait(5)
+        client.execute("PUBLISH", "news", "early")
+        published.set()
+
+    publisher = threading.Thread(target=publish)
+    publisher.start()
+    with redis_client.Client("localhost", port).subscription() as subscription:
+        subscription.subscribe("news")
+        assert subscription.get_message(timeout=5) == [b"subscribe", b"news", 1]
+        assert subscription.get_message(timeout=5) == [b"message", b"news", b"early"]
+    publisher.join()
+    client.close()
+    server.stop()
@@ -0,0 +1,183 @@
+import threading
+import pytest
+from src import client as redis_client
+from src import replication
+from src.datastore import DataStore
+from src.persistence import AppendOnlyPersister, restore_db
+from src.replication import READONLY_ERROR, Replication
+from src.server import AsyncServer
+from tests.helpers import free_port, wait_for
+
+
+class Node:
+    def __init__(self, directory, name):
+        self.port = free_port()
+        self.datastore = DataStore()
+        self.persister = AppendOnlyPersister(
+            str(directory / f"{name}.aof"), datastore=self.datastore, snapshot_filename=str(directory / f"{name}.rdb")
+        )
+        self.server = AsyncServer(self.port, self.datastore, self.persister)
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+        self.thread.start()
+        self.client = redis_client.Client("localhost", self.port)
+        wait_for(self._ready)
+
+    def _ready(self):
+        try:
+            return self.client.execute("PING") == "PONG"
+        except ConnectionRefusedError:
+            return False
+
+    def info(self):
+        text = self.client.execute("INFO", "replication").decode()
+        return dict(line.split(":", 1) for line in text.splitlines() if ":" in line)
+
+    def stop(self):
+        self.client.close()
+        self.server.stop()
+        self.thread.join(timeout=5)
+        self.persister.close()
+
+
+@pytest.fixture
+def nodes(tmp_path, monkeypatch):
+    monkeypatch.setattr(replication, "RECONNECT_INTERVAL", 0.05)
+    primary, replica = Node(tmp_path, "primary"), Node(tmp_path, "replica")
+    yield primary, replica
+    replica.stop()
+    primary.stop()
+
+
+def _start_replication(primary, replica):
+    assert replica.client.execute("REPLICAOF", "localhost", primary.port) == "OK"
+    wait_for(lambda: replica.info()["master_link_status"] == "up")
+
+
+def test_full_sync_then_streamed_writes(nodes):
+    primary, replica = nodes
+    primary.client.execute("SET", "before", "1")
+    primary.client.execute("RPUSH", "list", "a", "b")
+    primary.client.execute("SET", "ttl", "x", "EX", "100")
+    _start_replication(primary, replica)
+    assert replica.client.execute("GET", "before") == b"1"
+    assert replica.client.execute("LRANGE", "list", "0", "2") == [b"a", b"b"]
+    assert 0 < replica.client.execute("TTL", "ttl") <= 100
+
+    primary.client.execute("SET", "after", "2")
+    primary.client.execute("INCR", "counter")
+    primary.client.execute("DEL", "before")
+    wait_for(lambda: replica.client.execute("GET", "counter") == b"1")
+    assert replica.client.execute("GET", "after") == b"2"
+    assert replica.client.execute("EXISTS", "before") == 0
+
+    primary_info, replica_info = primary.info(), replica.info()
+    assert primary_info["role"] == "master"
+    assert primary_info["connected_slaves"] == "1"
+    assert replica_info["role"] == "slave"
+    assert replica_info["master_port"] == str(primary.port)
+    assert replica_info["slave_repl_offset"] == primary_info["master_repl_offset"]
+
+
+def test_full_sync_waits_for_a_running_rewrite_before_rewriting_the_aof(nodes, tmp_path):
+    primary, replica = nodes
+    primary.client.execute("SET", "synced", "1")
+    replica.client.execute("SET", "stale", "1")
+    # a rewrite of the replica's old dataset is still running when the sync loads
+    release, waited = threading.Event(), threading.Event()
+    rewrite, wait_for_rewrite = replica.persister._rewrite, replica.persister.wait_for_rewrite
+    replica.persister._rewrite = lambda entries: (release.wait(), rewrite(entries))
+    replica.persister.wait_for_rewrite = lambda: (waited.set(), wait_for_rewrite())
+    assert replica.client.execute("BGREWRITEAOF") is not None
+    assert replica.client.execute("REPLICAOF", "localhost", primary.port) == "OK"
+    assert waited.wait(5)
+    release.set()
+    wait_for(lambda: replica.info()["master_link_status"] == "up")
+    wait_for(lambda: not replica.persister.rewrite_in_progress())
+    replica.persister.flush(fsync=True)
+
+    restored = DataStore()
+    assert restore_db(str(tmp_path / "replica.aof"), restored, str(tmp_path / "replica.rdb"))
+    assert restored[b"synced"] == b"1"
+    assert b"stale" not in restored
+
+
+@pytest.mark.parametrize("policy", ["noeviction", "allkeys-lru"])
+def test_replica_applies_every_write_despite_its_memory_limit(nodes, policy):
+    primary, replica = nodes
+    replica.datastore.set_maxmemory(4096, policy)
+    _start_replication(primary, replica)
+    for i in range(100):
+        primary.client.execute("SET", f"key:{i}", "x" * 100)
+    primary.client.execute("SET", "last", "1")
+    wait_for(lambda: replica.client.execute("GET", "last") == b"1")
+    # nothing was refused as OOM or evicted on the replica's own account
+    assert len(replica.datastore) == len(primary.datastore) == 101
+    assert replica.info()["slave_repl_offset"] == primary.info()["master_repl_offset"]
+
+
+def test_replica_rejects_writes_until_promoted(nodes):
+    primary, replica = nodes
+    primary.client.execute("SET", "key", "primary")
+    _start_replication(primary, replica)
+    with pytest.raises(redis_client.ReplyError) as error:
+        replica.client.execute("SET", "key", "replica")
+    assert str(error.value) == READONLY_ERROR
+    assert replica.client.execute("GET", "key") == b"primary"
+
+    assert replica.client.execute("REPLICAOF", "NO", "ONE") == "OK"
+    assert replica.info()["role"] == "master"
+    assert replica.client.execute("SET", "key", "replica") == "OK"
+    assert replica.client.execute("GET", "key") == b"replica"
+    # the former primary carries on alone
+    wait_for(lambda: primary.info()["connected_slaves"] == "0")
+    primary.client.execute("SET", "other", "1")
+    assert replica.client.execute("EXISTS", "other") == 0
+
+
+def test_partial_resync_after_disconnect(nodes):
+    primary, replica = nodes
+    primary.client.execute("SET", "a", "1")
+    _start_replication(primary, replica)
+    link = replica.persister.replication._link
+    loads = []
+    load = link._load
+    link._load = lambda entries: (loads.append(entries), load(entries))
+
+    # drop every replica connection on the primary's side
+    for connection in primary.persister.replication._replicas:
+        connection.close()
+    primary.client.execute("SET", "b", "2")
+    wait_for(lambda: replica.client.execute("GET", "b") == b"2")
+    assert replica.client.execute("GET", "a") == b"1"
+    assert loads == []
+
+
+def test_backlog_decides_between_partial_and_full_resync():
+    repl = Replication(backlog_size=16)
+    datastore = DataStore()
+    _, reply = repl.sync("?", -1, datastore, ("127.0.0.1", 1))
+    assert reply == f"FULLRESYNC {repl.replid} 0"
+
+    repl.feed(b"x" * 10)
+    _, reply = repl.sync(repl.replid, 0, datastore, ("127.0.0.1", 2))
+    assert reply == f"CONTINUE {repl.replid}"
+    repl.feed(b"y" * 30)
+    assert repl.offset == 40
+    # trimmed back to the backlog size, so offset 0 is gone
+    _, reply = repl.sync(repl.replid, 0, datastore, ("127.0.0.1", 3))
+    assert reply == f"FULLRESYNC {repl.replid} 40"
+    _, reply = repl.sync(repl.replid, 30, datastore, ("127.0.0.1", 4))
+    assert reply == f"CONTINUE {repl.replid}"
+    _, reply = repl.sync("another-id", 40, datastore, ("127.0.0.1", 5))
+    assert reply.startswith("FULLRESYNC")
+
+
+def test_slow_replica_is_dropped(monkeypatch):
+    monkeypatch.setattr(replication, "REPLICA_OUTPUT_BUFFER_LIMIT", 100)
+    repl = Replication()
+    replica, _ = repl.sync("?", -1, DataStore(), ("127.0.0.1", 1))
+    repl.feed(b"x" * 60)
+    assert repl.info()[1] == ("connected_slaves", 1)
+    repl.feed(b"x" * 60)
+    assert replica.closed
+    assert ("connected_slaves", 0) in repl.info()
@@ -0,0 +1,77 @@
+import threading
+import time
+import pytest
+from src.datastore import DataStore
+from src.server import AsyncServer, Server
+from tests.helpers import connect, free_port, recv_exactly
+
+
+@pytest.fixture
+def async_server():
+    port = free_port()
+    server = AsyncServer(port, DataStore(), None)
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    yield port
+    server.stop()
+    thread.join(timeout=5)
+
+
+@pytest.fixture
+def threaded_server():
+    port = free_port()
+    server = Server(port, DataStore(), None)
+    threading.Thread(target=server.run, daemon=True).start()
+    yield port
+    server.stop()
+
+
+def test_async_server_set_get(async_server):
+    with connect(async_server) as client:
+        client.sendall(b"*3\r\n$3\r\nSET\r\n$1\r\nk\r\n$1\r\nv\r\n")
+        assert recv_exactly(client, 5) == b"+OK\r\n"
+        client.sendall(b"*2\r\n$3\r\nGET\r\n$1\r\nk\r\n")
+        assert recv_exactly(client, 7) == b"$1\r\nv\r\n"
+
+
+def test_async_server_many_connections(async_server):
+    clients = [connect(async_server) for _ in range(100)]
+    try:
+        for client in clients:
+            client.sendall(b"*1\r\n$4\r\nPING\r\n")
+        for client in clients:
+            assert recv_exactly(client, 7) == b"+PONG\r\n"
+    finally:
+        for client in clients:
+            client.close()
+
+
+@pytest.mark.parametrize("server_fixture", ["threaded_server", "async_server"])
+def test_pipelined_commands(server_fixture, request):
+    port = request.getfixturevalue(server_fixture)
+    pipeline = b"".join(
+        b"*2\r\n$4\r\nINCR\r\n$7\r\ncounter\r\n" for _ in range(16)
+    )
+    expected = b"".join(f":{i}\r\n".encode() for i in range(1, 17))
+    with connect(port) as client:
+        # split mid-frame to make sure partial frames are kept for the next read
+        client.sendall(pipeline[:50])
+        time.sleep(0.05)
+        client.sendall(pipeline[50:])
+        assert recv_exactly(client, len(expected)) == expected
+
+
+@pytest.mark.parametrize("server_fixture", ["threaded_server", "async_server"])
+@pytest.mark.parametrize(
+    "request_bytes",
+    [b"*1\r\n:5\r\n", b"*1\r\n$-1\r\n", b"*2\r\n$3\r\nGET\r\n*1\r\n$1\r\nk\r\n", b"+PING\r\n"],
+)
+def test_malformed_commands_are_rejected(server_fixture, request_bytes, request):
+    port = request.getfixturevalue(server_fixture)
+    with connect(port) as client:
+        client.sendall(request_bytes + b"*1\r\n$4\r\nPING\r\n")
+        reply = b"-ERR Protocol error: expected bulk string\r\n"
+        assert recv_exactly(client, len(reply) + 1) == reply
+    with connect(port) as client:
+        client.sendall(b"*1\r\n$4\r\nPING\r\n")
+        assert recv_exactly(client, 7) == b"+PONG\r\n"
@@ -0,0 +1,119 @@
+from time import time_ns
+import pytest
+from src.command_handler import handle_command
+from src.datastore import DataStore
+from src.persistence import AppendOnlyPersister, restore_db
+from src.snapshot import SnapshotError, load_snapshot, read_snapshot, save_snapshot
+from src.types import BulkString, SimpleString
+from tests.helpers import bulk_command
+
+
+def test_snapshot_round_trip(tmp_path):
+    filename = tmp_path / "dump.rdb"
+    expiry = time_ns() + 100 * 10**9
+    entries = [
+        (b"string", b"value", 0),
+        (b"binary\x00key", bytes(range(256)), 0),
+        (b"expiring", b"soon", expiry),
+        (b"list", [b"a", b"", b"c"], expiry),
+    ]
+    save_snapshot(filename, entries)
+    datastore = DataStore()
+    assert load_snapshot(filename, datastore) == 4
+    assert sorted(datastore.snapshot()) == sorted(entries)
+
+
+def test_snapshot_skips_expired_keys(tmp_path):
+    filename = tmp_path / "dump.rdb"
+    save_snapshot(filename, [(b"old", b"v", time_ns() - 1), (b"new", b"v", 0)])
+    datastore = DataStore()
+    load_snapshot(filename, datastore)
+    assert datastore.snapshot() == [(b"new", b"v", 0)]
+
+
+def test_snapshot_detects_corruption(tmp_path):
+    filename = tmp_path / "dump.rdb"
+    save_snapshot(filename, [(b"key", b"value", 0)])
+    data = bytearray(filename.read_bytes())
+    data[12] ^= 0xFF
+    with pytest.raises(SnapshotError):
+        read_snapshot(bytes(data))
+    with pytest.raises(SnapshotError):
+        read_snapshot(bytes(data[:-6]))
+
+
+def test_save_command_and_restore_from_snapshot(tmp_path):
+    aof_filename = tmp_path / "test.aof"
+    snapshot_filename = tmp_path / "dump.rdb"
+    datastore = DataStore()
+    persister = AppendOnlyPersister(aof_filename, "always", datastore, snapshot_filename)
+    handle_command(bulk_command(b"set", b"k", b"v"), datastore, persister)
+    handle_command(bulk_command(b"rpush", b"l", b"1", b"2"), datastore, persister)
+    assert handle_command(bulk_command(b"save"), datastore, persister) == SimpleString("OK")
+    persister.close()
+
+    aof_filename.write_bytes(b"")
+    restored = DataStore()
+    assert restore_db(aof_filename, restored, snapshot_filename)
+    assert restored[b"k"] == b"v"
+    assert restored.lrange(b"l", 0, 2) == [b"1", b"2"]
+
+
+def test_snapshot_round_trips_hashes(tmp_path):
+    filename = tmp_path / "dump.rdb"
+    datastore = DataStore()
+    handle_command(bulk_command(b"hset", b"small", b"f1", b"v1", b"f2", b"v2"), datastore)
+    big_fields = [arg for i in range(200) for arg in (b"f%d" % i, b"v%d" % i)]
+    handle_command(bulk_command(b"hset", b"big", *big_fields), datastore)
+    save_snapshot(filename, datastore.snapshot())
+
+    loaded = DataStore()
+    assert load_snapshot(filename, loaded) == 2
+    assert sorted(loaded.snapshot()) == sorted(datastore.snapshot())
+    entries = dict((key, value) for key, value, _ in loaded.snapshot())
+    assert entries[b"small"].is_compact and not entries[b"big"].is_compact
+    assert handle_command(bulk_command(b"hget", b"big", b"f150"), loaded) == BulkString(b"v150")
+
+
+def test_snapshot_round_trips_sorted_sets(tmp_path):
+    filename = tmp_path / "dump.rdb"
+    datastore = DataStore()
+    handle_command(bulk_command(b"zadd", b"z", b"2", b"b", b"-1.5", b"a", b"inf", b"c"), datastore)
+    save_snapshot(filename, datastore.snapshot())
+    loaded = DataStore()
+    load_snapshot(filename, loaded)
+    assert loaded.snapshot() == datastore.snapshot()
+    result = handle_command(bulk_command(b"zrange", b"z", b"0", b"-1", b"withscores"), loaded)
+    assert result == bulk_command(b"a", b"-1.5", b"b", b"2", b"c", b"inf")
+
+
+def test_snapshot_round_trips_sets(tmp_path):
+    filename = tmp_path / "dump.rdb"
+    datastore = DataStore()
+    handle_command(bulk_command(b"sadd", b"ids", b"1", b"-5", b"100"), datastore)
+    handle_command(bulk_command(b"sadd", b"tags", b"red", b"blue"), datastore)
+    save_snapshot(filename, datastore.snapshot())
+    loaded = DataStore()
+    load_snapshot(filename, loaded)
+    assert sorted(loaded.snapshot()) == sorted(datastore.snapshot())
+    entries = {key: value for key, value, _ in loaded.snapshot()}
+    assert entries[b"ids"].is_intset
+
+
+def test_snapshot_keys_survive_restarts_after_new_writes(tmp_path):
+    aof_filename = tmp_path / "test.aof"
+    snapshot_filename = tmp_path / "dump.rdb"
+    save_snapshot(snapshot_filename, [(b"from_snapshot", b"1", 0)])
+
+    # first restart: no AOF yet, the snapshot is loaded and a write follows
+    datastore = DataStore()
+    assert restore_db(aof_filename, datastore, snapshot_filename)
+    persister = AppendOnlyPersister(aof_filename, "always", datastore, snapshot_filename)
+    handle_command(bulk_command(b"set", b"after_restart", b"2"), datastore, persister)
+    persister.close()
+
+    # second restart replays the now non-empty AOF
+    restored = DataStore()
+    assert restore_db(aof_filename, restored, snapshot_filename)
+    assert restored[b"from_snapshot"] == b"1"
+    assert restored[b"after_restart"] == b"2"
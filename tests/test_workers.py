@@ -0,0 +1,143 @@
+import os
+import socket
+import threading
+import pytest
+from src.command_handler import handle_command
+from src.datastore import DataStore
+from src.hashslot import key_hash_slot
+from src.protocol_handler import encode_message
+from src.server import AsyncServer
+from src.types import Error, Integer, SimpleString
+from src.workers import WorkerRouter, serve_worker_socket, worker_for_key, worker_socket_path
+from tests.helpers import bulk_command, connect, free_port, recv_exactly
+
+
+@pytest.mark.parametrize(
+    "key, slot",
+    [
+        (b"123456789", 0x31C3 % 16384),
+        (b"foo", 12182),
+        (b"{user1000}.following", key_hash_slot(b"user1000")),
+        (b"foo{}{bar}", key_hash_slot(b"foo{}{bar}")),
+        (b"foo{{bar}}zap", key_hash_slot(b"{bar")),
+    ],
+)
+def test_key_hash_slot(key, slot):
+    assert key_hash_slot(key) == slot
+
+
+@pytest.fixture
+def workers():
+    port = os.getpid()
+    paths = [worker_socket_path(port, i) for i in range(2)]
+    datastores = [DataStore(), DataStore()]
+    sockets = [serve_worker_socket(path, datastore, None) for path, datastore in zip(paths, datastores)]
+    yield paths, datastores
+    for sock, path in zip(sockets, paths):
+        sock.close()
+        os.remove(path)
+
+
+def _key_for_worker(worker_id):
+    return next(b"key:%d" % i for i in range(100) if worker_for_key(b"key:%d" % i, 2) == worker_id)
+
+
+def test_router_forwards_foreign_keys(workers):
+    paths, datastores = workers
+    router = WorkerRouter(0, paths)
+    local_key, foreign_key = _key_for_worker(0), _key_for_worker(1)
+
+    assert router.route(bulk_command(b"set", local_key, b"v")) is None
+    assert router.route(bulk_command(b"set", foreign_key, b"v")) == SimpleString("OK")
+    assert datastores[1][foreign_key] == b"v"
+    assert router.route(bulk_command(b"incr", foreign_key)) == Error(
+        "ERR value is not an integer or out of range"
+    )
+    assert router.route(bulk_command(b"ping")) is None
+
+
+def test_router_rejects_cross_worker_commands(workers):
+    paths, _ = workers
+    router = WorkerRouter(0, paths)
+    result = router.route(bulk_command(b"del", _key_for_worker(0), _key_for_worker(1)))
+    assert result.data.startswith("CROSSSLOT")
+    assert router.route(bulk_command(b"del", b"{tag}a", b"{tag}b")) in (None, Integer(0))
+
+
+def _fake_worker(path, reply, release=None):
+    # a worker that answers every command with reply, once release is set;
+    # returns the list the commands it receives are appended to
+    received = []
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(path)
+    listener.listen()
+
+    def serve():
+        with listener:
+            connection, _ = listener.accept()
+            with connection:
+                while True:
+                    data = connection.recv(4096)
+                    if not data:
+                        return
+                    received.append(data)
+                    if release is not None:
+                        release.wait(5)
+                    if reply is None:
+                        return
+                    connection.sendall(reply)
+
+    threading.Thread(target=serve, daemon=True).start()
+    return received
+
+
+@pytest.fixture
+def fake_worker_path():
+    path = worker_socket_path(os.getpid(), 1)
+    yield path
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def test_router_does_not_resend_after_the_worker_dropped_the_connection(fake_worker_path):
+    received = _fake_worker(fake_worker_path, None)
+    router = WorkerRouter(0, [None, fake_worker_path])
+    result = router.route(bulk_command(b"incr", _key_for_worker(1)))
+    assert isinstance(result, Error)
+    assert len(received) == 1
+
+
+def test_router_reconnects_when_the_worker_closed_an_idle_connection(workers):
+    paths, datastores = workers
+    router = WorkerRouter(0, paths)
+    key = _key_for_worker(1)
+    assert router.route(bulk_command(b"set", key, b"1")) == SimpleString("OK")
+    sock, _ = router._connections()[1]
+    sock.shutdown(socket.SHUT_RDWR)
+    assert router.route(bulk_command(b"incr", key)) == Integer(2)
+    assert datastores[1][key] == b"2"
+
+
+def test_async_engine_forwards_off_the_event_loop(fake_worker_path):
+    release = threading.Event()
+    _fake_worker(fake_worker_path, b"+OK\r\n", release)
+    port = free_port()
+    server = AsyncServer(port, DataStore(), None, WorkerRouter(0, [None, fake_worker_path]))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    try:
+        with connect(port) as forwarding, connect(port) as other:
+            forwarding.sendall(
+                encode_message(bulk_command(b"set", _key_for_worker(1), b"v"))
+                + encode_message(bulk_command(b"set", _key_for_worker(0), b"v"))
+            )
+            # the loop keeps serving other connections while the forward waits
+            other.settimeout(2)
+            other.sendall(encode_message(bulk_command(b"ping")))
+            assert recv_exactly(other, 7) == b"+PONG\r\n"
+            release.set()
+            assert recv_exactly(forwarding, 10) == b"+OK\r\n+OK\r\n"
+    finally:
+        release.set()
+        server.stop()
+        thread.join(timeout=5)